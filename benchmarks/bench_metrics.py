@@ -0,0 +1,206 @@
+"""
+Микро-замеры этапа расчета метрик на синтетических трансферах (synthetic_transfers.py).
+
+Для каждого размера набора в отдельном процессе замеряются этапы:
+    generate        — генерация набора в TransferStore (для справки);
+    parse           — разбор ответов Etherscan (словарей) в колонки хранилища (только до --parse-limit строк);
+    per_address     — calculate_period_metrics на выборке адресов (старый путь, экстраполируется на все кошельки);
+    metrics_<имя>   — aggregate-движки из METRICS_BACKENDS на колонках из хранилища;
+    metrics_sharded_w<N> — режим "sharded" на N процессах для каждого N из --workers (масштабирование по ядрам;
+                      время включает запуск процессов, ускорение сравнивается с metrics_pandas);
+    counterparties  — подсчет уникальных контрагентов отдельно (множества в Python и nunique в pandas);
+    csv_export      — build_wallet_metrics и запись CSV.
+По каждому этапу выводится время, пропускная способность, прирост пикового RSS и память Arrow;
+с --trace-memory дополнительно пик аллокаций Python (tracemalloc, время при этом завышено).
+
+Запуск: python benchmarks/bench_metrics.py --sizes 10000,1000000,10000000
+        python benchmarks/bench_metrics.py --sizes 1000000 --backends pandas --workers 1,2,4,8
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from bench_pipeline import REPO_DIR, peak_rss_mb
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULT_PREFIX = "BENCH_RESULT "
+
+
+class StageTimer:
+    """Замер этапов: время, пиковый RSS процесса после этапа, пик памяти Arrow и (опционально) tracemalloc."""
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+    def run(self, name, func, items=None, wallets=None):
+        import pyarrow as pa
+
+        rss_before = peak_rss_mb()
+        arrow_before = pa.total_allocated_bytes()
+        if self.trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        stage = {"seconds": elapsed, "peak_rss_mb": peak_rss_mb(), "rss_growth_mb": peak_rss_mb() - rss_before,
+                 "arrow_mb": (pa.total_allocated_bytes() - arrow_before) / 2 ** 20}
+        if self.trace_memory:
+            stage["python_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+        if items is not None:
+            stage["transfers_per_s"] = items / elapsed
+        if wallets is not None:
+            stage["wallets_per_s"] = wallets / elapsed
+        self.stages[name] = stage
+        return result
+
+
+def counterparties_python(transfers):
+    """Уникальные контрагенты через множества на каждый адрес (как в _aggregate_transfer_rows)."""
+    counterparties = {}
+    for sender, receiver in zip(transfers.column("from_id").to_pylist(), transfers.column("to_id").to_pylist()):
+        if sender != receiver:
+            counterparties.setdefault(sender, set()).add(receiver)
+            counterparties.setdefault(receiver, set()).add(sender)
+    return {address: len(peers) for address, peers in counterparties.items()}
+
+
+def counterparties_pandas(transfers):
+    """Уникальные контрагенты через groupby().nunique() по ногам трансферов (как в aggregate_period_metrics_vectorized)."""
+    import pandas as pd
+
+    frame = transfers.select(["from_id", "to_id"]).to_pandas()
+    frame = frame[frame["from_id"] != frame["to_id"]]
+    legs = pd.DataFrame({
+        "address": pd.concat([frame["from_id"], frame["to_id"]], ignore_index=True),
+        "counterparty": pd.concat([frame["to_id"], frame["from_id"]], ignore_index=True),
+    })
+    return legs.groupby("address")["counterparty"].nunique()
+
+
+def run_child(args):
+    data_dir = tempfile.mkdtemp(prefix="bench_metrics_")
+    os.environ.update(ETHERSCAN_API_KEY="bench", ETHERSCAN_DATA_DIR=data_dir, ETHERSCAN_CACHE_MODE="off")
+    sys.path.insert(0, REPO_DIR)
+    import data_fetch
+    import synthetic_transfers
+
+    # Замеряется только расчет: баланс для calculate_period_metrics не запрашивается из сети
+    data_fetch.fetch_token_balance = lambda address, contract_address: 0
+    timer = StageTimer(args.trace_memory)
+    contract = synthetic_transfers.SYNTHETIC_CONTRACT
+    end_ts = int(time.time())
+    start_dt = datetime.fromtimestamp(end_ts - args.days * 86400)
+    end_dt = datetime.fromtimestamp(end_ts)
+    options = {"days": args.days, "end_ts": end_ts, "seed": args.seed}
+
+    n_wallets = timer.run("generate", lambda: synthetic_transfers.write_synthetic_store(
+        data_fetch.TRANSFER_STORE, contract, args.size, **options), items=args.size)
+    transfers = data_fetch.TRANSFER_STORE.read_columns(contract)
+
+    if args.size <= args.parse_limit:
+        transactions = synthetic_transfers.generate_transactions(args.size, **options)
+        timer.run("parse", lambda: data_fetch.TRANSFER_STORE._to_table(transactions), items=args.size)
+        sample = [synthetic_transfers.wallet_address(index) for index in range(1, min(args.per_address_sample, n_wallets) + 1)]
+        timer.run("per_address", lambda: [
+            data_fetch.calculate_period_metrics(address, transactions, 18, start_dt, end_dt, contract) for address in sample
+        ], wallets=len(sample))
+        del transactions
+
+    metrics = None
+    for backend in args.backends:
+        metrics = timer.run(f"metrics_{backend}", lambda: data_fetch.METRICS_BACKENDS[backend](transfers, 18, start_dt, end_dt),
+                            items=args.size, wallets=n_wallets)
+    for workers in args.workers:
+        metrics = timer.run(f"metrics_sharded_w{workers}", lambda: data_fetch.aggregate_period_metrics_sharded(
+            transfers, 18, start_dt, end_dt, workers=workers), items=args.size, wallets=n_wallets)
+    timer.run("counterparties_python", lambda: counterparties_python(transfers), items=args.size)
+    timer.run("counterparties_pandas", lambda: counterparties_pandas(transfers), items=args.size)
+
+    if metrics is not None:
+        csv_path = os.path.join(data_dir, "wallets.csv")
+
+        def export_csv():
+            import pandas as pd
+            rows = [data_fetch.build_wallet_metrics(address, metrics, 18, raw_balance=0) for address in metrics]
+            pd.DataFrame(rows).to_csv(csv_path, index=False, date_format='%Y-%m-%d %H:%M:%S', float_format='%.8f')
+
+        timer.run("csv_export", export_csv, wallets=len(metrics))
+
+    print(RESULT_PREFIX + json.dumps({"wallets": n_wallets, "stages": timer.stages}), flush=True)
+
+
+def run_size(size, args):
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--size", str(size), "--days", str(args.days),
+               "--seed", str(args.seed), "--backends", ",".join(args.backends), "--parse-limit", str(args.parse_limit),
+               "--per-address-sample", str(args.per_address_sample), "--workers", ",".join(map(str, args.workers))]
+    if args.trace_memory:
+        command.append("--trace-memory")
+    child = subprocess.run(command, stdout=subprocess.PIPE, stderr=None if args.verbose else subprocess.DEVNULL, text=True)
+    for line in child.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"Замер для {size} трансферов завершился без результата (код {child.returncode})")
+
+
+def print_report(results):
+    nan = float("nan")
+    print(f"\n{'трансферов':>11} {'этап':<22} {'сек':>9} {'трансф./с':>11} {'кошел./с':>10} "
+          f"{'RSS +МБ':>8} {'пик RSS':>8} {'Arrow МБ':>9} {'Python МБ':>10}")
+    for size, result in results.items():
+        for stage, values in result["stages"].items():
+            print(f"{size:>11} {stage:<22} {values['seconds']:>9.3f} {values.get('transfers_per_s', nan):>11.0f} "
+                  f"{values.get('wallets_per_s', nan):>10.0f} {values['rss_growth_mb']:>8.1f} {values['peak_rss_mb']:>8.1f} "
+                  f"{values['arrow_mb']:>9.1f} {values.get('python_peak_mb', nan):>10.1f}")
+        print(f"{'':>11} кошельков: {result['wallets']}")
+        baseline = result["stages"].get("metrics_pandas")
+        scaling = [(stage[len("metrics_sharded_w"):], values["seconds"]) for stage, values in result["stages"].items()
+                   if stage.startswith("metrics_sharded_w")]
+        if baseline and scaling:
+            print(f"{'':>11} ускорение относительно metrics_pandas: " +
+                  ", ".join(f"{workers} проц. x{baseline['seconds'] / seconds:.2f}" for workers, seconds in scaling))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Микро-замеры расчета метрик на синтетических трансферах.")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="размеры наборов через запятую (до 50 млн)")
+    parser.add_argument("--days", type=int, default=15)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backends", default="python,pandas,sharded", help="движки из METRICS_BACKENDS")
+    parser.add_argument("--parse-limit", type=int, default=1_000_000, help="до какого размера замерять разбор словарей Etherscan")
+    parser.add_argument("--per-address-sample", type=int, default=20, help="сколько адресов считать через calculate_period_metrics")
+    parser.add_argument("--workers", default="", help="числа процессов для режима sharded через запятую, например 1,2,4")
+    parser.add_argument("--trace-memory", action="store_true", help="пик аллокаций Python через tracemalloc")
+    parser.add_argument("--json", help="сохранить результаты в JSON файл")
+    parser.add_argument("--verbose", action="store_true", help="показывать вывод процессов замера")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    args.backends = [backend for backend in args.backends.split(",") if backend]
+    args.workers = [int(workers) for workers in args.workers.split(",") if workers]
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.child:
+        run_child(args)
+        sys.exit(0)
+
+    results = {}
+    for size in args.sizes.split(","):
+        print(f"Замер: {int(size)} трансферов...", flush=True)
+        results[size] = run_size(int(size), args)
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": {key: value for key, value in vars(args).items() if key not in ("child", "size")},
+                       "results": results}, f, indent=2)
+        print(f"\nРезультаты сохранены в {args.json}")
@@ -0,0 +1,165 @@
+"""
+Сквозной замер пропускной способности конвейера на локальной замене Etherscan (fake_etherscan.py).
+
+Для каждого размера данных (среднее число трансферов на блок) запускается отдельный сервер и отдельный процесс
+замера, чтобы пиковая память (peak RSS) относилась только к одному размеру. Замеряются этапы:
+fetch (fetch_transactions_daily_chunks в колоночное хранилище), metrics (каждый из METRICS_BACKENDS)
+и balances (EtherscanBalanceProvider). Отчет: запросы/с, трансферы/с, кошельки/с и peak RSS после этапа.
+
+Запуск: python benchmarks/bench_pipeline.py --sizes 0.2,1,4 --days 2 --latency-ms 30 --json bench.json
+Масштабирование по ключам: --api-keys 3 --rps 5 --max-rps-per-key 5 (сервер ограничивает каждый ключ отдельно).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+FAKE_CONTRACT = "0x00000000000000000000000000000000000fa4e0"
+RESULT_PREFIX = "BENCH_RESULT "
+
+
+def peak_rss_mb():
+    """data_fetch.peak_rss_mb для процесса замера; NaN там, где пиковый RSS недоступен (Windows)."""
+    import data_fetch # Только в процессе замера: окружение (ETHERSCAN_*) к этому моменту уже задано
+
+    peak = data_fetch.peak_rss_mb()
+    return float("nan") if peak is None else peak
+
+
+def server_stats(url):
+    with urllib.request.urlopen(url.rsplit("/", 1)[0] + "/stats") as response:
+        return json.load(response)
+
+
+def run_child(args):
+    """Замер одного размера данных; вызывается в отдельном процессе с уже запущенным сервером."""
+    data_dir = tempfile.mkdtemp(prefix="bench_data_")
+    os.environ.update(ETHERSCAN_API_KEY="bench", ETHERSCAN_DATA_DIR=data_dir, ETHERSCAN_CACHE_MODE="off")
+    sys.path.insert(0, REPO_DIR)
+    import data_fetch
+
+    data_fetch.CLIENT.url = args.url
+    data_fetch.CLIENT.keys = data_fetch.ApiKeyPool([f"bench{index}" for index in range(args.api_keys)], args.rps)
+    end_dt = datetime.now()
+    start_dt = end_dt - timedelta(days=args.days - 1)
+    stages = {}
+
+    stats_before = server_stats(args.url)
+    started = time.perf_counter()
+    transfers, addresses, _ = data_fetch.fetch_transactions_daily_chunks(
+        FAKE_CONTRACT, start_dt, end_dt, store=data_fetch.TRANSFER_STORE
+    )
+    elapsed = time.perf_counter() - started
+    requests_made = server_stats(args.url)["requests"] - stats_before["requests"]
+    stages["fetch"] = {
+        "seconds": elapsed, "requests": requests_made, "requests_per_s": requests_made / elapsed,
+        "transfers": transfers.num_rows, "transfers_per_s": transfers.num_rows / elapsed, "peak_rss_mb": peak_rss_mb(),
+    }
+
+    for backend in args.backends:
+        started = time.perf_counter()
+        metrics = data_fetch.METRICS_BACKENDS[backend](transfers, 18, start_dt, end_dt)
+        elapsed = time.perf_counter() - started
+        stages[f"metrics_{backend}"] = {
+            "seconds": elapsed, "transfers": transfers.num_rows, "transfers_per_s": transfers.num_rows / elapsed,
+            "wallets": len(metrics), "wallets_per_s": len(metrics) / elapsed, "peak_rss_mb": peak_rss_mb(),
+        }
+
+    wallets = addresses[:args.balance_wallets]
+    if wallets:
+        stats_before = server_stats(args.url)
+        started = time.perf_counter()
+        data_fetch.EtherscanBalanceProvider().fetch_balances(wallets, FAKE_CONTRACT, progress=False)
+        elapsed = time.perf_counter() - started
+        requests_made = server_stats(args.url)["requests"] - stats_before["requests"]
+        stages["balances"] = {
+            "seconds": elapsed, "requests": requests_made, "requests_per_s": requests_made / elapsed,
+            "wallets": len(wallets), "wallets_per_s": len(wallets) / elapsed, "peak_rss_mb": peak_rss_mb(),
+        }
+
+    print(RESULT_PREFIX + json.dumps({"stages": stages, "server": server_stats(args.url)}), flush=True)
+
+
+def run_size(transfers_per_block, args):
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "fake_etherscan.py"), "--port", "0",
+         "--transfers-per-block", str(transfers_per_block), "--chain-days", str(args.days + 1),
+         "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+         "--rate-limit-probability", str(args.rate_limit_probability),
+         "--window-error-probability", str(args.window_error_probability)]
+        + (["--max-rps-per-key", str(args.max_rps_per_key)] if args.max_rps_per_key else []),
+        stdout=subprocess.PIPE, text=True,
+    )
+    try:
+        url = server.stdout.readline().split()[-1]
+        child = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", "--url", url, "--days", str(args.days),
+             "--rps", str(args.rps), "--api-keys", str(args.api_keys), "--backends", ",".join(args.backends), "--balance-wallets", str(args.balance_wallets)],
+            stdout=subprocess.PIPE, stderr=None if args.verbose else subprocess.DEVNULL, text=True,
+        )
+    finally:
+        server.terminate()
+        server.wait()
+    for line in child.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"Замер для {transfers_per_block} трансферов/блок завершился без результата (код {child.returncode})")
+
+
+def print_report(results):
+    print(f"\n{'трансф./блок':>12} {'этап':<16} {'сек':>8} {'запр./с':>9} {'трансф./с':>11} {'кошел./с':>10} {'peak RSS, МБ':>13}")
+    for transfers_per_block, result in results.items():
+        for stage, values in result["stages"].items():
+            print(f"{transfers_per_block:>12} {stage:<16} {values['seconds']:>8.2f} "
+                  f"{values.get('requests_per_s', float('nan')):>9.1f} {values.get('transfers_per_s', float('nan')):>11.0f} "
+                  f"{values.get('wallets_per_s', float('nan')):>10.0f} {values['peak_rss_mb']:>13.1f}")
+        server = result["server"]
+        print(f"{'':>12} сервер: запросов {server['requests']}, ошибок лимита {server['rate_limited']}, "
+              f"ошибок окна 10k {server['window_errors']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Замер пропускной способности загрузки и расчета метрик на fake Etherscan.")
+    parser.add_argument("--sizes", default="0.2,1,4", help="средние числа трансферов на блок через запятую (7200 блоков в дне)")
+    parser.add_argument("--days", type=int, default=2, help="сколько дней загружать")
+    parser.add_argument("--rps", type=float, default=200, help="лимит частоты клиента на один ключ (CALLS_PER_SECOND)")
+    parser.add_argument("--api-keys", type=int, default=1, help="сколько ключей в пуле ApiKeyPool")
+    parser.add_argument("--max-rps-per-key", type=float, default=None, help="лимит сервера на один ключ (ошибка лимита сверх него)")
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0)
+    parser.add_argument("--window-error-probability", type=float, default=0.0)
+    parser.add_argument("--backends", default="python,pandas", help="бэкенды метрик из METRICS_BACKENDS")
+    parser.add_argument("--balance-wallets", type=int, default=500, help="для скольких кошельков запрашивать балансы")
+    parser.add_argument("--json", help="сохранить результаты в JSON файл")
+    parser.add_argument("--verbose", action="store_true", help="показывать вывод процессов замера")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    args.backends = [backend for backend in args.backends.split(",") if backend]
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.child:
+        run_child(args)
+        sys.exit(0)
+
+    results = {}
+    for size in args.sizes.split(","):
+        print(f"Замер: {size} трансферов на блок, {args.days} дн...", flush=True)
+        results[size] = run_size(float(size), args)
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": {key: value for key, value in vars(args).items() if key not in ("child", "url")},
+                       "results": results}, f, indent=2)
+        print(f"\nРезультаты сохранены в {args.json}")
@@ -0,0 +1,86 @@
+"""
+Проверка признаков CounterpartyGraph на небольших графах, где охват за два шага считается перебором.
+
+    hub    — хаб с --hub-size контрагентами, у которых одна общая биржа: число путей хаб -> биржа
+             не должно переполняться (в int8 при 256 контрагентах оно обнулялось, и биржа выпадала из охвата);
+    random — случайные графы: graph_degree и точный graph_two_hop_reach совпадают с перебором множеств соседей.
+Код возврата 1, если хотя бы одна проверка не прошла.
+
+Запуск: python benchmarks/check_graph.py --hub-size 256 --graphs 20
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime
+
+from bench_pipeline import REPO_DIR
+
+START_DT = datetime(2024, 1, 1)
+END_DT = datetime(2024, 1, 2)
+
+
+def transfers(edges):
+    timestamp = str(int(START_DT.timestamp()) + 60)
+    return [{"timeStamp": timestamp, "from": f"0x{sender:040x}", "to": f"0x{receiver:040x}", "value": "1"}
+            for sender, receiver in edges]
+
+
+def brute_force_reach(edges):
+    neighbors = {}
+    for sender, receiver in edges:
+        if sender != receiver:
+            neighbors.setdefault(sender, set()).add(receiver)
+            neighbors.setdefault(receiver, set()).add(sender)
+    reach = {}
+    for node, peers in neighbors.items():
+        reached = set(peers)
+        for peer in peers:
+            reached |= neighbors[peer]
+        reached.discard(node)
+        reach[f"0x{node:040x}"] = (len(peers), len(reached))
+    return reach
+
+
+def check_edges(data_fetch, name, edges):
+    features = data_fetch.counterparty_graph_features(transfers(edges), 18, START_DT, END_DT)
+    expected = brute_force_reach(edges)
+    wrong = [address for address, (degree, reach) in expected.items()
+             if features.get(address, {}).get("graph_degree") != degree
+             or features.get(address, {}).get("graph_two_hop_reach") != reach]
+    print(f"{name}: адресов {len(expected)}, расхождений {len(wrong)}")
+    for address in wrong[:5]:
+        print(f"    {address}: ожидалось {expected[address]}, получено "
+              f"{[features.get(address, {}).get(key) for key in ('graph_degree', 'graph_two_hop_reach')]}")
+    return not wrong and len(features) == len(expected)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Проверка степеней и охвата за два шага в CounterpartyGraph.")
+    parser.add_argument("--hub-size", type=int, default=256)
+    parser.add_argument("--graphs", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    os.environ.update(ETHERSCAN_API_KEY="check", ETHERSCAN_DATA_DIR=tempfile.mkdtemp(prefix="check_graph_"),
+                      ETHERSCAN_CACHE_MODE="off")
+    sys.path.insert(0, REPO_DIR)
+    import data_fetch
+
+    hub, exchange = 1, 2
+    counterparties = range(3, 3 + args.hub_size)
+    edges = [(hub, peer) for peer in counterparties] + [(peer, exchange) for peer in counterparties]
+    checks = [check_edges(data_fetch, f"hub ({args.hub_size} контрагентов с общей биржей)", edges)]
+
+    rng = random.Random(args.seed)
+    for index in range(args.graphs):
+        nodes = rng.randint(2, 60)
+        edges = [(rng.randint(1, nodes), rng.randint(1, nodes)) for _ in range(rng.randint(1, 4 * nodes))]
+        checks.append(check_edges(data_fetch, f"random #{index}", edges))
+    print("Все проверки пройдены" if all(checks) else "Есть непройденные проверки")
+    return 0 if all(checks) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
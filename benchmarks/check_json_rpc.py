@@ -0,0 +1,129 @@
+"""
+Проверка JsonRpcBalanceProvider на локальных заглушках JSON-RPC (fake_json_rpc.py) и Etherscan (fake_etherscan.py).
+
+    roundtrip — ручное ABI-кодирование data_fetch (balanceOf, Multicall3.aggregate3) сверяется с eth_abi:
+                calldata побайтно совпадает с eth_abi.encode, а ответы aggregate3, закодированные eth_abi
+                (успешные и неуспешные вызовы, returnData разной длины), декодируются без расхождений;
+    provider  — балансы batch eth_call и Multicall3 совпадают с балансами цепочки, резервный источник не вызывается;
+    fallback  — при отказах пачек (HTTP 503), пропущенных нодой адресах и некорректных адресах недостающие
+                балансы запрашиваются через Etherscan, и итог все равно совпадает с цепочкой.
+Код возврата 1, если хотя бы одна проверка не прошла.
+
+Запуск: python benchmarks/check_json_rpc.py --wallets 2000 --batch-size 100
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+from eth_abi import decode, encode
+
+import fake_etherscan
+import fake_json_rpc
+from bench_pipeline import REPO_DIR
+
+CONTRACTS = ["0x00000000000000000000000000000000000fa4e0", "0x00000000000000000000000000000000000fa4e1"]
+
+
+def check_roundtrip(data_fetch, rng, rounds):
+    failures = []
+    for _ in range(rounds):
+        calls = [(f"0x{rng.getrandbits(160):040x}", f"0x{rng.getrandbits(160):040x}") for _ in range(rng.randint(0, 20))]
+        for address, _ in calls:
+            expected = "0x70a08231" + encode(["address"], [address]).hex()
+            if data_fetch._encode_balance_of(address) != expected:
+                failures.append(f"balanceOf({address})")
+        encoded = data_fetch._encode_multicall_aggregate3(
+            [(contract, data_fetch._encode_balance_of(address)) for address, contract in calls]
+        )
+        (decoded,) = decode(["(address,bool,bytes)[]"], bytes.fromhex(encoded[10:]))
+        expected_calls = [(contract, True, bytes.fromhex(data_fetch._encode_balance_of(address)[2:]))
+                          for address, contract in calls]
+        if encoded[:10] != data_fetch.MULTICALL3_AGGREGATE3_SELECTOR or \
+                [(target.lower(), flag, data) for target, flag, data in decoded] != expected_calls or \
+                encoded[10:] != encode(["(address,bool,bytes)[]"], [expected_calls]).hex():
+            failures.append(f"aggregate3 из {len(calls)} вызовов")
+
+        results, expected_balances = [], []
+        for _ in range(len(calls)):
+            balance = rng.getrandbits(rng.choice([8, 128, 256]))
+            kind = rng.random()
+            if kind < 0.2:
+                results.append((False, b""))
+                expected_balances.append(None)
+            elif kind < 0.3:
+                results.append((True, b"\x01" * rng.randint(0, 31))) # Короче слова: баланс не прочитать
+                expected_balances.append(None)
+            elif kind < 0.4:
+                results.append((True, encode(["uint256", "uint256"], [balance, 1]))) # Лишние данные после баланса
+                expected_balances.append(balance)
+            else:
+                results.append((True, encode(["uint256"], [balance])))
+                expected_balances.append(balance)
+        if data_fetch._decode_multicall_aggregate3("0x" + encode(["(bool,bytes)[]"], [results]).hex()) != expected_balances:
+            failures.append(f"ответ aggregate3 из {len(results)} вызовов")
+    print(f"roundtrip: {rounds} наборов вызовов, расхождений: {len(failures)}")
+    for failure in failures[:10]:
+        print(f"    {failure}")
+    return not failures
+
+
+def check_provider(data_fetch, name, pairs, chain, rpc, etherscan, use_multicall, batch_size, expect_fallback):
+    rpc_before = dict(rpc.stats)
+    etherscan_before = etherscan.stats["requests"]
+    provider = data_fetch.JsonRpcBalanceProvider(rpc.url, batch_size=batch_size, use_multicall=use_multicall)
+    balances = provider.fetch_balances_multi(pairs, progress=False)
+    wrong = [pair for pair in pairs if balances.get(pair) != chain.balance(pair[0])]
+    fallback_requests = etherscan.stats["requests"] - etherscan_before
+    print(f"{name}: пар {len(pairs)}, запросов к ноде {rpc.stats['requests'] - rpc_before['requests']}, "
+          f"отказов пачек {rpc.stats['failed_batches'] - rpc_before['failed_batches']}, "
+          f"пропущено нодой {rpc.stats['dropped'] - rpc_before['dropped']}, запросов к Etherscan {fallback_requests}, "
+          f"неверных балансов {len(wrong)}")
+    return not wrong and (fallback_requests > 0) == expect_fallback
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Проверка ABI-кодирования и резервного источника JsonRpcBalanceProvider.")
+    parser.add_argument("--wallets", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=200, help="наборов вызовов в проверке roundtrip")
+    parser.add_argument("--batch-failure-probability", type=float, default=0.2)
+    parser.add_argument("--drop-probability", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    os.environ.update(ETHERSCAN_API_KEY="check", ETHERSCAN_DATA_DIR=tempfile.mkdtemp(prefix="check_rpc_"),
+                      ETHERSCAN_CACHE_MODE="off")
+    sys.path.insert(0, REPO_DIR)
+    import data_fetch
+
+    rng = random.Random(args.seed)
+    chain = fake_etherscan.SyntheticChain(seed=args.seed)
+    etherscan = fake_etherscan.FakeEtherscan(chain, seed=args.seed)
+    etherscan_server = fake_etherscan.start_server(etherscan)
+    data_fetch.CLIENT.url = f"http://127.0.0.1:{etherscan_server.server_port}/api"
+    data_fetch.CLIENT.keys = data_fetch.ApiKeyPool(["check"], 1000)
+
+    healthy = fake_json_rpc.FakeJsonRpc(chain, seed=args.seed)
+    faulty = fake_json_rpc.FakeJsonRpc(chain, batch_failure_probability=args.batch_failure_probability,
+                                       drop_probability=args.drop_probability, seed=args.seed)
+    for rpc in (healthy, faulty):
+        rpc.url = f"http://127.0.0.1:{fake_json_rpc.start_server(rpc).server_port}"
+
+    pairs = [(f"0x{rng.randrange(1, chain.addresses + 1):040x}", rng.choice(CONTRACTS)) for _ in range(args.wallets)]
+    pairs = list(dict.fromkeys(pairs))
+    broken = [("0x1234", CONTRACTS[0]), ("0x" + "zz" * 20, CONTRACTS[1])] # Некорректные адреса нода не получает
+
+    checks = [check_roundtrip(data_fetch, rng, args.rounds)]
+    for use_multicall, mode in ((False, "batch eth_call"), (True, "multicall")):
+        checks.append(check_provider(data_fetch, f"provider ({mode})", pairs, chain, healthy, etherscan,
+                                     use_multicall, args.batch_size, expect_fallback=False))
+        checks.append(check_provider(data_fetch, f"fallback ({mode})", pairs + broken, chain, faulty, etherscan,
+                                     use_multicall, args.batch_size, expect_fallback=True))
+    print("Все проверки пройдены" if all(checks) else "Есть непройденные проверки")
+    return 0 if all(checks) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+"""
+Локальная замена Etherscan API для замеров без расхода квоты.
+
+Отвечает на tokentx, getblocknobytime и tokenbalance синтетическими данными. Цепочка "живая":
+блоки идут каждые BLOCK_TIME секунд до текущего момента, трансферы блока детерминированно порождаются
+из его номера, поэтому сервер не хранит данные в памяти и одинаково отвечает на повторные запросы.
+Умеет добавлять задержку, ошибки лимита частоты (в том числе отдельно для каждого apikey) и ошибки окна 10k.
+
+Запуск: python benchmarks/fake_etherscan.py --port 8545 --transfers-per-block 2 --latency-ms 50
+Клиент: CLIENT.url = "http://127.0.0.1:8545/api"
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+BLOCK_TIME = 12
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+TOKEN_DECIMALS = 18
+MAX_RESULT_WINDOW = 10000
+
+
+class SyntheticChain:
+    """
+    Синтетическая цепочка одного токена: число трансферов блока в среднем равно transfers_per_block,
+    отдельные блоки (доля burst_probability) содержат в burst_factor раз больше трансферов.
+    Активность адресов неравномерная (степенной закон): небольшая часть кошельков делает большую часть трансферов.
+    """
+
+    def __init__(self, transfers_per_block=1.0, addresses=50000, chain_days=30, seed=0,
+                 burst_probability=0.002, burst_factor=50, mint_burn_share=0.01):
+        self.transfers_per_block = transfers_per_block
+        self.addresses = addresses
+        self.seed = seed
+        self.burst_probability = burst_probability
+        self.burst_factor = burst_factor
+        self.mint_burn_share = mint_burn_share
+        self.genesis_timestamp = int(time.time()) - chain_days * 86400
+
+    def head_block(self):
+        return (int(time.time()) - self.genesis_timestamp) // BLOCK_TIME
+
+    def block_timestamp(self, block):
+        return self.genesis_timestamp + block * BLOCK_TIME
+
+    def block_by_time(self, timestamp, closest="before"):
+        offset = timestamp - self.genesis_timestamp
+        block = offset // BLOCK_TIME if closest == "before" else -(-offset // BLOCK_TIME)
+        return max(0, min(self.head_block(), block))
+
+    def _address(self, rng):
+        # Степенное распределение активности: малые индексы выпадают намного чаще
+        return f"0x{int(self.addresses * rng.random() ** 3) + 1:040x}"
+
+    def block_transfers(self, block, contract_address):
+        rng = random.Random(self.seed * 1_000_003 + block)
+        rate = self.transfers_per_block * (self.burst_factor if rng.random() < self.burst_probability else 1)
+        count = int(rate) + (1 if rng.random() < rate - int(rate) else 0)
+        timestamp = str(self.block_timestamp(block))
+        transfers = []
+        for log_index in range(count):
+            sender, receiver = self._address(rng), self._address(rng)
+            if rng.random() < self.mint_burn_share:
+                if rng.random() < 0.5:
+                    sender = ZERO_ADDRESS
+                else:
+                    receiver = ZERO_ADDRESS
+            transfers.append({
+                "blockNumber": str(block), "timeStamp": timestamp,
+                "hash": f"0x{block:056x}{log_index:08x}", "from": sender, "to": receiver,
+                "value": str(int(rng.paretovariate(1.2) * 10 ** TOKEN_DECIMALS)),
+                "contractAddress": contract_address, "tokenName": "Fake Token", "tokenSymbol": "FAKE",
+                "tokenDecimal": str(TOKEN_DECIMALS), "logIndex": str(log_index),
+            })
+        return transfers
+
+    def range_transfers(self, contract_address, start_block, end_block, limit, descending=False):
+        """Первые limit трансферов диапазона блоков в порядке сортировки (генерируются только нужные блоки)."""
+        blocks = range(end_block, start_block - 1, -1) if descending else range(start_block, end_block + 1)
+        transfers = []
+        for block in blocks:
+            block_transfers = self.block_transfers(block, contract_address)
+            transfers.extend(reversed(block_transfers) if descending else block_transfers)
+            if len(transfers) >= limit:
+                break
+        return transfers
+
+    def balance(self, address):
+        return random.Random(f"{self.seed}:{address.lower()}").randint(0, 10 ** 6) * 10 ** TOKEN_DECIMALS
+
+
+class FakeEtherscan:
+    """Обработка запросов Etherscan API поверх SyntheticChain с инъекцией задержек и ошибок."""
+
+    def __init__(self, chain, latency_ms=0.0, jitter_ms=0.0, rate_limit_probability=0.0, max_rps=None,
+                 window_error_probability=0.0, seed=0, max_rps_per_key=None):
+        self.chain = chain
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_limit_probability = rate_limit_probability
+        self.max_rps = max_rps
+        self.max_rps_per_key = max_rps_per_key
+        self.window_error_probability = window_error_probability
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "rate_limited": 0, "window_errors": 0, "transfers_served": 0}
+        self.second_started = 0.0
+        self.second_requests = 0
+        self.key_seconds = {} # apikey -> [начало текущей секунды, запросов в ней]
+
+    def _count(self, key, value=1):
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + value
+
+    def _rate_limited(self, api_key):
+        with self.lock:
+            if self.rng.random() < self.rate_limit_probability:
+                return True
+            now = time.monotonic()
+            if self.max_rps_per_key is not None:
+                window = self.key_seconds.setdefault(api_key, [0.0, 0])
+                if now - window[0] >= 1:
+                    window[:] = [now, 0]
+                window[1] += 1
+                if window[1] > self.max_rps_per_key:
+                    return True
+            if self.max_rps is None:
+                return False
+            if now - self.second_started >= 1:
+                self.second_started = now
+                self.second_requests = 0
+            self.second_requests += 1
+            return self.second_requests > self.max_rps
+
+    def handle(self, params):
+        self._count("requests")
+        self._count(f"action_{params.get('action')}")
+        if self.latency_ms or self.jitter_ms:
+            time.sleep(max(0.0, self.latency_ms + self.rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000)
+        if self._rate_limited(params.get("apikey")):
+            self._count("rate_limited")
+            return {"status": "0", "message": "NOTOK", "result": "Max rate limit reached"}
+
+        action = params.get("action")
+        if action == "getblocknobytime":
+            block = self.chain.block_by_time(int(params["timestamp"]), params.get("closest", "before"))
+            return {"status": "1", "message": "OK", "result": str(block)}
+        if action == "tokenbalance":
+            return {"status": "1", "message": "OK", "result": str(self.chain.balance(params["address"]))}
+        if action == "tokentx":
+            return self._tokentx(params)
+        return {"status": "0", "message": "NOTOK", "result": f"Error! Unknown action {action}"}
+
+    def _tokentx(self, params):
+        page = int(params.get("page", 1))
+        offset = int(params.get("offset", 10000))
+        head_block = self.chain.head_block()
+        start_block = max(0, int(params.get("startblock", 0)))
+        end_block = min(head_block, int(params.get("endblock", head_block)))
+        if page * offset > MAX_RESULT_WINDOW or self.rng.random() < self.window_error_probability:
+            self._count("window_errors")
+            return {"status": "0", "message": "Result window is too large, PageNo x Offset size must be less than or equal to 10000",
+                    "result": None}
+        transfers = self.chain.range_transfers(params.get("contractaddress", "").lower(), start_block, end_block,
+                                               page * offset, descending=params.get("sort") == "desc")
+        transfers = transfers[(page - 1) * offset: page * offset]
+        self._count("transfers_served", len(transfers))
+        if not transfers:
+            return {"status": "0", "message": "No transactions found", "result": []}
+        return {"status": "1", "message": "OK", "result": transfers}
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/stats":
+                body = json.dumps(fake.stats)
+            else:
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                body = json.dumps(fake.handle(params))
+            payload = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return Handler
+
+
+def start_server(fake, host="127.0.0.1", port=0):
+    """Запускает сервер в фоновом потоке и возвращает его (порт — server.server_port)."""
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Локальная замена Etherscan API с синтетическими трансферами.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="0 — выбрать свободный порт")
+    parser.add_argument("--transfers-per-block", type=float, default=1.0)
+    parser.add_argument("--addresses", type=int, default=50000, help="размер пула адресов")
+    parser.add_argument("--chain-days", type=int, default=30, help="сколько дней истории до текущего момента")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0, help="доля ответов 'Max rate limit reached'")
+    parser.add_argument("--max-rps", type=float, default=None, help="сверх этой частоты отвечать ошибкой лимита")
+    parser.add_argument("--max-rps-per-key", type=float, default=None, help="то же для каждого apikey отдельно")
+    parser.add_argument("--window-error-probability", type=float, default=0.0, help="доля ответов tokentx с ошибкой окна 10k")
+    return parser.parse_args(argv)
+
+
+def fake_from_args(args):
+    chain = SyntheticChain(args.transfers_per_block, args.addresses, args.chain_days, args.seed)
+    return FakeEtherscan(chain, args.latency_ms, args.jitter_ms, args.rate_limit_probability, args.max_rps,
+                         args.window_error_probability, args.seed, args.max_rps_per_key)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(fake_from_args(args)))
+    server.daemon_threads = True
+    print(f"Fake Etherscan: http://{args.host}:{server.server_port}/api", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,170 @@
+"""
+Локальная замена JSON-RPC ноды Ethereum для проверки и замеров JsonRpcBalanceProvider без внешней ноды.
+
+Отвечает на eth_call balanceOf(address) (одиночные и batch-запросы) и на eth_call к Multicall3.aggregate3.
+Calldata разбирается и ответы кодируются библиотекой eth_abi (pip install eth-abi), а не кодом data_fetch,
+поэтому сервер служит эталоном для ручного ABI-кодирования в data_fetch. Балансы берутся из SyntheticChain
+(fake_etherscan.py) и совпадают с ответами tokenbalance заглушки Etherscan с тем же seed.
+Умеет добавлять задержку, отказ всей пачки (HTTP 503) и пропуск отдельных адресов: в batch-ответе
+элемент отсутствует или содержит ошибку, в aggregate3 вызов возвращается с success=false.
+
+Запуск: python benchmarks/fake_json_rpc.py --port 8546 --batch-failure-probability 0.1 --drop-probability 0.05
+Клиент: ETH_RPC_URL=http://127.0.0.1:8546
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from eth_abi import decode, encode
+
+from fake_etherscan import SyntheticChain
+
+MULTICALL3_ADDRESS = "0xca11bde05977b3631167028862be2a173976ca11"
+BALANCE_OF_SELECTOR = bytes.fromhex("70a08231")
+AGGREGATE3_SELECTOR = bytes.fromhex("82ad56cb")
+
+
+class FakeJsonRpc:
+    """Обработка JSON-RPC запросов поверх SyntheticChain с инъекцией задержек, отказов пачек и пропусков адресов."""
+
+    def __init__(self, chain, latency_ms=0.0, batch_failure_probability=0.0, drop_probability=0.0, seed=0):
+        self.chain = chain
+        self.latency_ms = latency_ms
+        self.batch_failure_probability = batch_failure_probability
+        self.drop_probability = drop_probability
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "failed_batches": 0, "calls": 0, "multicalls": 0, "dropped": 0}
+
+    def _count(self, key, value=1):
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + value
+
+    def _chance(self, probability):
+        with self.lock:
+            return self.rng.random() < probability
+
+    def _balance_of(self, call_data):
+        """Баланс по calldata balanceOf или None, если calldata не balanceOf(address)."""
+        if call_data[:4] != BALANCE_OF_SELECTOR or len(call_data) != 36:
+            return None
+        (address,) = decode(["address"], call_data[4:])
+        return self.chain.balance(address)
+
+    def _aggregate3(self, call_data):
+        if call_data[:4] != AGGREGATE3_SELECTOR:
+            raise ValueError("execution reverted")
+        (calls,) = decode(["(address,bool,bytes)[]"], call_data[4:])
+        results = []
+        for _, allow_failure, sub_call_data in calls:
+            balance = self._balance_of(sub_call_data)
+            if balance is None or self._chance(self.drop_probability):
+                if not allow_failure:
+                    raise ValueError("Multicall3: call failed")
+                self._count("dropped")
+                results.append((False, b""))
+            else:
+                results.append((True, encode(["uint256"], [balance])))
+        self._count("multicalls")
+        self._count("calls", len(calls))
+        return encode(["(bool,bytes)[]"], [results])
+
+    def _call(self, request):
+        """Ответ на один элемент запроса или None, если элемент нужно пропустить."""
+        response = {"jsonrpc": "2.0", "id": request.get("id")}
+        if request.get("method") != "eth_call":
+            response["error"] = {"code": -32601, "message": "the method does not exist/is not available"}
+            return response
+        call = request["params"][0]
+        call_data = bytes.fromhex(call["data"][2:])
+        try:
+            if call["to"].lower() == MULTICALL3_ADDRESS:
+                response["result"] = "0x" + self._aggregate3(call_data).hex()
+                return response
+            self._count("calls")
+            balance = self._balance_of(call_data)
+            if balance is None:
+                raise ValueError("execution reverted")
+        except Exception as e:
+            response["error"] = {"code": -32000, "message": str(e)}
+            return response
+        if self._chance(self.drop_probability):
+            self._count("dropped")
+            # Нода под нагрузкой теряет часть ответов пачки или отвечает на них ошибкой
+            return None if self._chance(0.5) else dict(response, error={"code": -32005, "message": "limit exceeded"})
+        response["result"] = "0x" + encode(["uint256"], [balance]).hex()
+        return response
+
+    def handle(self, payload):
+        """Возвращает (HTTP-статус, тело ответа) для одиночного или batch-запроса."""
+        self._count("requests")
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        if self._chance(self.batch_failure_probability):
+            self._count("failed_batches")
+            return 503, {"jsonrpc": "2.0", "id": None, "error": {"code": -32603, "message": "service unavailable"}}
+        if isinstance(payload, list):
+            return 200, [response for response in map(self._call, payload) if response is not None]
+        return 200, self._call(payload) or {"jsonrpc": "2.0", "id": payload.get("id"),
+                                             "error": {"code": -32005, "message": "limit exceeded"}}
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            self._send(200, fake.stats)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            self._send(*fake.handle(json.loads(self.rfile.read(length))))
+
+    return Handler
+
+
+def start_server(fake, host="127.0.0.1", port=0):
+    """Запускает сервер в фоновом потоке и возвращает его (порт — server.server_port)."""
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Локальная замена JSON-RPC ноды для запросов балансов ERC-20.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="0 — выбрать свободный порт")
+    parser.add_argument("--seed", type=int, default=0, help="тот же seed, что у fake_etherscan.py, дает те же балансы")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--batch-failure-probability", type=float, default=0.0, help="доля запросов, отвергнутых целиком (HTTP 503)")
+    parser.add_argument("--drop-probability", type=float, default=0.0, help="доля адресов, оставленных без баланса")
+    return parser.parse_args(argv)
+
+
+def fake_from_args(args):
+    return FakeJsonRpc(SyntheticChain(seed=args.seed), args.latency_ms, args.batch_failure_probability,
+                       args.drop_probability, args.seed)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(fake_from_args(args)))
+    server.daemon_threads = True
+    print(f"Fake JSON-RPC: http://{args.host}:{server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
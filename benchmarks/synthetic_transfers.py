@@ -0,0 +1,137 @@
+"""
+Воспроизводимый генератор реалистичных наборов трансферов ERC-20 для замеров (от 10 тыс. до 50 млн строк).
+
+Свойства данных: степенное распределение активности кошельков (несколько процентов адресов делают
+большую часть трансферов), киты с суммами на порядки выше медианы, эмиссия и сжигание через нулевой адрес.
+Один и тот же seed дает одинаковые данные. Генерация идет пачками с numpy, поэтому большие наборы
+пишутся сразу в TransferStore партициями и потом читаются через memory mapping, как в рабочем запуске.
+
+Пример:
+    store = TransferStore("bench_data/transfers")
+    write_synthetic_store(store, SYNTHETIC_CONTRACT, 5_000_000, days=15)
+    transfers = store.read_columns(SYNTHETIC_CONTRACT)
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_fetch import TRANSFER_SCHEMA
+
+SYNTHETIC_CONTRACT = "0x00000000000000000000000000000000005e7a11"
+BLOCK_TIME = 12
+CHUNK_SIZE = 1_000_000
+
+
+def wallet_address(index):
+    """Адрес синтетического кошелька по его номеру (0 — нулевой адрес для эмиссии и сжигания)."""
+    return f"0x{index:040x}"
+
+
+def default_wallet_count(n_transfers):
+    return max(100, n_transfers // 20)
+
+
+def iter_transfer_chunks(n_transfers, n_wallets=None, days=15, end_ts=None, seed=0, activity_exponent=3.0,
+                         whale_share=0.001, whale_multiplier=1000, mint_burn_share=0.01, decimals=18,
+                         chunk_size=CHUNK_SIZE):
+    """
+    Выдает пачки трансферов словарями numpy-колонок: block, timestamp, sender, receiver (номера кошельков),
+    value (сумма в минимальных единицах как int64 в 10^-6 токена и масштаб value_scale), hash, log_index.
+    Трансферы упорядочены по времени в пределах [end_ts - days суток, end_ts].
+    """
+    n_wallets = n_wallets or default_wallet_count(n_transfers)
+    end_ts = int(end_ts or time.time())
+    start_ts = end_ts - days * 86400
+    genesis_ts = start_ts - 10_000_000 * BLOCK_TIME
+    n_whales = max(1, int(n_wallets * whale_share))
+    rng = np.random.default_rng(seed)
+    # Равномерные отсортированные моменты времени по пачкам: граница каждой пачки — свой отрезок окна
+    bounds = np.linspace(start_ts, end_ts, num=(n_transfers + chunk_size - 1) // chunk_size + 1)
+
+    for chunk_index, chunk_start in enumerate(range(0, n_transfers, chunk_size)):
+        size = min(chunk_size, n_transfers - chunk_start)
+        timestamps = np.sort(rng.integers(int(bounds[chunk_index]), int(bounds[chunk_index + 1]) + 1, size=size))
+        # Номер кошелька от 1: малые номера выпадают намного чаще (степенной закон активности)
+        senders = (n_wallets * rng.random(size) ** activity_exponent).astype(np.int64) + 1
+        receivers = (n_wallets * rng.random(size) ** activity_exponent).astype(np.int64) + 1
+        mint_burn = rng.random(size) < mint_burn_share
+        mint = mint_burn & (rng.random(size) < 0.5)
+        senders[mint] = 0
+        receivers[mint_burn & ~mint] = 0
+        # Суммы — распределение Парето, у китов (первые n_whales кошельков) умножены на whale_multiplier
+        values = np.minimum(rng.pareto(1.2, size) + 0.01, 1e6)
+        values[(senders <= n_whales) & (senders > 0)] *= whale_multiplier
+        yield {
+            "block": (timestamps - genesis_ts) // BLOCK_TIME,
+            "timestamp": timestamps,
+            "sender": senders,
+            "receiver": receivers,
+            "value": np.round(values * 1e6).astype(np.int64),
+            "value_scale": 10 ** (decimals - 6),
+            "hash": rng.integers(0, 256, size=(size, 32), dtype=np.uint8),
+            "log_index": np.zeros(size, dtype=np.int32),
+        }
+
+
+def _scaled_decimal(values, scale):
+    """int64 в 10^-6 токена -> decimal128(38, 0) в минимальных единицах без переполнения и без Python-объектов."""
+    scaled = pc.multiply(pa.array(values).cast(pa.decimal128(19, 0)), pa.scalar(scale, pa.decimal128(len(str(scale)), 0)))
+    return scaled.cast(TRANSFER_SCHEMA.field("value").type)
+
+
+def chunk_to_table(chunk, wallet_ids):
+    """Пачка генератора -> pyarrow.Table в схеме TRANSFER_SCHEMA; wallet_ids переводит номер кошелька в id AddressTable."""
+    hashes = pa.FixedSizeBinaryArray.from_buffers(pa.binary(32), len(chunk["hash"]), [None, pa.py_buffer(chunk["hash"].tobytes())])
+    return pa.table({
+        "block": pa.array(chunk["block"], pa.int64()),
+        "timestamp": pa.array(chunk["timestamp"], pa.int64()),
+        "from_id": pa.array(wallet_ids[chunk["sender"]], pa.int32()),
+        "to_id": pa.array(wallet_ids[chunk["receiver"]], pa.int32()),
+        "value": _scaled_decimal(chunk["value"], chunk["value_scale"]),
+        "hash": hashes.cast(pa.binary()),
+        "log_index": pa.array(chunk["log_index"], pa.int32()),
+    }, schema=TRANSFER_SCHEMA)
+
+
+def intern_wallets(address_table, n_wallets):
+    """Регистрирует адреса кошельков 0..n_wallets в AddressTable и возвращает массив номер кошелька -> id."""
+    return np.array(address_table.intern_many([wallet_address(index) for index in range(n_wallets + 1)]), dtype=np.int32)
+
+
+def write_synthetic_store(store, contract_address, n_transfers, n_wallets=None, **generator_options):
+    """
+    Записывает синтетический набор в TransferStore (одна партиция на пачку) и возвращает число кошельков.
+    Хранилище контракта предварительно очищается; high_water_block — последний сгенерированный блок.
+    data_fetch импортируется вызывающим кодом, поэтому ETHERSCAN_API_KEY/ETHERSCAN_DATA_DIR должны быть заданы до импорта.
+    """
+    n_wallets = n_wallets or default_wallet_count(n_transfers)
+    wallet_ids = intern_wallets(store.addresses, n_wallets)
+    store.reset(contract_address, 0)
+    last_block = 0
+    for chunk in iter_transfer_chunks(n_transfers, n_wallets, **generator_options):
+        store.append_table(contract_address, chunk_to_table(chunk, wallet_ids))
+        last_block = int(chunk["block"][-1])
+    store.set_high_water_block(contract_address, last_block)
+    return n_wallets
+
+
+def generate_transactions(n_transfers, n_wallets=None, contract_address=SYNTHETIC_CONTRACT, decimals=18, **generator_options):
+    """Тот же набор в формате ответов Etherscan tokentx (список словарей) — для замера разбора и старого пути расчета."""
+    transactions = []
+    for chunk in iter_transfer_chunks(n_transfers, n_wallets, decimals=decimals, **generator_options):
+        scale = chunk["value_scale"]
+        for block, timestamp, sender, receiver, value, tx_hash in zip(
+            chunk["block"].tolist(), chunk["timestamp"].tolist(), chunk["sender"].tolist(),
+            chunk["receiver"].tolist(), chunk["value"].tolist(), chunk["hash"]
+        ):
+            transactions.append({
+                "blockNumber": str(block), "timeStamp": str(timestamp), "hash": "0x" + tx_hash.tobytes().hex(),
+                "from": wallet_address(sender), "to": wallet_address(receiver), "value": str(value * scale),
+                "contractAddress": contract_address, "tokenDecimal": str(decimals), "logIndex": "0",
+            })
+    return transactions
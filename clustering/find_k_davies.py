@@ -1,3 +1,7 @@
+import argparse
+import os
+import sys
+
 import pandas as pd
 from sklearn.preprocessing import StandardScaler
 from sklearn.cluster import KMeans
@@ -5,24 +9,13 @@ from sklearn.metrics import davies_bouldin_score
 import matplotlib.pyplot as plt
 import seaborn as sns
 
-# --- Загрузка данных ---
-data = pd.read_csv(r"C:\Users\Gleb Onore\Desktop\ai_blockchain\ethereum_0x514910771AF9Ca656af840dff83E8264EcF986CA_clustering_dataset.csv")
-print(data.head())
-
-# --- Предобработка данных ---
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from profiling import ProfileSession, add_profile_arguments
 
-# Преобразование столбцов с датами
-data['first_token_tx_date'] = pd.to_datetime(data['first_token_tx_date'], errors='coerce')
-data['last_token_tx_date'] = pd.to_datetime(data['last_token_tx_date'], errors='coerce')
-data['first_token_tx_date_ts'] = data['first_token_tx_date'].apply(lambda x: x.timestamp() if pd.notnull(x) else None)
-data['last_token_tx_date_ts'] = data['last_token_tx_date'].apply(lambda x: x.timestamp() if pd.notnull(x) else None)
-
-# Обработка 'data_completeness'
-completeness_mapping = {
-    'full': 1.0,
-    'partial_10k_limit': 0.0
-}
-data['data_completeness'] = data['data_completeness'].map(completeness_mapping)
+parser = argparse.ArgumentParser(description="Подбор числа кластеров KMeans по метрике Davies-Bouldin.")
+add_profile_arguments(parser)
+args = parser.parse_args()
+profile = ProfileSession.from_args("find_k_davies", args).start()
 
 # Выбор признаков
 features = [
@@ -42,6 +35,29 @@ features = [
     'token_interactions'
 ]
 
+# Из датасета читаем только нужные столбцы (метки времени считаются из дат ниже)
+date_columns = ['first_token_tx_date', 'last_token_tx_date']
+usecols = [f for f in features if f not in ('first_token_tx_date_ts', 'last_token_tx_date_ts')] + date_columns
+
+# --- Загрузка данных ---
+data = pd.read_csv(r"C:\Users\Gleb Onore\Desktop\ai_blockchain\ethereum_0x514910771AF9Ca656af840dff83E8264EcF986CA_clustering_dataset.csv", usecols=usecols)
+print(data.head())
+
+# --- Предобработка данных ---
+
+# Преобразование столбцов с датами
+data['first_token_tx_date'] = pd.to_datetime(data['first_token_tx_date'], errors='coerce')
+data['last_token_tx_date'] = pd.to_datetime(data['last_token_tx_date'], errors='coerce')
+data['first_token_tx_date_ts'] = data['first_token_tx_date'].apply(lambda x: x.timestamp() if pd.notnull(x) else None)
+data['last_token_tx_date_ts'] = data['last_token_tx_date'].apply(lambda x: x.timestamp() if pd.notnull(x) else None)
+
+# Обработка 'data_completeness'
+completeness_mapping = {
+    'full': 1.0,
+    'partial_10k_limit': 0.0
+}
+data['data_completeness'] = data['data_completeness'].map(completeness_mapping)
+
 # Удаление пропусков
 data = data.dropna(subset=features)
 
@@ -59,6 +75,8 @@ for k in k_values:
     score = davies_bouldin_score(scaled_features, labels)
     db_scores.append(score)
 
+profile.stop() # Ожидание закрытия окна графика не профилируется
+
 # Визуализация
 plt.figure(figsize=(8, 5))
 plt.plot(k_values, db_scores, marker='o', color='green')
@@ -1,28 +1,124 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
 import pandas as pd
+from scipy import stats
 from sklearn.preprocessing import StandardScaler
 from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score
 import matplotlib.pyplot as plt
 import seaborn as sns
 
-# --- Загрузка данных ---
-data = pd.read_csv(r"C:\Users\Gleb Onore\Desktop\ai_blockchain\ethereum_0x514910771AF9Ca656af840dff83E8264EcF986CA_clustering_dataset.csv")
-print(data.head())
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from profiling import ProfileSession, add_profile_arguments
 
-# --- Предобработка данных ---
+# --- Параметры оценки silhouette ---
+EXACT_LIMIT = 20000 # В режиме auto до стольких кошельков silhouette считается точно, дальше — по выборкам
+SAMPLE_SIZE = 5000 # Сколько кошельков оценивается в одном повторе (стратифицированно по кластерам)
+REFERENCE_SIZE = 50000 # Со сколькими кошельками сравнивается каждая точка выборки (0 — со всеми)
+MIN_PER_CLUSTER = 50 # Минимум точек каждого кластера в выборке, чтобы малые кластеры не выпадали
+REPEATS = 5 # Число независимых повторов; по их разбросу строится доверительный интервал
+CONFIDENCE = 0.95
+CHUNK_MB = 256 # Предел памяти на блок матрицы расстояний
 
-# Преобразование дат в timestamp
-data['first_token_tx_date'] = pd.to_datetime(data['first_token_tx_date'], errors='coerce')
-data['last_token_tx_date'] = pd.to_datetime(data['last_token_tx_date'], errors='coerce')
-data['first_token_tx_date_ts'] = data['first_token_tx_date'].apply(lambda x: x.timestamp() if pd.notnull(x) else None)
-data['last_token_tx_date_ts'] = data['last_token_tx_date'].apply(lambda x: x.timestamp() if pd.notnull(x) else None)
 
-# Преобразование флагов в числовые значения
-completeness_mapping = {
-    'full': 1.0,
-    'partial_10k_limit': 0.0
-}
-data['data_completeness'] = data['data_completeness'].map(completeness_mapping)
+def stratified_sample(labels, sample_size, rng, min_per_cluster=MIN_PER_CLUSTER):
+    """
+    Выборка индексов, стратифицированная по кластерам: доля кластера пропорциональна его размеру,
+    но не меньше min_per_cluster точек (и не больше размера кластера).
+    Возвращает индексы и веса N_c / n_c, с которыми среднее по выборке несмещенно оценивает среднее по всем точкам.
+    """
+    clusters, inverse, sizes = np.unique(labels, return_inverse=True, return_counts=True)
+    quotas = np.minimum(sizes, np.maximum(np.round(sample_size * sizes / len(labels)).astype(int), min_per_cluster))
+    rows, weights = [], []
+    for cluster, (size, quota) in enumerate(zip(sizes, quotas)):
+        rows.append(rng.choice(np.flatnonzero(inverse == cluster), quota, replace=False))
+        weights.append(np.full(quota, size / quota))
+    return np.concatenate(rows), np.concatenate(weights)
+
+
+def silhouette_chunked(X, labels, rows=None, reference=None, chunk_mb=CHUNK_MB):
+    """
+    Silhouette s(i) для точек rows (по умолчанию всех) по расстояниям до точек reference (по умолчанию всех).
+    Евклидовы расстояния считаются блоками строк, блок rows x reference занимает не больше chunk_mb;
+    суммы расстояний по кластерам — np.add.reduceat по отсортированным по метке точкам reference.
+    Память O(блок + n) вместо O(n^2); при rows=reference=None результат совпадает с sklearn silhouette_samples.
+    """
+    n = len(X)
+    rows = np.arange(n) if rows is None else np.asarray(rows)
+    reference = np.arange(n) if reference is None else np.asarray(reference)
+    reference = reference[np.argsort(labels[reference], kind="stable")]
+    X_reference = X[reference]
+    clusters, starts, sizes = np.unique(labels[reference], return_index=True, return_counts=True)
+    reference_norms = np.einsum("ij,ij->i", X_reference, X_reference)
+    position = np.full(n, -1) # Позиция точки среди reference: ее расстояние до самой себя обнуляется и не считается
+    position[reference] = np.arange(len(reference))
+
+    block_rows = max(1, int(chunk_mb * 2 ** 20 // (len(reference) * 8 * 2))) # Блок расстояний и временный массив
+    values = np.empty(len(rows))
+    for begin in range(0, len(rows), block_rows):
+        block = rows[begin:begin + block_rows]
+        block_index = np.arange(len(block))
+        X_block = X[block]
+        distances = X_block @ X_reference.T
+        distances *= -2
+        distances += reference_norms
+        distances += np.einsum("ij,ij->i", X_block, X_block)[:, None]
+        np.maximum(distances, 0, out=distances)
+        np.sqrt(distances, out=distances)
+        in_reference = position[block] >= 0
+        distances[block_index[in_reference], position[block][in_reference]] = 0
+
+        sums = np.add.reduceat(distances, starts, axis=1)
+        own = np.searchsorted(clusters, labels[block])
+        own_sizes = sizes[own] - in_reference # Без самой точки
+        a = sums[block_index, own] / np.maximum(own_sizes, 1)
+        means = sums / sizes
+        means[block_index, own] = np.inf
+        b = means.min(axis=1)
+        with np.errstate(invalid="ignore"):
+            block_values = np.nan_to_num((b - a) / np.maximum(a, b))
+        block_values[own_sizes == 0] = 0 # Как в sklearn: для кластера из одной точки s(i) = 0
+        values[begin:begin + len(block)] = block_values
+    return values
+
+
+def sampled_silhouette(X, labels, rng, sample_size=SAMPLE_SIZE, reference_size=REFERENCE_SIZE, repeats=REPEATS,
+                       chunk_mb=CHUNK_MB):
+    """
+    Оценка средней silhouette по repeats независимым стратифицированным выборкам.
+    В каждом повторе sample_size точек сравниваются с reference_size точками (своя стратифицированная выборка,
+    0 — все точки); стоимость O(repeats * sample_size * reference_size) вместо O(n^2).
+    Возвращает (оценка, нижняя граница, верхняя граница) доверительного интервала Стьюдента по повторам.
+    """
+    estimates = []
+    for _ in range(repeats):
+        rows, weights = stratified_sample(labels, sample_size, rng)
+        reference = None
+        if reference_size and reference_size < len(X):
+            reference = stratified_sample(labels, reference_size, rng)[0]
+        estimates.append(np.average(silhouette_chunked(X, labels, rows, reference, chunk_mb), weights=weights))
+    estimate = float(np.mean(estimates))
+    if repeats < 2:
+        return estimate, np.nan, np.nan
+    half_width = stats.t.ppf((1 + CONFIDENCE) / 2, repeats - 1) * np.std(estimates, ddof=1) / np.sqrt(repeats)
+    return estimate, estimate - half_width, estimate + half_width
+
+
+parser = argparse.ArgumentParser(description="Подбор числа кластеров KMeans по Silhouette Score.")
+parser.add_argument("--mode", choices=["auto", "exact", "sampled"], default="auto",
+                    help=f"exact — точная silhouette блоками, sampled — по выборкам с доверительным интервалом, "
+                         f"auto — exact до {EXACT_LIMIT} кошельков")
+parser.add_argument("--sample-size", type=int, default=SAMPLE_SIZE, help="кошельков в одном повторе")
+parser.add_argument("--reference-size", type=int, default=REFERENCE_SIZE, help="с каким числом кошельков сравнивать (0 — со всеми)")
+parser.add_argument("--repeats", type=int, default=REPEATS, help="число повторов выборки")
+parser.add_argument("--chunk-mb", type=float, default=CHUNK_MB, help="предел памяти на блок матрицы расстояний, МБ")
+parser.add_argument("--seed", type=int, default=42)
+add_profile_arguments(parser)
+args = parser.parse_args()
+profile = ProfileSession.from_args("find_k_siluette", args).start()
 
 # Список признаков
 features = [
@@ -42,6 +138,29 @@ features = [
     'token_interactions'
 ]
 
+# Из датасета читаем только нужные столбцы (метки времени считаются из дат ниже)
+date_columns = ['first_token_tx_date', 'last_token_tx_date']
+usecols = [f for f in features if f not in ('first_token_tx_date_ts', 'last_token_tx_date_ts')] + date_columns
+
+# --- Загрузка данных ---
+data = pd.read_csv(r"C:\Users\Gleb Onore\Desktop\ai_blockchain\ethereum_0x514910771AF9Ca656af840dff83E8264EcF986CA_clustering_dataset.csv", usecols=usecols)
+print(data.head())
+
+# --- Предобработка данных ---
+
+# Преобразование дат в timestamp
+data['first_token_tx_date'] = pd.to_datetime(data['first_token_tx_date'], errors='coerce')
+data['last_token_tx_date'] = pd.to_datetime(data['last_token_tx_date'], errors='coerce')
+data['first_token_tx_date_ts'] = data['first_token_tx_date'].apply(lambda x: x.timestamp() if pd.notnull(x) else None)
+data['last_token_tx_date_ts'] = data['last_token_tx_date'].apply(lambda x: x.timestamp() if pd.notnull(x) else None)
+
+# Преобразование флагов в числовые значения
+completeness_mapping = {
+    'full': 1.0,
+    'partial_10k_limit': 0.0
+}
+data['data_completeness'] = data['data_completeness'].map(completeness_mapping)
+
 # Удаление пропусков
 data = data.dropna(subset=features)
 
@@ -50,18 +169,42 @@ scaler = StandardScaler()
 scaled_features = scaler.fit_transform(data[features])
 
 # --- Silhouette Score для определения количества кластеров ---
+sampled = args.mode == "sampled" or (args.mode == "auto" and len(scaled_features) > EXACT_LIMIT)
+if sampled:
+    reference = f"с {args.reference_size}" if args.reference_size else "со всеми"
+    print(f"\nSilhouette по выборкам: {len(scaled_features)} кошельков, повторов: {args.repeats} по {args.sample_size} кошельков, "
+          f"сравнение {reference} кошельками, доверительный интервал {CONFIDENCE:.0%}")
+else:
+    print(f"\nТочная silhouette блоками (до {args.chunk_mb:.0f} МБ): {len(scaled_features)} кошельков")
+rng = np.random.default_rng(args.seed)
 silhouette_scores = []
+silhouette_intervals = []
 k_values = range(2, 11)  # silhouette score применим от k=2
 
 for k in k_values:
     kmeans = KMeans(n_clusters=k, random_state=42)
     labels = kmeans.fit_predict(scaled_features)
-    score = silhouette_score(scaled_features, labels)
+    started = time.perf_counter()
+    if sampled:
+        score, low, high = sampled_silhouette(scaled_features, labels, rng, args.sample_size, args.reference_size,
+                                              args.repeats, args.chunk_mb)
+        silhouette_intervals.append((score - low, high - score))
+        print(f"k={k}: silhouette {score:.4f} [{low:.4f}; {high:.4f}], {time.perf_counter() - started:.1f} сек")
+    else:
+        score = float(silhouette_chunked(scaled_features, labels, chunk_mb=args.chunk_mb).mean())
+        print(f"k={k}: silhouette {score:.4f}, {time.perf_counter() - started:.1f} сек")
     silhouette_scores.append(score)
 
+print(f"Лучшее k по silhouette: {k_values[int(np.argmax(silhouette_scores))]}")
+
+profile.stop() # Ожидание закрытия окна графика не профилируется
+
 # Визуализация
 plt.figure(figsize=(8, 5))
-plt.plot(k_values, silhouette_scores, marker='o')
+if sampled:
+    plt.errorbar(k_values, silhouette_scores, yerr=np.array(silhouette_intervals).T, marker='o', capsize=4)
+else:
+    plt.plot(k_values, silhouette_scores, marker='o')
 plt.title('Silhouette Score для определения количества кластеров')
 plt.xlabel('Количество кластеров')
 plt.ylabel('Silhouette Score')
@@ -0,0 +1,2664 @@
+import argparse
+import math
+import os
+import json
+import asyncio
+import hashlib
+import pickle
+import subprocess
+from bisect import bisect_right
+from contextlib import contextmanager
+import dotenv
+import requests
+from datetime import datetime, timedelta, time as dt_time # Импортируем time как dt_time
+import time as os_time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import scipy.sparse as sp
+from tqdm import tqdm
+import sys
+from profiling import ProfileSession, add_profile_arguments
+import metrics_worker
+from metrics_worker import AMOUNT_LIMBS, _aggregate_transfers_frame, _limb_totals, _per_address_metrics, _transfer_legs, _volume_limb_sums
+try:
+    import resource
+except ImportError: # Windows: пиковый RSS в отчете запуска не заполняется
+    resource = None
+try:
+    import fcntl
+except ImportError: # Windows: межпроцессная блокировка файлов через msvcrt
+    fcntl = None
+    import msvcrt
+dotenv.load_dotenv()
+ETHERSCAN_API_KEY = os.getenv("ETHERSCAN_API_KEY")
+# Пул ключей: ETHERSCAN_API_KEYS=КЛЮЧ1,КЛЮЧ2,... (у каждого ключа своя квота), иначе единственный ETHERSCAN_API_KEY
+ETHERSCAN_API_KEYS = [key.strip() for key in os.getenv("ETHERSCAN_API_KEYS", "").split(",") if key.strip()] or \
+                     [key for key in [ETHERSCAN_API_KEY] if key]
+if not ETHERSCAN_API_KEYS and os.getenv("ETHERSCAN_CACHE_MODE") != "replay": # В режиме replay API не вызывается
+    print("Ошибка: ETHERSCAN_API_KEY не найден в переменных окружения.")
+    print("Пожалуйста, убедитесь, что у вас есть файл .env с ETHERSCAN_API_KEY=ВАШ_КЛЮЧ (или ETHERSCAN_API_KEYS=КЛЮЧ1,КЛЮЧ2)")
+    sys.exit(1)
+
+TOKENS = { # Анализируемые токены: символ -> адрес контракта
+    "AAVE": "0x7Fc66500c84A76Ad7e9c93437bFc5Ac33E2DDaE9",
+    "LINK": "0x514910771AF9Ca656af840dff83E8264EcF986CA",
+}
+DAYS_BACK = 15
+METRIC_WINDOWS = () # Дополнительные окна в днях, например (1, 7, 15, 30): столбцы <метрика>_<N>d
+CALLS_PER_SECOND = 5 # Лимит тарифного плана Etherscan на один ключ
+KEY_MAX_CONSECUTIVE_ERRORS = 5 # После стольких ошибок лимита подряд ключ выводится из ротации
+MAX_WORKERS = 8 # Сколько запросов может находиться "в полете" одновременно
+PAGE_BATCH_SIZE = 3 # Сколько следующих страниц дня запрашивать параллельно
+MAX_RESULT_WINDOW = 10000 # Etherscan отдает не более 10k записей на один диапазон блоков
+SPLIT_THRESHOLD = 0.8 # Делить диапазон заранее, если оценка превышает эту долю окна 10k
+USE_ASYNC_FETCH = True # Загружать дни параллельно через asyncio; False — дни по очереди
+MAX_CONCURRENT_DAYS = 8 # Сколько дней может загружаться одновременно в asyncio-режиме
+HTTP_TIMEOUT = (10, 60) # Таймауты (соединение, чтение) запроса к Etherscan, сек
+
+DATA_DIR = os.getenv("ETHERSCAN_DATA_DIR", "data") # Локальные данные между запусками (индекс блоков и т.п.)
+BLOCK_INDEX_PATH = os.path.join(DATA_DIR, "block_index.npy")
+TRANSFER_STORE_DIR = os.path.join(DATA_DIR, "transfers")
+HTTP_CACHE_MODE = os.getenv("ETHERSCAN_CACHE_MODE", "off") # Кэш ответов API: "off", "cache" (с записью) или "replay"
+HTTP_CACHE_DIR = os.path.join(DATA_DIR, "http_cache")
+RUN_END_PATH = os.path.join(HTTP_CACHE_DIR, "run_end.json") # Конец окна последнего запуска с записью в кэш: replay берет его же
+MUTABLE_CACHE_TTL = 5 * 60 # Сколько секунд хранить ответы на изменяемые запросы
+CHECKPOINT_DIR = os.path.join(DATA_DIR, "checkpoints") # Контрольные точки запроса балансов для продолжения прерванного запуска
+CHECKPOINT_BATCH_SIZE = 500 # После каждой такой пачки балансов полученные значения сохраняются на диск
+CHECKPOINT_MAX_AGE = 6 * 60 * 60 # Балансы из контрольной точки старше этого (в секундах) запрашиваются заново
+ETH_RPC_URL = os.getenv("ETH_RPC_URL") # JSON-RPC нода для балансов (если не задана — Etherscan tokenbalance)
+RPC_BATCH_SIZE = 200 # Сколько адресов запрашивать в одном batch-запросе / вызове Multicall3
+RPC_USE_MULTICALL = False # Запрашивать пачку балансов через Multicall3 вместо JSON-RPC batch
+RPC_MAX_CONCURRENT_BATCHES = 4
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+BALANCE_OF_SELECTOR = "0x70a08231"
+MULTICALL3_AGGREGATE3_SELECTOR = "0x82ad56cb"
+USE_BALANCE_LEDGER = False # Восстанавливать балансы из трансферов хранилища (см. BalanceLedger)
+METRICS_BACKEND = "python" # Расчет метрик: "python", "pandas" или "sharded" (pandas в нескольких процессах)
+METRICS_WORKERS = os.cpu_count() or 1 # Сколько процессов считают метрики в режиме "sharded"
+METRICS_SHARDS = None # На сколько шардов делить адреса (None — по одному на процесс)
+STREAM_METRICS = False # Потоковый расчет по партициям хранилища, строки пишутся пачками
+STREAM_PARTIALS_MERGE = 16 # Через сколько партиций объединять частичные агрегаты потокового расчета
+OUTPUT_FORMAT = "csv" # Формат результата в потоковом режиме: "csv" или "parquet"
+OUTPUT_CHUNK_SIZE = 10000 # Сколько строк кошельков держать в памяти перед записью в файл
+GRAPH_FEATURES = False # Добавлять признаки графа контрагентов (см. CounterpartyGraph)
+PAGERANK_DAMPING = 0.85
+PAGERANK_MAX_ITER = 100
+PAGERANK_TOL = 1e-10 # Порог сходимости PageRank по сумме абсолютных изменений рангов
+REACH_EXACT_LIMIT = 10000 # Порог суммы степеней соседей для точного охвата за два шага
+REACH_SKETCHES = 64 # Число хэшей для оценки охвата остальных адресов
+RUN_REPORT_DIR = os.path.join(DATA_DIR, "reports") # JSON-отчеты запусков (фазы, квота API, память)
+PROFILE_DIR = os.path.join(DATA_DIR, "profiles") # Результаты режима --profile (см. profiling.py)
+PROMETHEUS_TEXTFILE = os.getenv("ETHERSCAN_PROMETHEUS_FILE") # Если задан — метрики запуска пишутся сюда в текстовом формате Prometheus
+INCREMENTAL_FETCH = False # Загружать только новые блоки после прошлого запуска
+BLOCK_INDEX_MIN_AGE = 15 * 60 # Не кэшировать номера блоков для слишком свежих моментов времени
+
+def _run_end_dt(mode=HTTP_CACHE_MODE):
+    """Конец окна анализа: текущее время, а в режиме replay — конец записанного запуска (RUN_END_PATH)."""
+    if mode != "replay":
+        return datetime.now()
+    try:
+        with open(RUN_END_PATH, encoding="utf-8") as f:
+            return datetime.fromisoformat(json.load(f)["end"])
+    except (OSError, ValueError, KeyError):
+        print(f"Предупреждение: Нет записанного конца окна ({RUN_END_PATH}), replay использует текущее время.")
+        return datetime.now()
+
+def _record_run_end(end_dt, path=RUN_END_PATH):
+    """Сохраняет конец окна запуска рядом с записанными ответами, чтобы replay повторил то же окно."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"end": end_dt.isoformat()}, f)
+    os.replace(tmp_path, path)
+
+END_DATE_DT = _run_end_dt()
+START_DATE_DT = END_DATE_DT - timedelta(days=DAYS_BACK)
+FETCH_START_DT = END_DATE_DT - timedelta(days=max((DAYS_BACK,) + tuple(METRIC_WINDOWS))) # Загружаем самое длинное из окон
+
+def peak_rss_mb():
+    """Пиковый RSS процесса в МБ или None, если модуля resource нет (Windows). Используется и в benchmarks/."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024 # macOS — байты, Linux — килобайты
+
+class RunTelemetry:
+    """
+    Телеметрия запуска: время фаз (phase), счетчики по меткам (add) и пиковый RSS.
+    Сохраняется JSON-отчетом (write_report) и в текстовом формате Prometheus (write_prometheus).
+    """
+
+    PROMETHEUS_LABELS = {
+        "api_calls": "action", "http_requests": "action", "cache_hits": "action", "bytes_received": "action",
+        "retries": "reason", "errors": "reason", "sleep_seconds": "reason", "transfers": "token", "rows_written": "token",
+        "key_requests": "key",
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = os_time.time()
+            self.phases = {}
+            self.counters = {}
+
+    def add(self, name, label, value=1):
+        with self.lock:
+            values = self.counters.setdefault(name, {})
+            values[label] = values.get(label, 0) + value
+
+    @contextmanager
+    def phase(self, name):
+        """Замеряет время блока как фазу name (повторные входы суммируются) и фиксирует пиковый RSS после нее."""
+        started = os_time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = os_time.perf_counter() - started
+            with self.lock:
+                phase = self.phases.setdefault(name, {"seconds": 0.0, "runs": 0})
+                phase["seconds"] += elapsed
+                phase["runs"] += 1
+                phase["peak_rss_mb"] = peak_rss_mb()
+
+    def report(self, **context):
+        with self.lock:
+            return dict(context, started_at=datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+                        wall_seconds=os_time.time() - self.started, peak_rss_mb=peak_rss_mb(),
+                        phases={name: dict(phase) for name, phase in self.phases.items()},
+                        counters={name: dict(values) for name, values in self.counters.items()})
+
+    def write_report(self, path, **context):
+        """Сохраняет report() в JSON (атомарно) и возвращает путь."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.report(**context), f, ensure_ascii=False, indent=2, default=str)
+        os.replace(tmp_path, path)
+        return path
+
+    def prometheus_text(self):
+        """Метрики запуска в текстовом формате Prometheus (например, для textfile collector node_exporter)."""
+        report = self.report()
+        lines = ["# TYPE etherscan_run_phase_seconds gauge"]
+        lines += [f'etherscan_run_phase_seconds{{phase="{name}"}} {phase["seconds"]:.6f}' for name, phase in report["phases"].items()]
+        for name, values in report["counters"].items():
+            metric = f"etherscan_{name}_total"
+            label = self.PROMETHEUS_LABELS.get(name, "label")
+            lines.append(f"# TYPE {metric} counter")
+            lines += [f'{metric}{{{label}="{key}"}} {value}' for key, value in sorted(values.items())]
+        lines += ["# TYPE etherscan_run_wall_seconds gauge", f"etherscan_run_wall_seconds {report['wall_seconds']:.6f}"]
+        if report["peak_rss_mb"] is not None:
+            lines += ["# TYPE etherscan_run_peak_rss_bytes gauge", f"etherscan_run_peak_rss_bytes {int(report['peak_rss_mb'] * 2 ** 20)}"]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+TELEMETRY = RunTelemetry()
+
+class TokenBucket:
+    """Потокобезопасный token bucket: выдает не более rate разрешений в секунду (с запасом burst)."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = os_time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """Забирает разрешение без ожидания: возвращает 0, если оно выдано, иначе через сколько секунд появится следующее."""
+        with self.lock:
+            now = os_time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Блокирует поток, пока не появится свободное разрешение."""
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            os_time.sleep(wait)
+
+    def pause(self, seconds):
+        """Останавливает выдачу разрешений всем потокам на seconds секунд (например, после 'Max rate limit reached')."""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, os_time.monotonic() + seconds)
+            self.updated = self.blocked_until
+            self.tokens = 0
+
+class ApiKeyPool:
+    """
+    Пул ключей Etherscan API: у каждого ключа свой TokenBucket и своя пауза после ошибки лимита.
+    Ключ с max_errors ошибками лимита подряд или недействительный выводится из ротации (кроме последнего).
+    """
+
+    def __init__(self, keys, calls_per_second=CALLS_PER_SECOND, max_errors=KEY_MAX_CONSECUTIVE_ERRORS):
+        self.keys = list(keys)
+        self.limiters = [TokenBucket(calls_per_second) for _ in self.keys]
+        self.errors = [0] * len(self.keys)
+        self.active = list(range(len(self.keys)))
+        self.max_errors = max_errors
+        self.next_index = 0
+        self.lock = threading.Lock()
+
+    def key(self, index):
+        return self.keys[index]
+
+    def acquire(self):
+        """Блокирует поток, пока у одного из активных ключей не появится разрешение; возвращает номер ключа."""
+        while True:
+            with self.lock:
+                active = list(self.active)
+                start = self.next_index
+                self.next_index = (self.next_index + 1) % len(active)
+            wait = None
+            for offset in range(len(active)):
+                index = active[(start + offset) % len(active)]
+                key_wait = self.limiters[index].try_acquire()
+                if not key_wait:
+                    return index
+                wait = key_wait if wait is None else min(wait, key_wait)
+            os_time.sleep(wait)
+
+    def succeeded(self, index):
+        with self.lock:
+            self.errors[index] = 0
+
+    def rate_limited(self, index, seconds):
+        """Пауза только для ключа index; после max_errors таких ошибок подряд ключ выводится из ротации."""
+        self.limiters[index].pause(seconds)
+        with self.lock:
+            self.errors[index] += 1
+            if self.errors[index] >= self.max_errors:
+                self._retire(index, f"{self.errors[index]} ошибок лимита подряд")
+
+    def retire(self, index, reason):
+        """Выводит ключ из ротации; возвращает False, если это последний активный ключ."""
+        with self.lock:
+            return self._retire(index, reason)
+
+    def _retire(self, index, reason):
+        if index not in self.active or len(self.active) == 1:
+            return False
+        self.active.remove(index)
+        self.next_index = 0
+        print(f"\nПредупреждение: Ключ API #{index + 1} выведен из ротации ({reason}), активных ключей: {len(self.active)}.")
+        TELEMETRY.add("errors", "key_retired")
+        return True
+
+class ResponseCache:
+    """
+    Кэш ответов Etherscan на диске: файл на sha256 параметров запроса без apikey.
+    Неизменяемые ответы хранятся бессрочно, остальные — MUTABLE_CACHE_TTL; replay отдает все записанные.
+    """
+
+    CACHEABLE_MESSAGES = ("No transactions found", "No records found", "Result window is too large")
+
+    def __init__(self, root, replay=False, mutable_ttl=MUTABLE_CACHE_TTL):
+        self.root = root
+        self.replay = replay
+        self.mutable_ttl = mutable_ttl
+
+    def _path(self, params):
+        normalized = {str(key).lower(): str(value).lower() for key, value in params.items() if str(key).lower() != "apikey"}
+        key = hashlib.sha256(json.dumps(normalized, sort_keys=True).encode("utf-8")).hexdigest()
+        return os.path.join(self.root, key[:2], key + ".json")
+
+    def get(self, params):
+        """Возвращает записанный ответ API (разобранный JSON) или None, если его нет или он устарел."""
+        path = self._path(params)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self.replay or entry["immutable"] or os_time.time() - entry["stored_at"] <= self.mutable_ttl:
+            return entry["response"]
+        return None
+
+    def put(self, params, data):
+        """Записывает ответ, если он окончательный: успешный или "нет данных"/лимит 10k, но не ошибка и не лимит частоты."""
+        if data.get("status") != "1" and not any(message in data.get("message", "") for message in self.CACHEABLE_MESSAGES):
+            return
+        path = self._path(params)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"params": {key: str(value) for key, value in params.items()}, "stored_at": os_time.time(),
+                       "immutable": _is_immutable_query(params), "response": data}, f)
+        os.replace(tmp_path, path)
+
+def make_response_cache(mode=HTTP_CACHE_MODE):
+    """Кэш ответов для режима ETHERSCAN_CACHE_MODE или None, если кэш выключен."""
+    if mode == "off":
+        return None
+    if mode not in ("cache", "replay"):
+        print(f"Предупреждение: Неизвестный режим кэша ETHERSCAN_CACHE_MODE={mode}, кэш выключен.")
+        return None
+    return ResponseCache(HTTP_CACHE_DIR, replay=mode == "replay")
+
+class EtherscanClient:
+    """
+    Клиент Etherscan API: общая requests.Session, пул ключей ApiKeyPool и, при cache, кэш ResponseCache.
+    Запросы можно выполнять параллельно через map().
+    """
+
+    def __init__(self, api_keys, calls_per_second=CALLS_PER_SECOND, max_workers=MAX_WORKERS,
+                 url="https://api.etherscan.io/api", cache=None):
+        self.url = url
+        self.cache = cache
+        self.keys = ApiKeyPool(api_keys, calls_per_second)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def map(self, func, items):
+        """Выполняет func для каждого элемента параллельно; результаты возвращаются в исходном порядке."""
+        return self.executor.map(func, items)
+
+    def request(self, params):
+        """Отправляет запрос к Etherscan API с обработкой ошибок; ключ и частоту запросов выбирает пул ключей."""
+        action = params.get("action", "")
+        max_retries = 4
+        retry_delay = 5
+        TELEMETRY.add("api_calls", action)
+
+        for attempt in range(max_retries):
+            key_index = None # Ключ, которым сделана попытка (None — ответ из кэша)
+            try:
+                data = self.cache.get(params) if self.cache else None
+                if data is None:
+                    if self.cache and self.cache.replay:
+                        print(f"\nПредупреждение: Нет записанного ответа для запроса {params} (режим replay). Пропуск запроса.")
+                        TELEMETRY.add("errors", "replay_miss")
+                        return None
+                    waiting_started = os_time.perf_counter()
+                    key_index = self.keys.acquire()
+                    TELEMETRY.add("sleep_seconds", "rate_limiter", os_time.perf_counter() - waiting_started)
+                    response = self.session.get(self.url, params=dict(params, apikey=self.keys.key(key_index)), timeout=HTTP_TIMEOUT)
+                    TELEMETRY.add("http_requests", action)
+                    TELEMETRY.add("key_requests", f"key{key_index + 1}") # Номер ключа в пуле, сам ключ в отчет не попадает
+                    TELEMETRY.add("bytes_received", action, len(response.content))
+                    response.raise_for_status()
+                    data = response.json()
+                    if self.cache:
+                        self.cache.put(params, data)
+                else:
+                    TELEMETRY.add("cache_hits", action)
+
+                if data.get("status") == "1":
+                    if key_index is not None:
+                        self.keys.succeeded(key_index)
+                    return data["result"]
+                elif data.get("status") == "0":
+                    message = data.get("message", "")
+                    result_val = data.get("result")
+                    error_text = f"{message} {result_val}"
+
+                    if "Result window is too large" in message:
+                        print(f"\n[Лимит Дня] Предупреждение: Достигнут лимит API Etherscan 10k ({message}) для запроса: {params}. Данные за этот день будут неполными.")
+                        TELEMETRY.add("errors", "window_10k")
+                        return "10k_limit"
+
+                    elif "Max rate limit reached" in error_text: # Etherscan пишет это в result
+                         print(f"\nПредупреждение: Достигнут лимит запросов ключа #{key_index + 1} ({message}). "
+                               f"Пауза ключа {retry_delay * (attempt + 2)} сек, повтор...")
+                         TELEMETRY.add("retries", "rate_limit") # Сама пауза попадает в sleep_seconds rate_limiter
+                         self.keys.rate_limited(key_index, retry_delay * (attempt + 2))
+                         continue # Переход к следующей попытке (другим ключом, если он свободен раньше)
+
+                    elif key_index is not None and ("Invalid API Key" in error_text or "daily" in error_text.lower()):
+                        # Недействительный ключ или исчерпанная дневная квота
+                        if self.keys.retire(key_index, str(result_val or message)):
+                            TELEMETRY.add("retries", "key_error")
+                            continue
+                        print(f"\nОшибка API Etherscan (Status 0): {message} | Result: {result_val} | Params: {params}")
+                        TELEMETRY.add("errors", "api_error")
+                        return None
+
+                    elif "No transactions found" in message or "No records found" in message:
+                        if key_index is not None:
+                            self.keys.succeeded(key_index)
+                        return None
+
+                    elif "Invalid address format" in message:
+                        print(f"\nПредупреждение: Неверный формат адреса в запросе: {params}")
+                        TELEMETRY.add("errors", "invalid_address")
+                        return None
+
+                    elif "Query Timeout" in message:
+                         print(f"\nПредупреждение: Таймаут запроса Etherscan ({message}). Повтор через {retry_delay * (attempt + 1)} сек...")
+                         TELEMETRY.add("retries", "query_timeout")
+                         TELEMETRY.add("sleep_seconds", "retry_backoff", retry_delay * (attempt + 1))
+                         os_time.sleep(retry_delay * (attempt + 1))
+                         continue # Переход к следующей попытке
+
+                    else:
+                        print(f"\nОшибка API Etherscan (Status 0): {message} | Result: {result_val} | Params: {params}")
+                        TELEMETRY.add("errors", "api_error")
+                        return None
+                else:
+                    print(f"\nНеожиданный формат ответа API Etherscan: {data}")
+                    TELEMETRY.add("errors", "unexpected_response")
+                    return None
+
+            except requests.exceptions.RequestException as e:
+                # Таймаут повторяется так же, как другие сетевые ошибки
+                reason = "timeout" if isinstance(e, requests.exceptions.Timeout) else "network"
+                print(f"\nСетевая или HTTP ошибка во время запроса к Etherscan: {e}")
+                if attempt < max_retries - 1:
+                    print(f"Повтор через {retry_delay * (attempt + 1)} секунд...")
+                    TELEMETRY.add("retries", reason)
+                    TELEMETRY.add("sleep_seconds", "retry_backoff", retry_delay * (attempt + 1))
+                    os_time.sleep(retry_delay * (attempt + 1))
+                else:
+                    print("Достигнуто максимальное количество попыток для сетевой/HTTP ошибки. Пропуск запроса.")
+                    TELEMETRY.add("errors", reason)
+                    return None
+            except Exception as e:
+                 print(f"\nПроизошла неожиданная ошибка при обработке API запроса: {e}")
+                 TELEMETRY.add("errors", "unexpected_exception")
+                 return None
+
+        print("\nНе удалось получить успешный ответ после максимального количества попыток.")
+        TELEMETRY.add("errors", "retries_exhausted")
+        return None
+
+CLIENT = EtherscanClient(ETHERSCAN_API_KEYS, cache=make_response_cache())
+
+def etherscan_request(params):
+    """Отправляет запрос к Etherscan API через общий клиент (пул соединений + ограничение частоты)."""
+    return CLIENT.request(params)
+
+class BlockIndex:
+    """
+    Индекс "timestamp -> номер блока" для getblocknobytime.
+    Хранится на диске массивом int64 [timestamp, block] (.npy), новые точки накапливаются до save().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.new_anchors = {}
+        self.recent_anchors = {} # Свежие точки: только в рамках текущего запуска
+        if os.path.exists(path):
+            self.anchors = np.load(path, mmap_mode="r")
+        else:
+            self.anchors = np.empty((0, 2), dtype=np.int64)
+
+    def _merged_anchors(self):
+        """Объединяет сохраненные и новые опорные точки в один отсортированный массив (вызывать под lock)."""
+        if self.new_anchors:
+            new_points = np.array(sorted(self.new_anchors.items()), dtype=np.int64)
+            merged = np.concatenate([np.asarray(self.anchors), new_points])
+            order = np.argsort(merged[:, 0], kind="stable")
+            merged = merged[order]
+            # При совпадении timestamp оставляем последнюю (самую свежую) точку
+            keep = np.append(merged[1:, 0] != merged[:-1, 0], True)
+            self.anchors = merged[keep]
+            self.new_anchors = {}
+        return self.anchors
+
+    def lookup(self, timestamp):
+        """Возвращает номер блока для timestamp без обращения к API или None, если индекс не может ответить точно."""
+        with self.lock:
+            if timestamp in self.recent_anchors:
+                return self.recent_anchors[timestamp]
+            anchors = self._merged_anchors()
+            if len(anchors) == 0:
+                return None
+            timestamps = anchors[:, 0]
+            right = int(np.searchsorted(timestamps, timestamp, side="right"))
+            left = right - 1
+            if left >= 0 and timestamps[left] == timestamp:
+                return int(anchors[left, 1])
+            if left >= 0 and right < len(anchors) and anchors[left, 1] == anchors[right, 1]:
+                return int(anchors[left, 1])
+            return None
+
+    def add(self, timestamp, block):
+        """Добавляет опорную точку из API; на диск попадают только достаточно старые моменты времени."""
+        with self.lock:
+            if timestamp > os_time.time() - BLOCK_INDEX_MIN_AGE:
+                self.recent_anchors[int(timestamp)] = int(block)
+            else:
+                self.new_anchors[int(timestamp)] = int(block)
+
+    def stable_block(self):
+        """
+        Номер самого позднего блока среди сохраняемых опорных точек или None. Все они старше BLOCK_INDEX_MIN_AGE,
+        поэтому трансферы в блоках до него уже не изменятся.
+        """
+        with self.lock:
+            anchors = self._merged_anchors()
+            return int(anchors[-1, 1]) if len(anchors) else None
+
+    def save(self):
+        """Атомарно записывает индекс на диск, если появились новые опорные точки."""
+        with self.lock:
+            if not self.new_anchors:
+                return
+            anchors = np.array(self._merged_anchors())
+            # Отпускаем memory map до замены файла (для Windows)
+            self.anchors = anchors
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, anchors)
+            os.replace(tmp_path, self.path)
+
+BLOCK_INDEX = BlockIndex(BLOCK_INDEX_PATH)
+
+def _is_immutable_query(params):
+    """
+    Ответ на запрос больше не изменится: номер блока для достаточно старого момента времени
+    или трансферы в закрытом диапазоне блоков, который целиком старше BLOCK_INDEX_MIN_AGE.
+    """
+    try:
+        if params.get("action") == "getblocknobytime":
+            return int(params["timestamp"]) <= os_time.time() - BLOCK_INDEX_MIN_AGE
+        if params.get("action") == "tokentx" and "endblock" in params:
+            stable_block = BLOCK_INDEX.stable_block()
+            return stable_block is not None and int(params["endblock"]) <= stable_block
+    except (ValueError, TypeError):
+        pass
+    return False
+
+def datetime_to_block(dt, closest="before"):
+    """
+    Конвертирует datetime объект в примерный номер блока Ethereum.
+    Для closest="before" сначала используется локальный индекс BLOCK_INDEX; API вызывается только при промахе.
+    """
+    timestamp = int(dt.timestamp())
+    if closest == "before":
+        block = BLOCK_INDEX.lookup(timestamp)
+        if block is not None:
+            return block
+
+    params = {
+        "module": "block",
+        "action": "getblocknobytime",
+        "timestamp": timestamp,
+        "closest": closest
+    }
+    result = etherscan_request(params)
+    if result and result != "10k_limit":
+        try:
+            block = int(result)
+        except (ValueError, TypeError):
+            print(f"\nОшибка: Не удалось конвертировать результат номера блока '{result}' в целое число для {dt}.")
+            return None
+        if closest == "before":
+            BLOCK_INDEX.add(timestamp, block)
+        return block
+    else:
+        if result == "10k_limit":
+             print(f"\nПредупреждение: Не удалось получить номер блока для {dt} из-за лимита. Результат: {result}")
+        return None
+
+def day_boundary_datetimes(days, end_date_dt):
+    """
+    Границы дневных окон: начало каждого дня и конец последнего (не позже end_date_dt).
+    На N дней возвращается N+1 граница.
+    """
+    last_boundary = min(datetime.combine(days[-1], dt_time.max), end_date_dt)
+    return [datetime.combine(day, dt_time.min) for day in days] + [last_boundary]
+
+def fetch_token_decimals(contract_address):
+    """Получает количество десятичных знаков для токена."""
+    print(f"Получение информации о токене (десятичные знаки) для {contract_address}...")
+    params_tx = {
+        "module": "account",
+        "action": "tokentx",
+        "contractaddress": contract_address,
+        "page": 1, "offset": 1, "sort": "desc"
+    }
+    tx_result = etherscan_request(params_tx)
+    if tx_result and tx_result != "10k_limit" and isinstance(tx_result, list) and len(tx_result) > 0:
+        try:
+            decimals = int(tx_result[0].get('tokenDecimal', '18'))
+            print(f"Успешно получены десятичные знаки из транзакции: {decimals}")
+            return decimals
+        except (ValueError, TypeError, KeyError) as e:
+             print(f"\nНе удалось извлечь десятичные знаки из данных транзакции: {e}. Принимаем 18.")
+             return 18
+    else:
+        print(f"\nПредупреждение: Не удалось найти транзакции для токена {contract_address}, чтобы определить десятичные знаки. Принимаем 18.")
+        return 18
+
+def transaction_key(tx):
+    """Ключ для дедупликации трансферов: один tx может содержать несколько трансферов токена."""
+    return (tx.get("hash"), tx.get("logIndex"), tx.get("from"), tx.get("to"), tx.get("value"))
+
+def _filter_range_page(transactions_page, contract_address, min_dt, max_dt):
+    """Оставляет трансферы нужного контракта, попадающие в интервал [min_dt, max_dt]."""
+    filtered = []
+    for tx in transactions_page:
+         if isinstance(tx, dict) and tx.get("contractAddress", "").lower() == contract_address.lower():
+            try:
+                timestamp = int(tx["timeStamp"])
+                tx_time = datetime.fromtimestamp(timestamp)
+                if min_dt <= tx_time <= max_dt:
+                    filtered.append(tx)
+            except (ValueError, TypeError, KeyError):
+                continue
+    return filtered
+
+def fetch_block_range_transactions(contract_address, start_block, end_block, min_dt, max_dt, first_page=None):
+    """
+    Получает трансферы токена в диапазоне блоков, деля его пополам, пока ответ не влезет в окно 10k.
+    Возвращает список транзакций и признак того, что лимит 10k все же достигнут.
+    """
+    offset = 1000
+    max_pages = MAX_RESULT_WINDOW // offset
+    base_params = {
+        "module": "account", "action": "tokentx",
+        "contractaddress": contract_address,
+        "startblock": start_block, "endblock": end_block,
+        "offset": offset, "sort": "asc"
+    }
+
+    if first_page is None:
+        first_page = etherscan_request(dict(base_params, page=1))
+    if first_page == "10k_limit":
+        if start_block == end_block:
+            return [], True
+        return _split_block_range(contract_address, start_block, end_block, min_dt, max_dt, None)
+    if not first_page or not isinstance(first_page, list):
+        return [], False
+
+    range_transactions = _filter_range_page(first_page, contract_address, min_dt, max_dt)
+    if len(first_page) < offset:
+        return range_transactions, False
+
+    # Первая страница заполнена: оцениваем число трансферов в диапазоне
+    try:
+        last_block = int(first_page[-1]["blockNumber"])
+        estimated_total = offset * (end_block - start_block + 1) / (last_block - start_block + 1)
+    except (ValueError, TypeError, KeyError, ZeroDivisionError):
+        estimated_total = MAX_RESULT_WINDOW
+    if estimated_total > MAX_RESULT_WINDOW * SPLIT_THRESHOLD and start_block < end_block:
+        return _split_block_range(contract_address, start_block, end_block, min_dt, max_dt, first_page)
+
+    page = 2
+    batch_size = max(1, min(max_pages, math.ceil(estimated_total / offset)) - 1)
+    range_finished = False
+    window_exceeded = False
+
+    while not range_finished:
+        pages = list(range(page, min(page + batch_size, max_pages + 1)))
+        pages_results = CLIENT.map(lambda p: etherscan_request(dict(base_params, page=p)), pages)
+
+        for page, transactions_page in zip(pages, pages_results):
+            if transactions_page == "10k_limit":
+                window_exceeded = True
+                break
+
+            if not transactions_page or not isinstance(transactions_page, list):
+                range_finished = True
+                break
+
+            range_transactions.extend(_filter_range_page(transactions_page, contract_address, min_dt, max_dt))
+
+            if len(transactions_page) < offset:
+                range_finished = True
+                break
+
+        if range_finished or window_exceeded:
+            break
+
+        page += 1
+        batch_size = PAGE_BATCH_SIZE
+        if page > max_pages:
+            window_exceeded = True # Все страницы окна заполнены: в диапазоне может быть больше 10k трансферов
+            break
+
+    if not window_exceeded:
+        return range_transactions, False
+    if start_block == end_block:
+        print(f"\nПредупреждение: В блоке {start_block} больше {MAX_RESULT_WINDOW} трансферов, разбить диапазон дальше нельзя. Данные будут неполными.")
+        return range_transactions, True
+    return _split_block_range(contract_address, start_block, end_block, min_dt, max_dt, first_page)
+
+def _split_block_range(contract_address, start_block, end_block, min_dt, max_dt, first_page):
+    """Делит диапазон блоков пополам и объединяет результаты, переиспользуя уже полученную первую страницу."""
+    mid_block = (start_block + end_block) // 2
+    left_first_page = None
+    left_transactions = None
+
+    if first_page and isinstance(first_page, list):
+        try:
+            last_block = int(first_page[-1]["blockNumber"])
+        except (ValueError, TypeError, KeyError):
+            last_block = None
+        if last_block is not None and last_block <= mid_block:
+            # Первая страница совпадает с первой страницей левой половины
+            left_first_page = first_page
+        elif last_block is not None:
+            # Первая страница покрывает всю левую половину
+            left_page = [tx for tx in first_page if isinstance(tx, dict) and int(tx.get("blockNumber", last_block)) <= mid_block]
+            left_transactions = _filter_range_page(left_page, contract_address, min_dt, max_dt)
+
+    left_hit_limit = False
+    if left_transactions is None:
+        left_transactions, left_hit_limit = fetch_block_range_transactions(
+            contract_address, start_block, mid_block, min_dt, max_dt, first_page=left_first_page
+        )
+    right_transactions, right_hit_limit = fetch_block_range_transactions(contract_address, mid_block + 1, end_block, min_dt, max_dt)
+    return left_transactions + right_transactions, left_hit_limit or right_hit_limit
+
+def fetch_day_transactions(contract_address, current_date, day_start_block, day_end_block):
+    """
+    Получает все трансферы токена за один день (диапазон блоков day_start_block..day_end_block).
+    Возвращает список транзакций дня и признак достижения лимита 10k.
+    """
+    day_start_dt = datetime.combine(current_date, dt_time.min)
+    day_end_dt = datetime.combine(current_date, dt_time.max)
+    day_transactions, hit_limit_today = fetch_block_range_transactions(
+        contract_address, day_start_block, day_end_block, day_start_dt, day_end_dt
+    )
+    if hit_limit_today:
+        print(f"-> Лимит 10k достигнут для {current_date}.")
+    return day_transactions, hit_limit_today
+
+def _collect_day_transactions(day_transactions, sink, unique_address_ids, completed_day, addresses):
+    """
+    Передает транзакции дня в общий упорядоченный поток (sink), пропуская повторы трансферов.
+    Участники собираются в unique_address_ids как id из AddressTable.
+    """
+    seen_keys = set()
+    unique_day_transactions = []
+    for tx in day_transactions:
+        key = transaction_key(tx)
+        if key in seen_keys:
+            continue
+        seen_keys.add(key)
+        unique_day_transactions.append(tx)
+    unique_address_ids.update(addresses.intern_many(
+        [tx.get("from", "") for tx in unique_day_transactions] + [tx.get("to", "") for tx in unique_day_transactions]
+    ))
+    sink(unique_day_transactions, completed_day)
+
+def _print_fetch_summary(all_transactions, unique_addresses, days_with_10k_limit):
+    print(f"\n--- Завершено получение транзакций по дням. ---")
+    print(f"Всего найдено транзакций за период: {len(all_transactions)}")
+    print(f"Всего найдено уникальных адресов: {len(unique_addresses)}")
+    if days_with_10k_limit:
+        print(f"Предупреждение: Лимит Etherscan в 10,000 транзакций был достигнут для следующих дат:")
+        for dt in days_with_10k_limit:
+            print(f"- {dt.strftime('%Y-%m-%d')}")
+        print("Данные за эти дни могут быть неполными.")
+    else:
+        print("Лимит Etherscan в 10,000 транзакций за день не был достигнут.")
+
+def _day_sink(contract_address, all_transactions, store):
+    """Куда складывать готовые дни: в список в памяти или сразу в колоночное хранилище на диске (с контрольной точкой)."""
+    if store is None:
+        return lambda day_transactions, completed_day: all_transactions.extend(day_transactions)
+    return lambda day_transactions, completed_day: store.append(contract_address, day_transactions, completed_day=completed_day)
+
+def _start_daily_fetch(contract_address, days, boundary_blocks, store):
+    """
+    Готовит хранилище к загрузке по дням и возвращает {дата ISO: запись} дней, уже загруженных прерванным запуском.
+    Без хранилища контрольных точек нет: все дни загружаются заново.
+    """
+    if store is None:
+        return {}
+    day_blocks = {day.isoformat(): (boundary_blocks[i], boundary_blocks[i + 1]) for i, day in enumerate(days)}
+    completed_days = store.resume(contract_address, boundary_blocks[0], day_blocks)
+    if completed_days:
+        print(f"Продолжение прерванной загрузки: {len(completed_days)} из {len(days)} дней уже в хранилище.")
+    return completed_days
+
+def _completed_day(current_date, day_start_block, day_end_block, hit_limit_today):
+    return {"date": current_date.isoformat(), "start_block": day_start_block, "end_block": day_end_block, "hit_limit": hit_limit_today}
+
+def _finish_daily_fetch(contract_address, start_date_dt, end_date_dt, boundary_blocks, all_transactions, unique_address_ids, store):
+    """Фиксирует покрытый диапазон блоков в хранилище и возвращает колонки окна и адреса из хранилища."""
+    if store is None:
+        return all_transactions, TRANSFER_STORE.addresses.wallet_addresses(unique_address_ids)
+    store.set_high_water_block(contract_address, boundary_blocks[-1])
+    all_transactions = store.read_columns(contract_address, datetime.combine(start_date_dt.date(), dt_time.min), end_date_dt)
+    return all_transactions, store.unique_addresses(all_transactions)
+
+def fetch_transactions_daily_chunks(contract_address, start_date_dt, end_date_dt, use_async=USE_ASYNC_FETCH, store=None):
+    """
+    Получает транзакции токена, разбивая период на дневные интервалы.
+    Возвращает список всех транзакций (или pyarrow.Table при store), множество уникальных адресов и список дат с достигнутым лимитом 10k.
+    """
+    if use_async:
+        return asyncio.run(fetch_transactions_daily_chunks_async(contract_address, start_date_dt, end_date_dt, store=store))
+
+    print(f"\nПолучение транзакций токена {contract_address} по дням за период с {start_date_dt.date()} по {end_date_dt.date()}...")
+    all_transactions = []
+    unique_address_ids = set()
+    addresses = (store or TRANSFER_STORE).addresses
+    days_with_10k_limit = []
+    total_days = (end_date_dt.date() - start_date_dt.date()).days + 1
+    days = [start_date_dt.date() + timedelta(days=i) for i in range(total_days)]
+
+    # Номера блоков для границ всех дней запрашиваем параллельно
+    boundary_blocks = list(CLIENT.map(lambda dt: datetime_to_block(dt, closest="before"), day_boundary_datetimes(days, end_date_dt)))
+    BLOCK_INDEX.save()
+    completed_days = _start_daily_fetch(contract_address, days, boundary_blocks, store)
+    sink = _day_sink(contract_address, all_transactions, store)
+
+    with tqdm(total=total_days, desc="Обработка дней", unit=" день") as pbar_days:
+        for day_index, current_date in enumerate(days):
+            day_start_block = boundary_blocks[day_index]
+            day_end_block = boundary_blocks[day_index + 1]
+
+            if day_start_block is None or day_end_block is None or day_end_block < day_start_block:
+                print(f"\nПредупреждение: Не удалось определить корректные блоки для даты {current_date}. Пропуск этого дня.")
+                pbar_days.update(1)
+                continue
+
+            completed_day = completed_days.get(current_date.isoformat())
+            if completed_day is not None:
+                if completed_day["hit_limit"]:
+                    days_with_10k_limit.append(current_date)
+                pbar_days.update(1)
+                continue
+
+            day_transactions, hit_limit_today = fetch_day_transactions(contract_address, current_date, day_start_block, day_end_block)
+            _collect_day_transactions(day_transactions, sink, unique_address_ids,
+                                      _completed_day(current_date, day_start_block, day_end_block, hit_limit_today), addresses)
+            if hit_limit_today:
+                days_with_10k_limit.append(current_date)
+            pbar_days.update(1)
+
+    all_transactions, unique_addresses = _finish_daily_fetch(
+        contract_address, start_date_dt, end_date_dt, boundary_blocks, all_transactions, unique_address_ids, store
+    )
+    _print_fetch_summary(all_transactions, unique_addresses, days_with_10k_limit)
+    return all_transactions, unique_addresses, days_with_10k_limit
+
+async def fetch_transactions_daily_chunks_async(contract_address, start_date_dt, end_date_dt, max_concurrent_days=MAX_CONCURRENT_DAYS, store=None):
+    """
+    Асинхронный вариант fetch_transactions_daily_chunks: до max_concurrent_days дней загружаются одновременно.
+    Возвращает тот же кортеж (all_transactions, unique_addresses, days_with_10k_limit).
+    """
+    print(f"\nПолучение транзакций токена {contract_address} по дням (asyncio) за период с {start_date_dt.date()} по {end_date_dt.date()}...")
+    all_transactions = []
+    unique_address_ids = set()
+    addresses = (store or TRANSFER_STORE).addresses
+    days_with_10k_limit = []
+    total_days = (end_date_dt.date() - start_date_dt.date()).days + 1
+    days = [start_date_dt.date() + timedelta(days=i) for i in range(total_days)]
+
+    boundary_blocks = await asyncio.gather(*(asyncio.to_thread(datetime_to_block, dt, "before") for dt in day_boundary_datetimes(days, end_date_dt)))
+    BLOCK_INDEX.save()
+    completed_days = _start_daily_fetch(contract_address, days, boundary_blocks, store)
+    sink = _day_sink(contract_address, all_transactions, store)
+
+    semaphore = asyncio.Semaphore(max_concurrent_days)
+    finished_days = asyncio.Queue()
+
+    async def run_day(day_index):
+        current_date = days[day_index]
+        day_start_block = boundary_blocks[day_index]
+        day_end_block = boundary_blocks[day_index + 1]
+        if day_start_block is None or day_end_block is None or day_end_block < day_start_block:
+            print(f"\nПредупреждение: Не удалось определить корректные блоки для даты {current_date}. Пропуск этого дня.")
+            await finished_days.put((day_index, [], False))
+            return
+        completed_day = completed_days.get(current_date.isoformat())
+        if completed_day is not None:
+            await finished_days.put((day_index, None, completed_day["hit_limit"]))
+            return
+        try:
+            async with semaphore:
+                day_transactions, hit_limit_today = await asyncio.to_thread(
+                    fetch_day_transactions, contract_address, current_date, day_start_block, day_end_block
+                )
+        except Exception as e:
+            # Ошибку передаем в основной цикл: иначе он вечно ждал бы этот день в очереди
+            await finished_days.put((day_index, e, False))
+            return
+        await finished_days.put((day_index, day_transactions, hit_limit_today))
+
+    tasks = [asyncio.create_task(run_day(day_index)) for day_index in range(total_days)]
+    pending_days = {}
+    next_day_index = 0
+
+    with tqdm(total=total_days, desc="Обработка дней", unit=" день") as pbar_days:
+        for _ in range(total_days):
+            day_index, day_transactions, hit_limit_today = await finished_days.get()
+            if isinstance(day_transactions, Exception):
+                for task in tasks:
+                    task.cancel()
+                raise day_transactions # Готовые дни уже в хранилище: перезапуск продолжит с незавершенных
+            pending_days[day_index] = (day_transactions, hit_limit_today)
+            pbar_days.update(1)
+            # Выдаем в поток только непрерывный префикс дней по датам
+            while next_day_index in pending_days:
+                day_transactions, hit_limit_today = pending_days.pop(next_day_index)
+                if day_transactions is not None: # None — день уже в хранилище после прерванного запуска
+                    current_date = days[next_day_index]
+                    _collect_day_transactions(day_transactions, sink, unique_address_ids, _completed_day(
+                        current_date, boundary_blocks[next_day_index], boundary_blocks[next_day_index + 1], hit_limit_today
+                    ), addresses)
+                if hit_limit_today:
+                    days_with_10k_limit.append(days[next_day_index])
+                next_day_index += 1
+
+    await asyncio.gather(*tasks)
+
+    all_transactions, unique_addresses = _finish_daily_fetch(
+        contract_address, start_date_dt, end_date_dt, boundary_blocks, all_transactions, unique_address_ids, store
+    )
+    _print_fetch_summary(all_transactions, unique_addresses, days_with_10k_limit)
+    return all_transactions, unique_addresses, days_with_10k_limit
+
+
+TRANSFER_SCHEMA = pa.schema([
+    ("block", pa.int64()),
+    ("timestamp", pa.int64()),
+    ("from_id", pa.int32()),
+    ("to_id", pa.int32()),
+    ("value", pa.decimal128(38, 0)),
+    ("hash", pa.binary(32)),
+    ("log_index", pa.int32()),
+])
+
+def _write_arrow_file(path, table):
+    """Атомарно записывает таблицу в несжатый Arrow IPC файл (такие файлы читаются через memory mapping без копирования)."""
+    tmp_path = path + ".tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+def _read_arrow_file(path):
+    """Открывает Arrow IPC файл через memory mapping."""
+    return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+def address_key(address):
+    """Нормализованный ключ адреса: 20 байт для hex-адреса, байты строки для некорректного значения."""
+    if address and len(address) == 42 and address[:2] in ("0x", "0X"):
+        try:
+            return bytes.fromhex(address[2:])
+        except ValueError:
+            pass
+    return (address or "").encode("utf-8")[:255] # Длина ключа в файле AddressTable — один байт
+
+def address_hex(key):
+    """Обратное преобразование ключа в адрес "0x..." в нижнем регистре — только для вывода и запросов к API."""
+    return "0x" + key.hex() if len(key) == 20 else key.decode("utf-8", errors="replace")
+
+@contextmanager
+def _file_lock(path):
+    """Эксклюзивная блокировка файла path между процессами (например, двумя скриптами на одном ETHERSCAN_DATA_DIR)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a+b") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0) # msvcrt блокирует байты с текущей позиции
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError: # LK_LOCK сдается после 10 попыток
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+class AddressTable:
+    """
+    Таблица интернирования адресов: 20-байтный адрес <-> плотный int32 id, общая для всех контрактов.
+    Файл — журнал ключей, id — номер записи; новые id выделяются под блокировкой файла.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.keys = []
+        self.ids = {}
+        self.offset = 0 # Размер прочитанной части журнала
+        with self.lock, _file_lock(path + ".lock"):
+            self._migrate_arrow()
+            self._read_new()
+
+    def _migrate_arrow(self):
+        """Переносит таблицу старого формата (addresses.arrow) в журнал."""
+        arrow_path = os.path.splitext(self.path)[0] + ".arrow"
+        if os.path.exists(self.path) or not os.path.exists(arrow_path):
+            return
+        column = _read_arrow_file(arrow_path).column("address")
+        keys = [address_key(address) for address in column.to_pylist()] if pa.types.is_string(column.type) else column.to_pylist()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(bytes([len(key)]) + key for key in keys))
+        os.replace(tmp_path, self.path)
+        os.remove(arrow_path)
+
+    def _read_new(self):
+        """Дочитывает записи, добавленные в журнал (в т.ч. другими процессами); недописанный хвост пропускается."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        position = 0
+        while position < len(data) and position + 1 + data[position] <= len(data):
+            key = data[position + 1:position + 1 + data[position]]
+            self.ids.setdefault(key, len(self.keys))
+            self.keys.append(key)
+            position += 1 + data[position]
+        self.offset += position
+
+    def intern_many(self, addresses):
+        """Возвращает список id адресов, при необходимости выделяя новые (одна блокировка файла на вызов)."""
+        keys = [address_key(address) for address in addresses]
+        if any(key not in self.ids for key in keys):
+            with self.lock, _file_lock(self.path + ".lock"):
+                self._read_new()
+                new_keys = [key for key in dict.fromkeys(keys) if key not in self.ids]
+                if new_keys:
+                    with open(self.path, "ab") as f:
+                        f.truncate(self.offset) # Хвост, недописанный при сбое
+                        f.write(b"".join(bytes([len(key)]) + key for key in new_keys))
+                    for key in new_keys:
+                        self.ids[key] = len(self.keys)
+                        self.keys.append(key)
+                    self.offset = os.path.getsize(self.path)
+        return [self.ids[key] for key in keys]
+
+    def intern(self, address):
+        """Возвращает id адреса, при необходимости выделяя новый."""
+        address_id = self.ids.get(address_key(address))
+        return self.intern_many([address])[0] if address_id is None else address_id
+
+    def id(self, address):
+        """id уже известного адреса или None."""
+        key = address_key(address)
+        if key not in self.ids:
+            with self.lock:
+                self._read_new()
+        return self.ids.get(key)
+
+    def address(self, address_id):
+        if address_id >= len(self.keys):
+            with self.lock:
+                self._read_new()
+        return address_hex(self.keys[address_id])
+
+    def wallet_addresses(self, address_ids):
+        """Адреса кошельков для набора id: без нулевого адреса и пустых значений."""
+        excluded = {self.id(ZERO_ADDRESS), self.id("")}
+        return [self.address(int(address_id)) for address_id in address_ids if int(address_id) not in excluded]
+
+class TransferStore:
+    """
+    Колоночное хранилище трансферов: партиции Arrow IPC и meta.json на каждый контракт.
+    meta.json хранит покрытый диапазон блоков, готовые дни (контрольная точка) и дни с лимитом 10k.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self._addresses = None
+
+    @property
+    def addresses(self):
+        """AddressTable хранилища, читается с диска при первом обращении."""
+        if self._addresses is None:
+            with self.lock:
+                if self._addresses is None:
+                    self._addresses = AddressTable(os.path.join(self.root, "addresses.bin"))
+        return self._addresses
+
+    def _contract_dir(self, contract_address):
+        return os.path.join(self.root, contract_address.lower())
+
+    def meta(self, contract_address):
+        """Возвращает метаданные контракта {'start_block', 'high_water_block', 'partitions'} или None, если данных нет."""
+        meta_path = os.path.join(self._contract_dir(contract_address), "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_meta(self, contract_address, meta):
+        meta_path = os.path.join(self._contract_dir(contract_address), "meta.json")
+        tmp_path = meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def reset(self, contract_address, start_block):
+        """Удаляет все данные контракта перед полной загрузкой окна, начинающегося с start_block."""
+        contract_dir = self._contract_dir(contract_address)
+        meta = self.meta(contract_address)
+        if meta:
+            for partition in meta["partitions"]:
+                os.remove(os.path.join(contract_dir, partition["file"]))
+        os.makedirs(contract_dir, exist_ok=True)
+        self._write_meta(contract_address, {"start_block": start_block, "high_water_block": None, "partitions": [],
+                                            "completed_days": [], "limit_days": []})
+
+    def resume(self, contract_address, start_block, day_blocks):
+        """
+        Начинает загрузку окна с start_block, сохраняя готовые дни с теми же границами блоков из day_blocks.
+        Возвращает {дата ISO: запись о готовом дне}.
+        """
+        meta = self.meta(contract_address)
+        day_files = {day["file"] for day in (meta or {}).get("completed_days", []) if day["file"]}
+        if (meta is None or meta["start_block"] != start_block or "completed_days" not in meta
+                or day_files != {partition["file"] for partition in meta["partitions"]}):
+            # Партиции без привязки к дням продолжить нельзя
+            self.reset(contract_address, start_block)
+            return {}
+
+        contract_dir = self._contract_dir(contract_address)
+        completed_days = {}
+        for day in meta["completed_days"]:
+            if tuple(day_blocks.get(day["date"], ())) == (day["start_block"], day["end_block"]):
+                completed_days[day["date"]] = day
+            elif day["file"]:
+                os.remove(os.path.join(contract_dir, day["file"]))
+        kept_files = {day["file"] for day in completed_days.values() if day["file"]}
+        for name in os.listdir(contract_dir):
+            # Партиции, записанные перед сбоем, но не попавшие в meta.json
+            if name.startswith("part-") and name not in kept_files:
+                os.remove(os.path.join(contract_dir, name))
+        meta["partitions"] = [partition for partition in meta["partitions"] if partition["file"] in kept_files]
+        meta["completed_days"] = list(completed_days.values())
+        meta["limit_days"] = sorted(day["date"] for day in completed_days.values() if day["hit_limit"])
+        meta["high_water_block"] = None
+        self._write_meta(contract_address, meta)
+        return completed_days
+
+    def _to_table(self, transactions):
+        """Преобразует страницу ответов Etherscan в типизированные колонки."""
+        columns = {name: [] for name in TRANSFER_SCHEMA.names}
+        for tx in transactions:
+            try:
+                block = int(tx["blockNumber"])
+                timestamp = int(tx["timeStamp"])
+            except (ValueError, TypeError, KeyError):
+                continue
+            try:
+                value = int(tx.get("value", "0"))
+                if value >= 10 ** 38:
+                    print(f"\nПредупреждение: Сумма трансфера {tx.get('hash')} не помещается в decimal128 и будет сохранена как пустая.")
+                    value = None
+            except (ValueError, TypeError):
+                value = None
+            tx_hash = tx.get("hash") or ""
+            try:
+                hash_bytes = bytes.fromhex(tx_hash[2:]) if len(tx_hash) == 66 else None
+            except ValueError:
+                hash_bytes = None
+            try:
+                log_index = int(tx["logIndex"])
+            except (ValueError, TypeError, KeyError):
+                log_index = None
+            columns["block"].append(block)
+            columns["timestamp"].append(timestamp)
+            columns["from_id"].append(tx.get("from", ""))
+            columns["to_id"].append(tx.get("to", ""))
+            columns["value"].append(value)
+            columns["hash"].append(hash_bytes)
+            columns["log_index"].append(log_index)
+        address_ids = self.addresses.intern_many(columns["from_id"] + columns["to_id"])
+        columns["from_id"], columns["to_id"] = address_ids[:len(columns["block"])], address_ids[len(columns["block"]):]
+        return pa.table(columns, schema=TRANSFER_SCHEMA)
+
+    def _write_partition(self, contract_address, table):
+        blocks = table.column("block")
+        timestamps = table.column("timestamp")
+        partition = {
+            "file": f"part-{pc.min(blocks).as_py():010d}-{pc.max(blocks).as_py():010d}-{os_time.time_ns()}.arrow",
+            "min_block": pc.min(blocks).as_py(), "max_block": pc.max(blocks).as_py(),
+            "min_timestamp": pc.min(timestamps).as_py(), "max_timestamp": pc.max(timestamps).as_py(),
+            "rows": table.num_rows,
+        }
+        _write_arrow_file(os.path.join(self._contract_dir(contract_address), partition["file"]), table)
+        return partition
+
+    def append(self, contract_address, transactions, high_water_block=None, completed_day=None, limit_days=()):
+        """
+        Дописывает трансферы новой партицией; при переданном high_water_block сдвигает его.
+        completed_day и limit_days отмечают готовый день и дни с лимитом 10k в контрольной точке.
+        """
+        self.append_table(contract_address, self._to_table(transactions), high_water_block, completed_day, limit_days)
+
+    def append_table(self, contract_address, table, high_water_block=None, completed_day=None, limit_days=()):
+        """То же, что append, для готовой таблицы в схеме TRANSFER_SCHEMA (адреса уже интернированы)."""
+        meta = self.meta(contract_address)
+        limit_days = {day.isoformat() for day in limit_days}
+        if completed_day is not None and completed_day["hit_limit"]:
+            limit_days.add(completed_day["date"])
+        if limit_days:
+            meta["limit_days"] = sorted(limit_days.union(meta.get("limit_days", [])))
+        partition = None
+        if table.num_rows:
+            partition = self._write_partition(contract_address, table)
+            meta["partitions"].append(partition)
+        if completed_day is not None:
+            meta["completed_days"].append(dict(completed_day, file=partition["file"] if partition else None))
+        else:
+            meta.pop("completed_days", None)
+        if high_water_block is not None:
+            meta["high_water_block"] = high_water_block
+        self._write_meta(contract_address, meta)
+
+    def set_high_water_block(self, contract_address, high_water_block):
+        meta = self.meta(contract_address)
+        meta["high_water_block"] = high_water_block
+        self._write_meta(contract_address, meta)
+
+    def read_columns(self, contract_address, start_dt=None, end_dt=None, columns=None, start_block=None, end_block=None):
+        """
+        Читает колонки трансферов контракта через memory mapping, при необходимости ограничивая время и блоки.
+        Возвращает pyarrow.Table в порядке блоков.
+        """
+        columns = list(columns or TRANSFER_SCHEMA.names)
+        tables = list(self.iter_batches(contract_address, start_dt, end_dt, columns, start_block, end_block))
+        if not tables:
+            return TRANSFER_SCHEMA.empty_table().select(columns)
+        return pa.concat_tables(tables)
+
+    def iter_batches(self, contract_address, start_dt=None, end_dt=None, columns=None, start_block=None, end_block=None):
+        """То же, что read_columns, но по одной партиции за раз (генератор pyarrow.Table)."""
+        columns = list(columns or TRANSFER_SCHEMA.names)
+        meta = self.meta(contract_address)
+        bounds = [] # (колонка, ключ минимума, ключ максимума, нижняя граница, верхняя граница)
+        if start_dt or end_dt:
+            bounds.append(("timestamp", "min_timestamp", "max_timestamp",
+                           math.ceil(start_dt.timestamp()) if start_dt else None,
+                           math.floor(end_dt.timestamp()) if end_dt else None))
+        if start_block is not None or end_block is not None:
+            bounds.append(("block", "min_block", "max_block", start_block, end_block))
+
+        for partition in (meta["partitions"] if meta else []):
+            if any((low is not None and partition[max_key] < low) or (high is not None and partition[min_key] > high)
+                   for _, min_key, max_key, low, high in bounds):
+                continue
+            table = _read_arrow_file(os.path.join(self._contract_dir(contract_address), partition["file"]))
+            mask = None
+            for column, min_key, max_key, low, high in bounds:
+                for condition in ((pc.greater_equal(table.column(column), low) if low is not None and partition[min_key] < low else None),
+                                  (pc.less_equal(table.column(column), high) if high is not None and partition[max_key] > high else None)):
+                    if condition is not None:
+                        mask = condition if mask is None else pc.and_(mask, condition)
+            table = table.select(columns)
+            yield table.filter(mask) if mask is not None else table
+
+    def prune(self, contract_address, start_dt, start_block):
+        """Удаляет трансферы старше start_dt: хранилище держит только скользящее окно анализа."""
+        meta = self.meta(contract_address)
+        if meta is None or meta["start_block"] >= start_block:
+            return
+        start_ts = math.ceil(start_dt.timestamp())
+        contract_dir = self._contract_dir(contract_address)
+        kept_partitions = []
+        for partition in meta["partitions"]:
+            path = os.path.join(contract_dir, partition["file"])
+            if partition["max_timestamp"] < start_ts:
+                os.remove(path)
+            elif partition["min_timestamp"] < start_ts:
+                table = _read_arrow_file(path)
+                table = table.filter(pc.greater_equal(table.column("timestamp"), start_ts))
+                os.remove(path)
+                if table.num_rows:
+                    kept_partitions.append(self._write_partition(contract_address, table))
+            else:
+                kept_partitions.append(partition)
+        meta["partitions"] = kept_partitions
+        meta["start_block"] = start_block
+        meta["limit_days"] = [day for day in meta.get("limit_days", []) if day >= start_dt.date().isoformat()]
+        meta.pop("completed_days", None)
+        self._write_meta(contract_address, meta)
+
+    def limit_days(self, contract_address, start_dt, end_dt):
+        """Даты окна [start_dt, end_dt], данные которых в хранилище неполны из-за лимита 10k."""
+        meta = self.meta(contract_address) or {}
+        return [datetime.fromisoformat(day).date() for day in meta.get("limit_days", [])
+                if start_dt.date().isoformat() <= day <= end_dt.date().isoformat()]
+
+    def unique_addresses(self, transfers):
+        """Уникальные адреса отправителей и получателей колоночной таблицы трансферов (без нулевого адреса)."""
+        address_ids = np.unique(np.concatenate([
+            transfers.column("from_id").to_numpy(), transfers.column("to_id").to_numpy()
+        ]))
+        return self.addresses.wallet_addresses(address_ids)
+
+TRANSFER_STORE = TransferStore(TRANSFER_STORE_DIR)
+
+def fetch_transactions_incremental(contract_address, start_date_dt, end_date_dt, store=TRANSFER_STORE):
+    """
+    Инкрементальная загрузка: из API запрашиваются только блоки после high_water_block прошлого запуска.
+    Возвращает тот же кортеж, что и fetch_transactions_daily_chunks с store.
+    """
+    window_start_dt = datetime.combine(start_date_dt.date(), dt_time.min)
+    window_start_block = datetime_to_block(window_start_dt, closest="before")
+    head_block = datetime_to_block(end_date_dt, closest="before")
+    BLOCK_INDEX.save()
+
+    meta = store.meta(contract_address)
+    if (window_start_block is None or head_block is None or meta is None
+            or meta["high_water_block"] is None or meta["start_block"] > window_start_block):
+        print("\nЛокальное хранилище не покрывает окно: полная загрузка по дням.")
+        return fetch_transactions_daily_chunks(contract_address, start_date_dt, end_date_dt, store=store)
+
+    from_block = meta["high_water_block"] + 1
+    if from_block <= head_block:
+        print(f"\nИнкрементальная загрузка трансферов токена {contract_address}: блоки {from_block}..{head_block}...")
+        new_transactions, hit_limit = fetch_block_range_transactions(
+            contract_address, from_block, head_block, window_start_dt, end_date_dt
+        )
+        limit_days = []
+        if hit_limit:
+            # Неполными считаются дни с последнего сохраненного трансфера
+            last_ts = max((partition["max_timestamp"] for partition in meta["partitions"]), default=None)
+            first_day = max(window_start_dt.date(), datetime.fromtimestamp(last_ts).date() if last_ts else window_start_dt.date())
+            limit_days = [first_day + timedelta(days=i) for i in range((end_date_dt.date() - first_day).days + 1)]
+        store.append(contract_address, new_transactions, head_block, limit_days=limit_days)
+        print(f"Получено новых трансферов: {len(new_transactions)}")
+    else:
+        print("\nНовых блоков с прошлого запуска нет.")
+    store.prune(contract_address, window_start_dt, window_start_block)
+
+    all_transactions = store.read_columns(contract_address, window_start_dt, end_date_dt)
+    unique_addresses = store.unique_addresses(all_transactions)
+    days_with_10k_limit = store.limit_days(contract_address, window_start_dt, end_date_dt) # В т.ч. дни прошлых запусков
+
+    _print_fetch_summary(all_transactions, unique_addresses, days_with_10k_limit)
+    return all_transactions, unique_addresses, days_with_10k_limit
+
+def _amount_limbs(values):
+    """Суммы decimal128(38, 0) -> массив uint32 формы (n, 4) с 32-битными разрядами (младший первым)."""
+    if len(values) == 0:
+        return np.zeros((0, 4), dtype=np.uint32)
+    values = pc.fill_null(values, pa.scalar(0, values.type))
+    if isinstance(values, pa.ChunkedArray):
+        values = values.combine_chunks()
+    return np.frombuffer(values.buffers()[1], dtype=np.uint32, count=4 * len(values), offset=16 * values.offset).reshape(-1, 4)
+
+def _amount_ints(values):
+    """Суммы decimal128(38, 0) -> список целых Python (пустые — 0) без создания объектов Decimal."""
+    limbs = _amount_limbs(values).astype(np.uint64)
+    low = (limbs[:, 0] | (limbs[:, 1] << np.uint64(32))).tolist()
+    high = (limbs[:, 2] | (limbs[:, 3] << np.uint64(32))).tolist()
+    return [lo | (hi << 64) if hi else lo for lo, hi in zip(low, high)]
+
+def _parse_amount(value):
+    """Сумма из ответа Etherscan -> целое в минимальных единицах (некорректная — 0)."""
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return 0
+
+def _aggregate_transfer_rows(rows, aggregated=None):
+    """
+    Однопроходная агрегация строк (timestamp, день, отправитель, получатель, сумма) в состояния адресов.
+    Если передан aggregated, строки добавляются к уже накопленным состояниям.
+    """
+    aggregated = {} if aggregated is None else aggregated
+
+    def get_state(key):
+        state = aggregated.get(key)
+        if state is None:
+            state = {
+                "tx_count": 0, "incoming_tx_count": 0, "outgoing_tx_count": 0,
+                "volume_in": 0, "volume_out": 0,
+                "counterparties": set(), "first_ts": None, "last_ts": None, "days": set()
+            }
+            aggregated[key] = state
+        return state
+
+    for timestamp, tx_day, sender, receiver, value in rows:
+        participants = (sender,) if sender == receiver else (sender, receiver)
+        for key in participants:
+            state = get_state(key)
+            state["tx_count"] += 1
+            state["days"].add(tx_day)
+            if state["first_ts"] is None or timestamp < state["first_ts"]: state["first_ts"] = timestamp
+            if state["last_ts"] is None or timestamp > state["last_ts"]: state["last_ts"] = timestamp
+
+        # Исходящая сторона учитывается приоритетно, как и в расчете по одному адресу
+        sender_state = aggregated[sender]
+        sender_state["outgoing_tx_count"] += 1
+        sender_state["volume_out"] += value
+        if receiver != sender:
+            sender_state["counterparties"].add(receiver)
+            receiver_state = aggregated[receiver]
+            receiver_state["incoming_tx_count"] += 1
+            receiver_state["volume_in"] += value
+            receiver_state["counterparties"].add(sender)
+    return aggregated
+
+def _finalize_period_metrics(aggregated, key_to_address, divisor):
+    """
+    Преобразует состояния агрегации в метрики периода, ключ — адрес в нижнем регистре.
+    Точные целые объемы делятся на divisor (10^decimals) один раз на адрес.
+    """
+    metrics_by_address = {}
+    for key, state in aggregated.items():
+        volume_in = state["volume_in"] / divisor
+        volume_out = state["volume_out"] / divisor
+        metrics_by_address[key_to_address(key)] = {
+            "period_total_tx_count": state["tx_count"],
+            "period_incoming_tx_count": state["incoming_tx_count"],
+            "period_outgoing_tx_count": state["outgoing_tx_count"],
+            "period_total_volume_in": volume_in,
+            "period_total_volume_out": volume_out,
+            "period_avg_volume_in": volume_in / state["incoming_tx_count"] if state["incoming_tx_count"] > 0 else 0.0,
+            "period_avg_volume_out": volume_out / state["outgoing_tx_count"] if state["outgoing_tx_count"] > 0 else 0.0,
+            "period_unique_counterparties": len(state["counterparties"]),
+            "period_first_tx_date": datetime.fromtimestamp(state["first_ts"]),
+            "period_last_tx_date": datetime.fromtimestamp(state["last_ts"]),
+            "period_active_days": len(state["days"]),
+        }
+    return metrics_by_address
+
+def _transaction_rows(all_period_transactions, start_dt, end_dt, addresses):
+    """Строки для агрегации из списка ответов Etherscan (словарей); адреса интернируются в id таблицы addresses."""
+    period_transactions = []
+    for tx in all_period_transactions:
+        # Дополнительно убедимся, что транзакция точно в периоде (на случай неточности при сборе)
+        try:
+            timestamp = int(tx["timeStamp"])
+            tx_time = datetime.fromtimestamp(timestamp)
+        except (ValueError, TypeError, KeyError):
+            continue
+        if start_dt <= tx_time <= end_dt:
+            period_transactions.append((timestamp, tx_time, tx))
+
+    address_ids = addresses.intern_many([tx.get("from", "") for _, _, tx in period_transactions] +
+                                        [tx.get("to", "") for _, _, tx in period_transactions])
+    for index, (timestamp, tx_time, tx) in enumerate(period_transactions):
+        yield timestamp, tx_time.date(), address_ids[index], address_ids[len(period_transactions) + index], _parse_amount(tx.get("value", "0"))
+
+def _column_rows(transfers, start_dt, end_dt, starts=None):
+    """
+    Строки для агрегации из колоночной таблицы хранилища.
+    При starts вместо id адресов выдаются ключи id * число окон + окно ноги.
+    """
+    timestamps = transfers.column("timestamp")
+    mask = pc.and_(pc.greater_equal(timestamps, math.ceil(start_dt.timestamp())),
+                   pc.less_equal(timestamps, math.floor(end_dt.timestamp())))
+    transfers = transfers.select(["timestamp", "from_id", "to_id", "value"]).filter(mask)
+    timestamps = transfers.column("timestamp").to_numpy()
+    senders = transfers.column("from_id").to_numpy().astype(np.int64)
+    receivers = transfers.column("to_id").to_numpy().astype(np.int64)
+    if starts:
+        levels = len(starts) - np.searchsorted(starts, timestamps, side="right")
+        senders = senders * len(starts) + levels
+        receivers = receivers * len(starts) + levels
+    for timestamp, sender_id, receiver_id, value in zip(
+        timestamps.tolist(), senders.tolist(), receivers.tolist(), _amount_ints(transfers.column("value"))
+    ):
+        yield timestamp, datetime.fromtimestamp(timestamp).date(), sender_id, receiver_id, value
+
+def aggregate_period_metrics(all_period_transactions, token_decimals, start_dt, end_dt, addresses=None):
+    """
+    Рассчитывает метрики сразу для ВСЕХ адресов за один проход по транзакциям периода.
+    Возвращает словарь {адрес: метрики} в схеме calculate_period_metrics, но без текущего баланса.
+    """
+    divisor = 10 ** token_decimals
+    addresses = addresses or TRANSFER_STORE.addresses
+    if isinstance(all_period_transactions, pa.Table):
+        aggregated = _aggregate_transfer_rows(_column_rows(all_period_transactions, start_dt, end_dt))
+    else:
+        aggregated = _aggregate_transfer_rows(_transaction_rows(all_period_transactions, start_dt, end_dt, addresses))
+    return _finalize_period_metrics(aggregated, addresses.address, divisor)
+
+def _window_levels(start_dt, end_dt, windows):
+    """
+    Вложенные окна, заканчивающиеся в end_dt: период и последние N дней для каждого N из windows.
+    Возвращает начала окон по возрастанию и пары (уровень, суффикс столбцов).
+    """
+    label_starts = [("", start_dt.timestamp())] if start_dt is not None else []
+    label_starts += [(f"_{days}d", (end_dt - timedelta(days=days)).timestamp()) for days in sorted(windows)]
+    starts = sorted({start for _, start in label_starts})
+    return starts, [(len(starts) - 1 - starts.index(start), suffix) for suffix, start in label_starts]
+
+def _window_key_rows(rows, starts):
+    """Строки _transaction_rows для вложенных окон starts с ключами id * число окон + окно ноги, как в _column_rows."""
+    levels = len(starts)
+    for timestamp, tx_day, sender, receiver, value in rows:
+        level = levels - bisect_right(starts, timestamp)
+        yield timestamp, tx_day, sender * levels + level, receiver * levels + level, value
+
+def _finalize_window_states(states, labels, divisor):
+    """Состояния кошелька по уровням окон -> {<метрика><суффикс>: значение} для уровней labels."""
+    levels = len(states)
+    total = None
+    by_level = []
+    for state in states:
+        if state is not None:
+            if total is None:
+                total = {"tx_count": 0, "incoming_tx_count": 0, "outgoing_tx_count": 0, "volume_in": 0, "volume_out": 0,
+                         "counterparties": set(), "first_ts": state["first_ts"], "last_ts": state["last_ts"], "days": set()}
+            for key in ("tx_count", "incoming_tx_count", "outgoing_tx_count", "volume_in", "volume_out"):
+                total[key] += state[key]
+            total["first_ts"] = min(total["first_ts"], state["first_ts"])
+            total["last_ts"] = max(total["last_ts"], state["last_ts"])
+            total["counterparties"].update(key // levels for key in state["counterparties"])
+            total["days"].update(state["days"])
+        if total is None:
+            volumes = ("period_total_volume_in", "period_total_volume_out", "period_avg_volume_in", "period_avg_volume_out")
+            by_level.append({**dict.fromkeys(PERIOD_METRIC_COLUMNS, 0), **dict.fromkeys(volumes, 0.0),
+                             "period_first_tx_date": None, "period_last_tx_date": None})
+        else:
+            by_level.append(_finalize_period_metrics({0: total}, lambda key: key, divisor)[0])
+    return {f"{name}{suffix}": value for level, suffix in labels for name, value in by_level[level].items()}
+
+class StreamingPeriodMetrics:
+    """
+    Инкрементальный вариант aggregate_period_metrics и aggregate_window_metrics по пачкам трансферов.
+    Между пачками хранятся только состояния кошельков; "sharded" считается как "pandas" в одном процессе.
+    """
+
+    def __init__(self, token_decimals, start_dt, end_dt, addresses=None, windows=(), backend=METRICS_BACKEND):
+        self.divisor = 10 ** token_decimals
+        self.start_dt = start_dt
+        self.end_dt = end_dt
+        self.read_start_dt = min([start_dt] + [end_dt - timedelta(days=days) for days in windows])
+        self.addresses = addresses or TRANSFER_STORE.addresses
+        self.starts, self.labels = _window_levels(start_dt, end_dt, windows)
+        if backend == "sharded":
+            print("\nПредупреждение: Потоковый расчет метрик не распределяется по процессам, "
+                  "режим \"sharded\" выполняется как \"pandas\" в одном процессе.")
+        self.vectorized = backend != "python"
+        self.aggregated = {}
+        self.partials = []
+
+    def update(self, batch):
+        """Добавляет пачку трансферов: pyarrow.Table в схеме хранилища или список ответов Etherscan."""
+        if not isinstance(batch, pa.Table):
+            rows = list(_transaction_rows(batch, self.read_start_dt, self.end_dt, self.addresses))
+            if not self.vectorized:
+                _aggregate_transfer_rows(_window_key_rows(rows, self.starts), self.aggregated)
+                return
+            if not rows:
+                return
+            # Адреса уже в id таблицы addresses: пачка приводится к колонкам хранилища
+            timestamps, _, senders, receivers, values = zip(*rows)
+            batch = pa.table({
+                "timestamp": pa.array(timestamps, TRANSFER_SCHEMA.field("timestamp").type),
+                "from_id": pa.array(senders, TRANSFER_SCHEMA.field("from_id").type),
+                "to_id": pa.array(receivers, TRANSFER_SCHEMA.field("to_id").type),
+                "value": pa.array([value if value < 10 ** 38 else None for value in values], TRANSFER_SCHEMA.field("value").type),
+            })
+        elif not self.vectorized:
+            _aggregate_transfer_rows(_column_rows(batch, self.read_start_dt, self.end_dt, self.starts), self.aggregated)
+            return
+        transfers, _ = _transfers_frame(batch, self.read_start_dt, self.end_dt, self.addresses)
+        if len(transfers):
+            self.partials.append(_window_partials(transfers, self.starts))
+        if len(self.partials) >= STREAM_PARTIALS_MERGE:
+            self.partials = [_merge_window_partials(self.partials)]
+
+    def _finalize_vectorized(self):
+        """Метрики всех кошельков из частичных агрегатов (один раз, при первом pop в режиме pandas/sharded)."""
+        if self.partials:
+            self.aggregated = _window_partials_metrics(_merge_window_partials(self.partials), self.labels, self.divisor,
+                                                       self.addresses.address)
+        self.partials = None
+
+    def pop(self, address):
+        """Метрики адреса с освобождением его состояния: (метрики периода или None, метрики окон)."""
+        if self.vectorized:
+            if self.partials is not None:
+                self._finalize_vectorized()
+            row = self.aggregated.pop(address.lower(), None)
+        else:
+            address_id = self.addresses.id(address)
+            levels = len(self.starts)
+            states = [self.aggregated.pop(address_id * levels + level, None) for level in range(levels)] if address_id is not None else []
+            row = _finalize_window_states(states, self.labels, self.divisor) if any(states) else None
+        if row is None:
+            return None, {}
+        period = {column: row.pop(column) for column in PERIOD_METRIC_COLUMNS}
+        return (period if period["period_total_tx_count"] else None), row
+
+def _transfers_frame(all_period_transactions, start_dt, end_dt, addresses):
+    """
+    Приводит трансферы периода к DataFrame с кодами адресов, timestamp и разрядами суммы AMOUNT_LIMBS.
+    Возвращает DataFrame и функцию, переводящую код обратно в адрес.
+    """
+    if isinstance(all_period_transactions, pa.Table):
+        addresses = addresses or TRANSFER_STORE.addresses
+        frame = all_period_transactions.select(["timestamp", "from_id", "to_id"]).to_pandas()
+        frame.columns = ["timestamp", "sender", "receiver"]
+        frame[AMOUNT_LIMBS] = _amount_limbs(all_period_transactions.column("value"))
+        code_to_address = addresses.address
+    else:
+        raw = pd.DataFrame.from_records(
+            ((tx.get("timeStamp"), tx.get("from", ""), tx.get("to", ""), tx.get("value", "0")) for tx in all_period_transactions),
+            columns=["timestamp", "sender", "receiver", "value"],
+        )
+        timestamps = pd.to_numeric(raw["timestamp"], errors="coerce")
+        raw = raw[timestamps.notna()]
+        codes, uniques = pd.factorize(pd.concat([raw["sender"], raw["receiver"]]).str.lower())
+        values = [_parse_amount(value) for value in raw["value"]]
+        frame = pd.DataFrame({
+            "timestamp": timestamps[timestamps.notna()].astype(np.int64).to_numpy(),
+            "sender": codes[:len(raw)],
+            "receiver": codes[len(raw):],
+        })
+        frame[AMOUNT_LIMBS] = _amount_limbs(pa.array([value if value < 10 ** 38 else None for value in values], TRANSFER_SCHEMA.field("value").type))
+        code_to_address = lambda code: uniques[code]
+
+    frame = frame[(frame["timestamp"] >= math.ceil(start_dt.timestamp())) & (frame["timestamp"] <= math.floor(end_dt.timestamp()))]
+    return frame, code_to_address
+
+def aggregate_period_metrics_vectorized(all_period_transactions, token_decimals, start_dt, end_dt, addresses=None):
+    """Векторный (pandas/NumPy) вариант aggregate_period_metrics с тем же результатом."""
+    transfers, code_to_address = _transfers_frame(all_period_transactions, start_dt, end_dt, addresses)
+    return _per_address_metrics(_aggregate_transfers_frame(transfers), code_to_address, 10 ** token_decimals)
+
+PERIOD_METRIC_COLUMNS = [
+    "period_total_tx_count", "period_incoming_tx_count", "period_outgoing_tx_count",
+    "period_total_volume_in", "period_total_volume_out", "period_avg_volume_in", "period_avg_volume_out",
+    "period_unique_counterparties", "period_active_days",
+    "period_first_tx_date", "period_last_tx_date",
+]
+
+def window_columns(windows):
+    """Имена столбцов многооконных метрик: <метрика>_<N>d для каждого окна."""
+    return [f"{column}_{days}d" for days in sorted(windows) for column in PERIOD_METRIC_COLUMNS]
+
+def _window_partials(transfers, starts):
+    """
+    Частичные агрегаты ног трансферов по вложенным окнам с началами starts.
+    Возвращает totals, days и counterparties, которые объединяются между пачками (_merge_window_partials).
+    """
+    legs = _transfer_legs(transfers)
+    legs["window"] = len(starts) - np.searchsorted(starts, legs["timestamp"].to_numpy(), side="right")
+    legs["day"] += datetime.fromtimestamp(int(transfers["timestamp"].min())).date().toordinal()
+
+    totals = legs.groupby(["address", "window"]).agg(
+        tx_count=("timestamp", "size"),
+        incoming=("incoming", "sum"),
+        outgoing=("outgoing", "sum"),
+        first_ts=("timestamp", "min"),
+        last_ts=("timestamp", "max"),
+    )
+    for column, limb_sums in zip(("volume_in", "volume_out"), _volume_limb_sums(legs, ["address", "window"])):
+        limb_sums = limb_sums.reindex(totals.index, fill_value=0)
+        for limb in AMOUNT_LIMBS:
+            totals[f"{column}_{limb}"] = limb_sums[limb].to_numpy(dtype=np.uint64)
+    days = legs.groupby(["address", "day"])["window"].min()
+    counterparty_legs = legs[legs["address"] != legs["counterparty"]]
+    counterparties = counterparty_legs.groupby(["address", "counterparty"])["window"].min()
+    return totals, days, counterparties
+
+def _merge_window_partials(partials):
+    """Объединяет частичные агрегаты _window_partials нескольких пачек в один такой же набор."""
+    if len(partials) == 1:
+        return partials[0]
+    totals, days, counterparties = (pd.concat(parts) for parts in zip(*partials))
+    aggregations = {column: "sum" for column in totals.columns}
+    aggregations.update(first_ts="min", last_ts="max")
+    return (totals.groupby(level=["address", "window"]).agg(aggregations),
+            days.groupby(level=["address", "day"]).min(),
+            counterparties.groupby(level=["address", "counterparty"]).min())
+
+def _window_partials_metrics(partials, labels, divisor, code_to_address):
+    """Частичные агрегаты _window_partials -> {адрес: {<метрика><суффикс>: значение}} для уровней labels."""
+    totals, days, counterparties = partials
+    window_index = range(max(level for level, _ in labels) + 1)
+
+    def prefix(frame, fill, accumulate):
+        return frame.unstack("window", fill_value=fill).reindex(columns=window_index, fill_value=fill).T.pipe(accumulate).T
+
+    sums = {column: prefix(totals[column], 0, pd.DataFrame.cumsum) for column in ("tx_count", "incoming", "outgoing")}
+    # Объемы — префиксные суммы по 32-битным разрядам
+    volume_limbs = {
+        column: [prefix(totals[f"{column}_{limb}"], 0, pd.DataFrame.cumsum) for limb in AMOUNT_LIMBS]
+        for column in ("volume_in", "volume_out")
+    }
+    first_ts = prefix(totals["first_ts"], np.inf, pd.DataFrame.cummin)
+    last_ts = prefix(totals["last_ts"], -np.inf, pd.DataFrame.cummax)
+    index = sums["tx_count"].index
+    active_days = prefix(days.groupby(level="address").value_counts().rename_axis(["address", "window"]), 0, pd.DataFrame.cumsum)
+    active_days = active_days.reindex(index=index, fill_value=0)
+    counterparties = prefix(counterparties.groupby(level="address").value_counts().rename_axis(["address", "window"]), 0, pd.DataFrame.cumsum)
+    counterparties = counterparties.reindex(index=index, fill_value=0)
+
+    def window_volumes(column, i):
+        limbs = np.column_stack([limb[i].reindex(index, fill_value=0).to_numpy() for limb in volume_limbs[column]])
+        return np.array([total / divisor for total in _limb_totals(limbs)], dtype=float)
+
+    columns = {}
+    for i, suffix in labels:
+        incoming_count = sums["incoming"][i].to_numpy()
+        outgoing_count = sums["outgoing"][i].to_numpy()
+        volume_in = window_volumes("volume_in", i)
+        volume_out = window_volumes("volume_out", i)
+        columns.update({
+            f"period_total_tx_count{suffix}": sums["tx_count"][i].tolist(),
+            f"period_incoming_tx_count{suffix}": incoming_count.tolist(),
+            f"period_outgoing_tx_count{suffix}": outgoing_count.tolist(),
+            f"period_total_volume_in{suffix}": volume_in.tolist(),
+            f"period_total_volume_out{suffix}": volume_out.tolist(),
+            f"period_avg_volume_in{suffix}": np.divide(volume_in, incoming_count, out=np.zeros_like(volume_in), where=incoming_count > 0).tolist(),
+            f"period_avg_volume_out{suffix}": np.divide(volume_out, outgoing_count, out=np.zeros_like(volume_out), where=outgoing_count > 0).tolist(),
+            f"period_unique_counterparties{suffix}": counterparties[i].tolist(),
+            f"period_active_days{suffix}": active_days[i].tolist(),
+            f"period_first_tx_date{suffix}": [datetime.fromtimestamp(int(ts)) if np.isfinite(ts) else None for ts in first_ts[i].to_numpy()],
+            f"period_last_tx_date{suffix}": [datetime.fromtimestamp(int(ts)) if np.isfinite(ts) else None for ts in last_ts[i].to_numpy()],
+        })
+    names = list(columns)
+    return {
+        code_to_address(int(code)): dict(zip(names, values))
+        for code, values in zip(index, zip(*columns.values()))
+    }
+
+def aggregate_window_metrics(all_period_transactions, token_decimals, windows, end_dt, addresses=None):
+    """
+    Метрики сразу для нескольких окон "последние N дней до end_dt" за один проход по трансферам.
+    Возвращает {адрес: {<метрика>_<N>d: значение}}.
+    """
+    starts, labels = _window_levels(None, end_dt, windows)
+    transfers, code_to_address = _transfers_frame(all_period_transactions, end_dt - timedelta(days=max(windows)), end_dt, addresses)
+    if len(transfers) == 0:
+        return {}
+    return _window_partials_metrics(_window_partials(transfers, starts), labels, 10 ** token_decimals, code_to_address)
+
+GRAPH_FEATURE_COLUMNS = [
+    "graph_degree", "graph_in_degree", "graph_out_degree", "graph_weighted_degree", "graph_volume_degree",
+    "graph_in_out_ratio", "graph_pagerank", "graph_two_hop_reach",
+]
+
+class CounterpartyGraph:
+    """
+    Разреженный граф контрагентов окна над id адресов (CSR по числу трансферов и объему).
+    Трансферы добавляются пачками (add), признаки всех кошельков считает features.
+    """
+
+    def __init__(self, divisor):
+        self.divisor = divisor
+        self.counts = sp.csr_matrix((0, 0), dtype=np.int64)
+        self.volumes = sp.csr_matrix((0, 0), dtype=np.float64)
+
+    def add(self, transfers):
+        """Добавляет DataFrame трансферов из _transfers_frame (sender, receiver, AMOUNT_LIMBS)."""
+        transfers = transfers[transfers["sender"] != transfers["receiver"]]
+        if len(transfers) == 0:
+            return
+        senders = transfers["sender"].to_numpy()
+        receivers = transfers["receiver"].to_numpy()
+        size = max(self.counts.shape[0], int(senders.max()) + 1, int(receivers.max()) + 1)
+        # Объем ребра нужен только как вес: разряды сразу во float
+        volumes = transfers[AMOUNT_LIMBS].to_numpy(dtype=np.float64) @ np.array([1.0, 2.0 ** 32, 2.0 ** 64, 2.0 ** 96]) / self.divisor
+        self.counts.resize((size, size))
+        self.volumes.resize((size, size))
+        self.counts = self.counts + sp.csr_matrix((np.ones(len(senders), dtype=np.int64), (senders, receivers)), shape=(size, size))
+        self.volumes = self.volumes + sp.csr_matrix((volumes, (senders, receivers)), shape=(size, size))
+
+    def features(self, code_to_address):
+        """{адрес: признаки GRAPH_FEATURE_COLUMNS} для всех адресов, у которых есть хотя бы одно ребро."""
+        counts = self.counts
+        active = np.flatnonzero((counts.getnnz(axis=1) > 0) | (counts.getnnz(axis=0) > 0))
+        counts = counts[active][:, active].tocsr()
+        volumes = self.volumes[active][:, active].tocsr()
+        undirected = ((counts + counts.T) > 0).astype(np.int32).tocsr() # int8 переполняется в числе путей B @ B
+
+        in_tx = np.asarray(counts.sum(axis=0)).ravel()
+        out_tx = np.asarray(counts.sum(axis=1)).ravel()
+        columns = {
+            "graph_degree": np.diff(undirected.indptr),
+            "graph_in_degree": counts.getnnz(axis=0),
+            "graph_out_degree": counts.getnnz(axis=1),
+            "graph_weighted_degree": in_tx + out_tx,
+            "graph_volume_degree": np.asarray(volumes.sum(axis=0)).ravel() + np.asarray(volumes.sum(axis=1)).ravel(),
+            "graph_in_out_ratio": (in_tx + 1) / (out_tx + 1), # Сглаженное отношение: конечно и для кошельков с одной стороной
+            "graph_pagerank": _pagerank(counts),
+            "graph_two_hop_reach": _two_hop_reach(undirected),
+        }
+        values = [column.tolist() for column in columns.values()]
+        return {
+            code_to_address(code): dict(zip(GRAPH_FEATURE_COLUMNS, row))
+            for code, row in zip(active.tolist(), zip(*values))
+        }
+
+def _pagerank(weights, damping=PAGERANK_DAMPING, max_iter=PAGERANK_MAX_ITER, tol=PAGERANK_TOL):
+    """
+    PageRank по направлению движения токенов (веса — число трансферов) степенным методом.
+    Масса кошельков без исходящих трансферов распределяется равномерно; сумма рангов равна 1.
+    """
+    n = weights.shape[0]
+    if n == 0:
+        return np.zeros(0)
+    out_weight = np.asarray(weights.sum(axis=1), dtype=np.float64).ravel()
+    dangling = out_weight == 0
+    inverse = np.divide(1.0, out_weight, out=np.zeros(n), where=~dangling)
+    transition = (sp.diags(inverse) @ weights).T.tocsr()
+    rank = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        updated = damping * (transition @ rank + rank[dangling].sum() / n) + (1.0 - damping) / n
+        converged = np.abs(updated - rank).sum() < tol
+        rank = updated
+        if converged:
+            break
+    return rank
+
+def _two_hop_reach(adjacency, exact_limit=REACH_EXACT_LIMIT, sketches=REACH_SKETCHES, seed=0):
+    """
+    Число адресов на расстоянии 1-2 шага в неориентированном графе adjacency.
+    Адреса с суммой степеней соседей больше exact_limit оцениваются по sketches.
+    """
+    n = adjacency.shape[0]
+    degree = np.diff(adjacency.indptr)
+    walks = adjacency @ degree
+    reach = np.zeros(n)
+
+    exact = np.flatnonzero(walks <= exact_limit)
+    # Строки для точного подсчета пачками по ~4 млн ненулевых в B[rows] @ B
+    chunk_ids = np.cumsum(walks[exact] + degree[exact]) // 2 ** 22
+    for rows in np.split(exact, np.flatnonzero(np.diff(chunk_ids)) + 1):
+        if len(rows):
+            block = adjacency[rows]
+            two_hop = (block + block @ adjacency).tocsr()
+            # Сам адрес достижим за два шага, если у него есть сосед
+            reach[rows] = np.diff(two_hop.indptr) - (degree[rows] > 0)
+
+    approximate = np.flatnonzero(walks > exact_limit)
+    if len(approximate):
+        rng = np.random.default_rng(seed)
+        indices = adjacency.indices
+        has_neighbors = degree > 0
+        starts = adjacency.indptr[:-1][has_neighbors]
+
+        def closed_neighborhood_min(values):
+            result = values.copy()
+            result[:, has_neighbors] = np.minimum(result[:, has_neighbors], np.minimum.reduceat(values[:, indices], starts, axis=1))
+            return result
+
+        totals = np.zeros(n)
+        chunk = max(1, min(sketches, 2 ** 25 // max(len(indices), 1))) # Не больше ~128 МБ float32 на пачку хэшей
+        for begin in range(0, sketches, chunk):
+            hashes = rng.exponential(size=(min(chunk, sketches - begin), n)).astype(np.float32)
+            totals += closed_neighborhood_min(closed_neighborhood_min(hashes)).sum(axis=0, dtype=np.float64)
+        reach[approximate] = np.maximum((sketches - 1) / totals[approximate] - 1, 0.0)
+    return reach
+
+def counterparty_graph_features(all_period_transactions, token_decimals, start_dt, end_dt, addresses=None):
+    """
+    Признаки графа контрагентов за период: степени, PageRank и охват за два шага.
+    Возвращает {адрес: признаки}; адреса без контрагентов в словарь не попадают.
+    """
+    transfers, code_to_address = _transfers_frame(all_period_transactions, start_dt, end_dt, addresses)
+    graph = CounterpartyGraph(10 ** token_decimals)
+    graph.add(transfers)
+    return graph.features(code_to_address)
+
+def aggregate_period_metrics_sharded(all_period_transactions, token_decimals, start_dt, end_dt, addresses=None,
+                                     workers=METRICS_WORKERS, shards=METRICS_SHARDS):
+    """
+    Многопроцессный вариант aggregate_period_metrics_vectorized: адреса делятся на шарды по хэшу кода.
+    Процессы metrics_worker.py читают трансферы из временного Arrow файла и возвращают метрики своих шардов.
+    """
+    shards = shards or workers
+    transfers, code_to_address = _transfers_frame(all_period_transactions, start_dt, end_dt, addresses)
+    if workers <= 1 or shards <= 1 or len(transfers) == 0:
+        return _per_address_metrics(_aggregate_transfers_frame(transfers), code_to_address, 10 ** token_decimals)
+
+    # Плотные коды: процессам передается список адресов только этого периода
+    codes, active = pd.factorize(np.concatenate([transfers["sender"].to_numpy(), transfers["receiver"].to_numpy()]))
+    transfers["sender"], transfers["receiver"] = codes[:len(transfers)], codes[len(transfers):]
+    os.makedirs(os.path.join(DATA_DIR, "tmp"), exist_ok=True)
+    base = os.path.join(DATA_DIR, "tmp", f"metrics-{os.getpid()}-{os_time.time_ns()}")
+    paths = [base + "-transfers.arrow", base + "-addresses.arrow"]
+    processes = []
+    try:
+        _write_arrow_file(paths[0], pa.Table.from_pandas(transfers, preserve_index=False))
+        _write_arrow_file(paths[1], pa.table({"address": [code_to_address(int(code)) for code in active]}))
+        del transfers
+        workers = min(workers, shards)
+        for index in range(workers):
+            processes.append(subprocess.Popen(
+                [sys.executable, metrics_worker.__file__, *paths, str(shards),
+                 ",".join(map(str, range(index, shards, workers))), str(10 ** token_decimals)],
+                stdout=subprocess.PIPE,
+            ))
+        metrics_by_address = {}
+        for process in processes:
+            output, _ = process.communicate()
+            if process.returncode != 0:
+                raise RuntimeError(f"Процесс расчета метрик завершился с кодом {process.returncode}")
+            metrics_by_address.update(pickle.loads(output))
+        return metrics_by_address
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+METRICS_BACKENDS = {
+    "python": aggregate_period_metrics,
+    "pandas": aggregate_period_metrics_vectorized,
+    "sharded": aggregate_period_metrics_sharded,
+}
+
+def build_wallet_metrics(address, metrics_by_address, token_decimals, raw_balance=None, contract_address=None,
+                         window_metrics=None, windows=(), graph_features=None):
+    """
+    Собирает итоговую строку метрик для адреса из результата aggregate_period_metrics и текущего баланса.
+    window_metrics и graph_features добавляют столбцы окон и признаки графа.
+    """
+    metrics = {
+        "address": address,
+        "period_total_tx_count": 0, "period_incoming_tx_count": 0, "period_outgoing_tx_count": 0,
+        "period_total_volume_in": 0.0, "period_total_volume_out": 0.0,
+        "period_avg_volume_in": 0.0, "period_avg_volume_out": 0.0,
+        "period_unique_counterparties": 0,
+        "period_first_tx_date": None, "period_last_tx_date": None, "period_active_days": 0,
+        "current_link_balance": 0.0
+    }
+    address_metrics = metrics_by_address.get(address.lower())
+    if address_metrics:
+        metrics.update(address_metrics)
+    if windows:
+        for column in window_columns(windows):
+            metrics[column] = None if "_date_" in column else 0
+        metrics.update((window_metrics or {}).get(address.lower(), {}))
+    if graph_features is not None:
+        metrics.update(dict.fromkeys(GRAPH_FEATURE_COLUMNS, 0))
+        metrics.update(graph_features.get(address.lower(), {}))
+
+    if raw_balance is None:
+        raw_balance = fetch_token_balance(address, contract_address)
+    metrics["current_link_balance"] = raw_balance / (10 ** token_decimals) if token_decimals else 0.0
+    return metrics
+
+def calculate_period_metrics(address, all_period_transactions, token_decimals, start_dt, end_dt, contract_address=None):
+    """
+    Рассчитывает метрики для ОДНОГО адреса на основе списка ВСЕХ транзакций за период.
+    Без contract_address контракт для запроса баланса берется из транзакций.
+    """
+    if contract_address is None:
+        contract_address = next((tx["contractAddress"] for tx in all_period_transactions if tx.get("contractAddress")), None)
+    address_lower = address.lower()
+    address_transactions = [
+        tx for tx in all_period_transactions
+        if tx.get("from", "").lower() == address_lower or tx.get("to", "").lower() == address_lower
+    ]
+    metrics_by_address = aggregate_period_metrics(address_transactions, token_decimals, start_dt, end_dt)
+    return build_wallet_metrics(address, metrics_by_address, token_decimals, raw_balance=None if contract_address else 0,
+                                contract_address=contract_address)
+
+def fetch_token_balance(address, contract_address):
+    """Получает текущий баланс токена ERC-20 для адреса."""
+    params = {
+        "module": "account", "action": "tokenbalance",
+        "contractaddress": contract_address, "address": address, "tag": "latest"
+    }
+    result = etherscan_request(params)
+    if result and result != "10k_limit":
+         try: return int(result)
+         except (ValueError, TypeError): return 0
+    else: return 0
+
+class EtherscanBalanceProvider:
+    """Балансы через Etherscan tokenbalance: один запрос на пару (кошелек, токен), запросы идут параллельно через CLIENT."""
+
+    def fetch_balances_multi(self, pairs, progress=True):
+        """Принимает список пар (адрес, контракт) и возвращает {(адрес, контракт): баланс в минимальных единицах}."""
+        balances_iter = CLIENT.map(lambda pair: fetch_token_balance(*pair), pairs)
+        if progress:
+            balances_iter = tqdm(balances_iter, total=len(pairs), desc="Балансы (Etherscan)", unit=" кошелек")
+        return dict(zip(pairs, balances_iter))
+
+    def fetch_balances(self, addresses, contract_address, progress=True):
+        """Возвращает {адрес: баланс в минимальных единицах токена}."""
+        balances = self.fetch_balances_multi([(address, contract_address) for address in addresses], progress=progress)
+        return {address: balance for (address, _), balance in balances.items()}
+
+def _encode_balance_of(address):
+    """calldata для balanceOf(address) или None для некорректного адреса."""
+    address_hex = address.lower()[2:] if address.lower().startswith("0x") else address.lower()
+    if len(address_hex) != 40:
+        return None
+    try:
+        int(address_hex, 16)
+    except ValueError:
+        return None
+    return BALANCE_OF_SELECTOR + address_hex.rjust(64, "0")
+
+def _encode_multicall_aggregate3(calls):
+    """ABI-кодирование вызова Multicall3.aggregate3((address,bool,bytes)[]) для списка пар (контракт, calldata balanceOf)."""
+    words = [f"{0x20:064x}", f"{len(calls):064x}"]
+    tuple_size = 32 * 6 # Кортеж Call3 в ABI-кодировке
+    words += [f"{32 * len(calls) + i * tuple_size:064x}" for i in range(len(calls))]
+    for contract_address, call_data in calls:
+        payload = call_data[2:]
+        words += [contract_address.lower()[2:].rjust(64, "0"), f"{1:064x}", f"{0x60:064x}",
+                  f"{len(payload) // 2:064x}", payload.ljust(128, "0")]
+    return MULTICALL3_AGGREGATE3_SELECTOR + "".join(words)
+
+def _decode_multicall_aggregate3(result_hex):
+    """Декодирует (bool success, bytes returnData)[] из ответа aggregate3; для неуспешных вызовов — None."""
+    data = bytes.fromhex(result_hex[2:] if result_hex.startswith("0x") else result_hex)
+    word = lambda offset: int.from_bytes(data[offset:offset + 32], "big")
+    array_start = word(0)
+    count = word(array_start)
+    heads_start = array_start + 32
+    balances = []
+    for i in range(count):
+        tuple_start = heads_start + word(heads_start + 32 * i)
+        success = word(tuple_start) != 0
+        bytes_start = tuple_start + word(tuple_start + 32)
+        return_data = data[bytes_start + 32: bytes_start + 32 + word(bytes_start)]
+        balances.append(int.from_bytes(return_data[:32], "big") if success and len(return_data) >= 32 else None)
+    return balances
+
+class JsonRpcBalanceProvider:
+    """
+    Балансы через JSON-RPC ноду: batch-запросы eth_call balanceOf или Multicall3.aggregate3.
+    Пары, для которых нода не вернула баланс, запрашиваются через fallback.
+    """
+
+    def __init__(self, url, batch_size=RPC_BATCH_SIZE, use_multicall=RPC_USE_MULTICALL, fallback=None,
+                 max_concurrent_batches=RPC_MAX_CONCURRENT_BATCHES):
+        self.url = url
+        self.batch_size = batch_size
+        self.use_multicall = use_multicall
+        self.fallback = fallback or EtherscanBalanceProvider()
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrent_batches)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent_batches)
+
+    def _post(self, payload):
+        response = self.session.post(self.url, json=payload, timeout=60)
+        TELEMETRY.add("http_requests", "json_rpc")
+        TELEMETRY.add("bytes_received", "json_rpc", len(response.content))
+        response.raise_for_status()
+        return response.json()
+
+    def _fetch_batch_eth_call(self, pairs):
+        requests_batch = []
+        for request_id, (address, contract_address) in enumerate(pairs):
+            call_data = _encode_balance_of(address)
+            if call_data is not None:
+                requests_batch.append({
+                    "jsonrpc": "2.0", "id": request_id, "method": "eth_call",
+                    "params": [{"to": contract_address, "data": call_data}, "latest"],
+                })
+        balances = [None] * len(pairs)
+        if not requests_batch:
+            return balances
+        responses = self._post(requests_batch)
+        for item in responses if isinstance(responses, list) else []:
+            result = item.get("result")
+            if item.get("id") is not None and 0 <= item["id"] < len(pairs) and isinstance(result, str) and len(result) >= 3:
+                try:
+                    balances[item["id"]] = int(result, 16)
+                except ValueError:
+                    pass
+        return balances
+
+    def _fetch_batch_multicall(self, pairs):
+        calls_data = [_encode_balance_of(address) for address, _ in pairs]
+        valid_indexes = [i for i, call_data in enumerate(calls_data) if call_data is not None]
+        balances = [None] * len(pairs)
+        if not valid_indexes:
+            return balances
+        calls = [(pairs[i][1], calls_data[i]) for i in valid_indexes]
+        payload = {
+            "jsonrpc": "2.0", "id": 1, "method": "eth_call",
+            "params": [{"to": MULTICALL3_ADDRESS, "data": _encode_multicall_aggregate3(calls)}, "latest"],
+        }
+        result = self._post(payload).get("result")
+        if isinstance(result, str):
+            for i, balance in zip(valid_indexes, _decode_multicall_aggregate3(result)):
+                balances[i] = balance
+        return balances
+
+    def _fetch_batch(self, pairs):
+        try:
+            if self.use_multicall:
+                return self._fetch_batch_multicall(pairs)
+            return self._fetch_batch_eth_call(pairs)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"\nПредупреждение: Ошибка JSON-RPC при запросе балансов ({e}). Пачка будет запрошена через резервный источник.")
+            return [None] * len(pairs)
+
+    def fetch_balances_multi(self, pairs, progress=True):
+        """Принимает список пар (адрес, контракт) и возвращает {(адрес, контракт): баланс в минимальных единицах}."""
+        # Балансы одного кошелька по разным токенам — в одну пачку
+        pairs = sorted(pairs, key=lambda pair: (pair[0].lower(), pair[1].lower()))
+        batches = [pairs[i:i + self.batch_size] for i in range(0, len(pairs), self.batch_size)]
+        balances = {}
+        missing = []
+        with tqdm(total=len(pairs), desc="Балансы (JSON-RPC)", unit=" кошелек", disable=not progress) as pbar:
+            for batch, batch_balances in zip(batches, self.executor.map(self._fetch_batch, batches)):
+                for pair, balance in zip(batch, batch_balances):
+                    if balance is None:
+                        missing.append(pair)
+                    else:
+                        balances[pair] = balance
+                pbar.update(len(batch))
+        if missing:
+            print(f"\nБалансы {len(missing)} адресов не получены через JSON-RPC, запрос через резервный источник...")
+            balances.update(self.fallback.fetch_balances_multi(missing, progress=progress))
+        return balances
+
+    def fetch_balances(self, addresses, contract_address, progress=True):
+        """Возвращает {адрес: баланс в минимальных единицах токена}."""
+        balances = self.fetch_balances_multi([(address, contract_address) for address in addresses], progress=progress)
+        return {address: balance for (address, _), balance in balances.items()}
+
+def make_balance_provider():
+    """JSON-RPC провайдер балансов, если задан ETH_RPC_URL, иначе Etherscan."""
+    if ETH_RPC_URL:
+        return JsonRpcBalanceProvider(ETH_RPC_URL)
+    return EtherscanBalanceProvider()
+
+class BalanceLedger:
+    """
+    Балансы кошельков, восстановленные воспроизведением трансферов из TransferStore.
+    Хранится в <каталог контракта>/balances.arrow.
+    """
+
+    def __init__(self, store, contract_address):
+        self.store = store
+        self.contract_address = contract_address
+        self.path = os.path.join(store._contract_dir(contract_address), "balances.arrow")
+        self.balances = {}
+        self.uncertain_until = {}
+        self.as_of_block = None
+        if os.path.exists(self.path):
+            table = _read_arrow_file(self.path)
+            self.as_of_block = int(table.schema.metadata[b"as_of_block"])
+            for address_id, balance, uncertain_until in zip(
+                table.column("address_id").to_pylist(), table.column("balance").to_pylist(),
+                table.column("uncertain_until").to_pylist()
+            ):
+                self.balances[address_id] = int(balance)
+                self.uncertain_until[address_id] = uncertain_until
+
+    def advance(self, head_block):
+        """Применяет к балансам трансферы блоков (as_of_block, head_block] из хранилища."""
+        meta = self.store.meta(self.contract_address)
+        if self.as_of_block is not None and head_block is not None and head_block <= self.as_of_block:
+            return
+        if self.as_of_block is None or meta is None or meta["start_block"] > self.as_of_block + 1:
+            # Нет непрерывной истории после as_of_block: журнал начинается заново
+            self.balances = {}
+            self.uncertain_until = {}
+            self.as_of_block = head_block
+            return
+
+        transfers = self.store.read_columns(
+            self.contract_address, columns=["block", "from_id", "to_id", "value"],
+            start_block=self.as_of_block + 1, end_block=head_block
+        )
+        for block, sender_id, receiver_id, value in zip(
+            transfers.column("block").to_pylist(), transfers.column("from_id").to_pylist(),
+            transfers.column("to_id").to_pylist(), transfers.column("value").to_pylist()
+        ):
+            for address_id, sign in ((sender_id, -1), (receiver_id, 1)):
+                if address_id not in self.balances:
+                    continue
+                if value is None or block <= self.uncertain_until[address_id]:
+                    del self.balances[address_id]
+                    del self.uncertain_until[address_id]
+                else:
+                    self.balances[address_id] += sign * int(value)
+        self.as_of_block = head_block
+
+    def known_balances(self, addresses):
+        """Возвращает {адрес: баланс} для адресов, баланс которых известен из журнала."""
+        known = {}
+        for address in addresses:
+            address_id = self.store.addresses.id(address)
+            if address_id in self.balances:
+                known[address] = self.balances[address_id]
+        return known
+
+    def seed(self, balances, uncertain_until_block):
+        """Добавляет балансы, полученные из API по тегу latest не позже блока uncertain_until_block."""
+        for address_id, balance in zip(self.store.addresses.intern_many(list(balances)), balances.values()):
+            self.balances[address_id] = balance
+            self.uncertain_until[address_id] = uncertain_until_block
+
+    def save(self):
+        address_ids = list(self.balances)
+        table = pa.table({
+            "address_id": pa.array(address_ids, pa.int32()),
+            "balance": pa.array([str(self.balances[address_id]) for address_id in address_ids], pa.string()),
+            "uncertain_until": pa.array([self.uncertain_until[address_id] for address_id in address_ids], pa.int64()),
+        }).replace_schema_metadata({"as_of_block": str(self.as_of_block)})
+        _write_arrow_file(self.path, table)
+
+class BalanceCheckpoint:
+    """
+    Контрольная точка запроса балансов в JSON Lines файле.
+    После перезапуска уже запрошенные пары (адрес, контракт) не запрашиваются снова.
+    """
+
+    def __init__(self, contracts, checkpoint_dir=CHECKPOINT_DIR, max_age=CHECKPOINT_MAX_AGE):
+        contracts_key = "-".join(sorted(contract_address.lower()[2:10] for contract_address in contracts))
+        self.path = os.path.join(checkpoint_dir, f"balances-{contracts_key}.jsonl")
+        self.max_age = max_age
+
+    def load(self):
+        """Возвращает {(адрес, контракт): баланс} из контрольной точки, если она не устарела."""
+        if not os.path.exists(self.path) or os_time.time() - os.path.getmtime(self.path) > self.max_age:
+            return {}
+        balances = {}
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    balances[(record["address"], record["contract"])] = int(record["balance"])
+                except (ValueError, KeyError):
+                    continue # Последняя строка может быть оборвана сбоем посреди записи
+        return balances
+
+    def append(self, balances):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            for (address, contract_address), balance in balances.items():
+                f.write(json.dumps({"address": address, "contract": contract_address, "balance": str(balance)}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def _fetch_balances_checkpointed(balance_provider, pairs, checkpoint):
+    """Запрашивает балансы пачками, сохраняя каждую готовую пачку в контрольную точку."""
+    balances = {}
+    with tqdm(total=len(pairs), desc="Балансы", unit=" кошелек") as pbar:
+        for i in range(0, len(pairs), CHECKPOINT_BATCH_SIZE):
+            batch_balances = balance_provider.fetch_balances_multi(pairs[i:i + CHECKPOINT_BATCH_SIZE], progress=False)
+            checkpoint.append(batch_balances)
+            balances.update(batch_balances)
+            pbar.update(len(pairs[i:i + CHECKPOINT_BATCH_SIZE]))
+    return balances
+
+def fetch_token_balances(addresses_by_contract, balance_provider, use_ledger=USE_BALANCE_LEDGER, store=TRANSFER_STORE, checkpoint=None):
+    """Балансы кошельков сразу по нескольким токенам: {контракт: [адреса]} -> {контракт: {адрес: баланс}}."""
+    balances_by_contract = {contract_address: {} for contract_address in addresses_by_contract}
+    ledgers = {}
+    missing_pairs = []
+    for contract_address, addresses in addresses_by_contract.items():
+        meta = store.meta(contract_address)
+        head_block = meta["high_water_block"] if meta else None
+        if use_ledger and head_block is not None:
+            ledger = BalanceLedger(store, contract_address)
+            ledger.advance(head_block)
+            balances_by_contract[contract_address] = ledger.known_balances(addresses)
+            ledgers[contract_address] = ledger
+        known = balances_by_contract[contract_address]
+        missing_pairs.extend((address, contract_address) for address in addresses if address not in known)
+
+    if ledgers:
+        known_count = sum(len(balances) for balances in balances_by_contract.values())
+        print(f"\nБалансы из журнала трансферов: {known_count}, запрос через API: {len(missing_pairs)}")
+    if checkpoint is None:
+        fetched = balance_provider.fetch_balances_multi(missing_pairs)
+    else:
+        resumed = checkpoint.load()
+        resumed = {pair: resumed[pair] for pair in missing_pairs if pair in resumed}
+        if resumed:
+            print(f"\nБалансы из контрольной точки прерванного запуска: {len(resumed)}")
+        # Балансы из контрольной точки в журнал не попадают
+        for (address, contract_address), balance in resumed.items():
+            balances_by_contract[contract_address][address] = balance
+        fetched = _fetch_balances_checkpointed(balance_provider, [pair for pair in missing_pairs if pair not in resumed], checkpoint)
+    for (address, contract_address), balance in fetched.items():
+        balances_by_contract[contract_address][address] = balance
+
+    if ledgers:
+        uncertain_until_block = datetime_to_block(datetime.now(), closest="before")
+        for contract_address, ledger in ledgers.items():
+            if uncertain_until_block is not None:
+                ledger.seed({address: balance for (address, contract), balance in fetched.items() if contract == contract_address},
+                            uncertain_until_block)
+            ledger.save()
+    return balances_by_contract
+
+async def fetch_tokens_async(contracts, start_date_dt, end_date_dt, incremental=INCREMENTAL_FETCH, store=TRANSFER_STORE,
+                             use_async=USE_ASYNC_FETCH):
+    """
+    Загружает трансферы нескольких токенов одновременно через общий CLIENT и индекс блоков.
+    Возвращает {контракт: (all_transactions, unique_addresses, days_with_10k_limit)}.
+    """
+    async def fetch_one(contract_address):
+        if incremental:
+            return await asyncio.to_thread(fetch_transactions_incremental, contract_address, start_date_dt, end_date_dt, store)
+        if not use_async:
+            return await asyncio.to_thread(fetch_transactions_daily_chunks, contract_address, start_date_dt, end_date_dt,
+                                           use_async=False, store=store)
+        return await fetch_transactions_daily_chunks_async(contract_address, start_date_dt, end_date_dt, store=store)
+
+    # Границы дней общие для всех токенов: запрашиваем их один раз
+    total_days = (end_date_dt.date() - start_date_dt.date()).days + 1
+    days = [start_date_dt.date() + timedelta(days=i) for i in range(total_days)]
+    with TELEMETRY.phase("block_lookup"):
+        await asyncio.gather(*(asyncio.to_thread(datetime_to_block, dt, "before") for dt in day_boundary_datetimes(days, end_date_dt)))
+        BLOCK_INDEX.save()
+
+    with TELEMETRY.phase("fetch"):
+        results = await asyncio.gather(*(fetch_one(contract_address) for contract_address in contracts))
+    return dict(zip(contracts, results))
+
+def wallet_columns(windows, graph_features=False):
+    """Порядок столбцов файла с метриками кошельков (общий для всех токенов и форматов)."""
+    return (["address", "current_link_balance"] + PERIOD_METRIC_COLUMNS + window_columns(windows)
+            + (GRAPH_FEATURE_COLUMNS if graph_features else []))
+
+def _wallet_column_type(column):
+    if column == "address":
+        return pa.string()
+    if "_date" in column:
+        return pa.timestamp("s")
+    if column.startswith("graph_"):
+        return pa.int64() if column in ("graph_degree", "graph_in_degree", "graph_out_degree", "graph_weighted_degree") else pa.float64()
+    if "count" in column or "counterparties" in column or "active_days" in column:
+        return pa.int64()
+    return pa.float64()
+
+def _wallet_metrics_filename(token_symbol, extension):
+    timestamp_str = END_DATE_DT.strftime("%Y%m%d_%H%M%S")
+    return f"{token_symbol.lower()}_wallet_activity_{DAYS_BACK}d_daily_{timestamp_str}.{extension}"
+
+def _print_limit_warning(days_hit_limit):
+    if days_hit_limit:
+        print("\n*** ВАЖНОЕ ПРЕДУПРЕЖДЕНИЕ ***")
+        print("Из-за достижения лимита Etherscan в 10,000 транзакций для некоторых дней,")
+        print("общий список транзакций и рассчитанные метрики могут быть НЕПОЛНЫМИ.")
+        print("Даты с потенциально неполными данными:")
+        for dt in days_hit_limit: print(f"- {dt.strftime('%Y-%m-%d')}")
+        print("****************************")
+
+def save_wallet_metrics_csv(all_wallet_metrics, token_symbol, days_hit_limit):
+    """Сохраняет метрики кошельков одного токена в CSV (схема столбцов общая для всех токенов)."""
+    if not all_wallet_metrics:
+        print(f"Нет данных {token_symbol} для сохранения в CSV.")
+        return None
+    df = pd.DataFrame(all_wallet_metrics)
+    df = df.reindex(columns=[col for col in wallet_columns(METRIC_WINDOWS, GRAPH_FEATURES) if col in df.columns])
+    filename = _wallet_metrics_filename(token_symbol, "csv")
+
+    try:
+        df.to_csv(filename, index=False, date_format='%Y-%m-%d %H:%M:%S', float_format='%.8f')
+        print(f"\nДанные {token_symbol} успешно сохранены в файл: {filename}")
+        print(f"Сохранено {len(df)} строк.")
+        TELEMETRY.add("rows_written", token_symbol, len(df))
+        _print_limit_warning(days_hit_limit)
+        return filename
+    except Exception as e:
+        print(f"\nОшибка при сохранении данных в CSV: {e}")
+        return None
+
+class WalletRowWriter:
+    """
+    Пишет строки кошельков в CSV или Parquet пачками по chunk_size.
+    Файл пишется во временный и переименовывается в close().
+    """
+
+    def __init__(self, path, columns, output_format=OUTPUT_FORMAT, chunk_size=OUTPUT_CHUNK_SIZE):
+        if output_format not in ("csv", "parquet"):
+            raise ValueError(f"Неизвестный формат результата: {output_format}")
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.columns = columns
+        self.output_format = output_format
+        self.chunk_size = chunk_size
+        self.schema = pa.schema([(column, _wallet_column_type(column)) for column in columns])
+        self.chunk = []
+        self.rows = 0
+        self.parquet_writer = None
+
+    def write(self, row):
+        self.chunk.append(row)
+        if len(self.chunk) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.chunk:
+            return
+        df = pd.DataFrame(self.chunk).reindex(columns=self.columns)
+        if self.output_format == "csv":
+            df.to_csv(self.tmp_path, mode="a" if self.rows else "w", header=not self.rows, index=False,
+                      date_format='%Y-%m-%d %H:%M:%S', float_format='%.8f')
+        else:
+            if self.parquet_writer is None:
+                self.parquet_writer = pq.ParquetWriter(self.tmp_path, self.schema)
+            self.parquet_writer.write_table(pa.Table.from_pandas(df, schema=self.schema, preserve_index=False))
+        self.rows += len(self.chunk)
+        self.chunk = []
+
+    def close(self):
+        self.flush()
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+        if self.rows:
+            os.replace(self.tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            if self.parquet_writer is not None:
+                self.parquet_writer.close()
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+        return False
+
+def iter_wallet_rows(contract_address, token_decimals, addresses, balances, start_dt, end_dt, windows=(), store=TRANSFER_STORE,
+                     graph_features=False, backend=METRICS_BACKEND):
+    """
+    Потоковый расчет строк кошельков по партициям хранилища.
+    Строки выдаются по одной, состояние выданного кошелька освобождается.
+    """
+    accumulator = StreamingPeriodMetrics(token_decimals, start_dt, end_dt, store.addresses, windows, backend)
+    graph = CounterpartyGraph(10 ** token_decimals) if graph_features else None
+    for batch in store.iter_batches(contract_address, accumulator.read_start_dt, end_dt, columns=["timestamp", "from_id", "to_id", "value"]):
+        accumulator.update(batch)
+        if graph is not None:
+            graph.add(_transfers_frame(batch, start_dt, end_dt, store.addresses)[0])
+    graph_by_address = graph.features(store.addresses.address) if graph is not None else None
+    graph = None
+
+    for address in addresses:
+        metrics, window_metrics = accumulator.pop(address)
+        yield build_wallet_metrics(address, {address.lower(): metrics} if metrics else {}, token_decimals,
+                                   raw_balance=balances.get(address, 0),
+                                   window_metrics={address.lower(): window_metrics}, windows=windows,
+                                   graph_features=graph_by_address)
+
+def save_wallet_metrics_stream(wallet_rows, token_symbol, days_hit_limit, output_format=OUTPUT_FORMAT):
+    """Записывает строки кошельков из генератора пачками (WalletRowWriter) в CSV или Parquet."""
+    filename = _wallet_metrics_filename(token_symbol, output_format)
+    try:
+        with WalletRowWriter(filename, wallet_columns(METRIC_WINDOWS, GRAPH_FEATURES), output_format) as writer:
+            for row in wallet_rows:
+                writer.write(row)
+    except Exception as e:
+        print(f"\nОшибка при сохранении данных в {output_format}: {e}")
+        return None
+    if not writer.rows:
+        print(f"Нет данных {token_symbol} для сохранения.")
+        return None
+    print(f"\nДанные {token_symbol} успешно сохранены в файл: {filename}")
+    print(f"Сохранено {writer.rows} строк.")
+    TELEMETRY.add("rows_written", token_symbol, writer.rows)
+    _print_limit_warning(days_hit_limit)
+    return filename
+
+def run_tokens(tokens, stream=STREAM_METRICS, output_format=OUTPUT_FORMAT, prometheus_path=PROMETHEUS_TEXTFILE):
+    """
+    Полный анализ нескольких токенов за один запуск: tokens — словарь {символ: адрес контракта}.
+    Результаты сохраняются в отдельный файл на каждый токен, телеметрия — в RUN_REPORT_DIR.
+    """
+    TELEMETRY.reset()
+    if HTTP_CACHE_MODE == "cache":
+        _record_run_end(END_DATE_DT)
+    try:
+        _analyze_tokens(tokens, stream, output_format)
+    finally:
+        report_path = TELEMETRY.write_report(
+            os.path.join(RUN_REPORT_DIR, f"run_{END_DATE_DT.strftime('%Y%m%d_%H%M%S')}.json"),
+            tokens=tokens, days_back=DAYS_BACK, start=START_DATE_DT.isoformat(timespec="seconds"),
+            end=END_DATE_DT.isoformat(timespec="seconds"), stream=stream, metrics_backend=METRICS_BACKEND,
+            cache_mode=HTTP_CACHE_MODE, metric_windows=list(METRIC_WINDOWS), graph_features=GRAPH_FEATURES,
+        )
+        print(f"\nОтчет запуска: {report_path}")
+        if prometheus_path:
+            TELEMETRY.write_prometheus(prometheus_path)
+
+def _analyze_tokens(tokens, stream, output_format):
+    """Фазы run_tokens: параметры токенов, поиск блоков и загрузка, метрики, балансы, экспорт (см. TELEMETRY)."""
+    print("--- Запуск анализа транзакций токенов ERC-20 (по дням) ---")
+    for token_symbol, contract_address in tokens.items():
+        print(f"Токен: {token_symbol} ({contract_address})")
+    print(f"Анализируемый период: последние {DAYS_BACK} дней")
+    print(f"Начало периода: {START_DATE_DT.strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"Конец периода: {END_DATE_DT.strftime('%Y-%m-%d %H:%M:%S')}")
+    if METRIC_WINDOWS:
+        print(f"Дополнительные окна метрик (дней): {', '.join(str(days) for days in sorted(METRIC_WINDOWS))}")
+    print("-" * 60)
+
+    contracts = list(tokens.values())
+    with TELEMETRY.phase("token_info"):
+        token_decimals_by_contract = dict(zip(contracts, CLIENT.map(fetch_token_decimals, contracts)))
+    print("-" * 60)
+
+    # Трансферы сразу пишутся в хранилище; all_transactions — колонки окна
+    # Фазы block_lookup и fetch отмечаются внутри fetch_tokens_async
+    fetched = asyncio.run(fetch_tokens_async(contracts, FETCH_START_DT, END_DATE_DT))
+
+    metrics_by_contract = {}
+    window_metrics_by_contract = {}
+    graph_features_by_contract = {}
+    addresses_by_contract = {}
+    for token_symbol, contract_address in tokens.items():
+        all_transactions, unique_addresses, _ = fetched[contract_address]
+        TELEMETRY.add("transfers", token_symbol, len(all_transactions))
+        if not unique_addresses:
+            print(f"\nНе найдено адресов, взаимодействовавших с токеном {token_symbol} в указанный период.")
+            continue
+        print(f"\nНайдено {len(unique_addresses)} уникальных адресов {token_symbol} для анализа.")
+        addresses_by_contract[contract_address] = unique_addresses # Обрабатываем все найденные адреса
+        if stream:
+            continue # Метрики считаются потоково при записи результата (фаза export)
+        print(f"\n--- Расчет метрик {token_symbol} для {len(unique_addresses)} адресов ---")
+        with TELEMETRY.phase("metrics"):
+            metrics_by_contract[contract_address] = METRICS_BACKENDS[METRICS_BACKEND](
+                all_transactions, token_decimals_by_contract[contract_address], START_DATE_DT, END_DATE_DT
+            )
+            if METRIC_WINDOWS:
+                window_metrics_by_contract[contract_address] = aggregate_window_metrics(
+                    all_transactions, token_decimals_by_contract[contract_address], METRIC_WINDOWS, END_DATE_DT
+                )
+            if GRAPH_FEATURES:
+                graph_features_by_contract[contract_address] = counterparty_graph_features(
+                    all_transactions, token_decimals_by_contract[contract_address], START_DATE_DT, END_DATE_DT
+                )
+
+    if not addresses_by_contract:
+        print("\nНе найдено адресов, взаимодействовавших с токенами в указанный период. Выход.")
+        return
+    print("-" * 60)
+
+    checkpoint = BalanceCheckpoint(contracts)
+    with TELEMETRY.phase("balances"):
+        balances_by_contract = fetch_token_balances(addresses_by_contract, make_balance_provider(), checkpoint=checkpoint)
+
+    for token_symbol, contract_address in tokens.items():
+        if contract_address not in addresses_by_contract:
+            continue
+        token_decimals = token_decimals_by_contract[contract_address]
+        balances = balances_by_contract[contract_address]
+        with TELEMETRY.phase("export"):
+            if stream:
+                print(f"\n--- Потоковый расчет метрик {token_symbol} для {len(addresses_by_contract[contract_address])} адресов ---")
+                wallet_rows = iter_wallet_rows(contract_address, token_decimals, addresses_by_contract[contract_address], balances,
+                                               START_DATE_DT, END_DATE_DT, METRIC_WINDOWS, graph_features=GRAPH_FEATURES)
+                save_wallet_metrics_stream(tqdm(wallet_rows, total=len(addresses_by_contract[contract_address]),
+                                                desc=f"Обработка кошельков {token_symbol}", unit=" кошелек"),
+                                           token_symbol, fetched[contract_address][2], output_format)
+                continue
+            all_wallet_metrics = []
+            for address in tqdm(addresses_by_contract[contract_address], desc=f"Обработка кошельков {token_symbol}", unit=" кошелек"):
+                metrics = build_wallet_metrics(address, metrics_by_contract[contract_address], token_decimals,
+                                               raw_balance=balances.get(address, 0),
+                                               window_metrics=window_metrics_by_contract.get(contract_address), windows=METRIC_WINDOWS,
+                                               graph_features=graph_features_by_contract.get(contract_address))
+                if metrics:
+                     all_wallet_metrics.append(metrics)
+            save_wallet_metrics_csv(all_wallet_metrics, token_symbol, fetched[contract_address][2])
+    checkpoint.clear()
+
+    print("\n--- Завершен расчет метрик ---")
+    print("-" * 60)
+
+def parse_tokens(values):
+    """Аргументы командной строки -> {символ: контракт}: символ из TOKENS или адрес контракта; без аргументов — все TOKENS."""
+    if not values:
+        return dict(TOKENS)
+    tokens = {}
+    for value in values:
+        if value.upper() in TOKENS:
+            tokens[value.upper()] = TOKENS[value.upper()]
+        else:
+            tokens[value.lower()[:10]] = value
+    return tokens
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Метрики кошельков по трансферам токенов ERC-20 за последние дни.")
+    parser.add_argument("tokens", nargs="*", help="символы из TOKENS или адреса контрактов (по умолчанию все TOKENS)")
+    parser.add_argument("--stream", action="store_true", default=STREAM_METRICS,
+                        help="потоковый расчет метрик с записью результата пачками")
+    parser.add_argument("--output-format", choices=["csv", "parquet"], default=OUTPUT_FORMAT,
+                        help="формат результата в потоковом режиме")
+    parser.add_argument("--prometheus", default=PROMETHEUS_TEXTFILE, metavar="PATH",
+                        help="записать метрики запуска в текстовом формате Prometheus")
+    add_profile_arguments(parser, PROFILE_DIR)
+    args = parser.parse_args()
+
+    with ProfileSession.from_args("data_fetch", args):
+        run_tokens(parse_tokens(args.tokens), stream=args.stream, output_format=args.output_format, prometheus_path=args.prometheus)
+
+    print("\n--- Скрипт завершен ---")
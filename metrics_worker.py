@@ -0,0 +1,144 @@
+"""
+Векторная агрегация метрик по трансферам (pandas/NumPy) и процесс режима METRICS_BACKEND = "sharded".
+Импортирует только numpy, pandas и pyarrow: процессы режима "sharded" запускаются как python metrics_worker.py.
+"""
+import pickle
+import sys
+from datetime import datetime, timedelta, time as dt_time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+AMOUNT_LIMBS = ["amount0", "amount1", "amount2", "amount3"] # 32-битные разряды суммы трансфера (младший первым)
+
+
+def _limb_totals(limb_sums):
+    """Суммы разрядов (n, 4) -> точные целые суммы Python; вызывается один раз на агрегат, а не на трансфер."""
+    return [a + (b << 32) + (c << 64) + (d << 96) for a, b, c, d in np.asarray(limb_sums, dtype=np.uint64).tolist()]
+
+
+def _local_day_codes(timestamps):
+    """Номера локальных календарных дней для массива timestamp (как datetime.fromtimestamp(ts).date(), но векторно)."""
+    if len(timestamps) == 0:
+        return np.zeros(0, dtype=np.int64)
+    first_day = datetime.fromtimestamp(int(timestamps.min())).date()
+    last_day = datetime.fromtimestamp(int(timestamps.max())).date()
+    day_starts = [
+        datetime.combine(first_day + timedelta(days=i), dt_time.min).timestamp()
+        for i in range(1, (last_day - first_day).days + 1)
+    ]
+    return np.searchsorted(np.array(day_starts, dtype=np.float64), timestamps, side="right")
+
+
+def _transfer_legs(transfers, sender_legs=None, receiver_legs=None):
+    """
+    Раскладывает трансферы на исходящую ногу отправителя и входящую ногу получателя.
+    sender_legs/receiver_legs — маски трансферов, для которых учитывается нога (по умолчанию все).
+    """
+    transfers = transfers.assign(day=_local_day_codes(transfers["timestamp"].to_numpy()))
+
+    outgoing = transfers if sender_legs is None else transfers[sender_legs]
+    outgoing_legs = pd.DataFrame({
+        "address": outgoing["sender"], "counterparty": outgoing["receiver"],
+        "timestamp": outgoing["timestamp"], "day": outgoing["day"], "incoming": 0, "outgoing": 1,
+        **{limb: outgoing[limb] for limb in AMOUNT_LIMBS},
+    })
+    incoming_mask = transfers["sender"] != transfers["receiver"]
+    if receiver_legs is not None:
+        incoming_mask &= receiver_legs
+    incoming = transfers[incoming_mask]
+    incoming_legs = pd.DataFrame({
+        "address": incoming["receiver"], "counterparty": incoming["sender"],
+        "timestamp": incoming["timestamp"], "day": incoming["day"], "incoming": 1, "outgoing": 0,
+        **{limb: incoming[limb] for limb in AMOUNT_LIMBS},
+    })
+    return pd.concat([outgoing_legs, incoming_legs], ignore_index=True)
+
+
+def _volume_limb_sums(legs, keys):
+    """Суммы разрядов входящих и исходящих объемов по ключам keys: (volume_in, volume_out), DataFrame из uint64."""
+    n_outgoing = int(legs["outgoing"].sum()) # Исходящие ноги идут в legs первыми (см. _transfer_legs)
+    return (legs.iloc[n_outgoing:].groupby(keys)[AMOUNT_LIMBS].sum(),
+            legs.iloc[:n_outgoing].groupby(keys)[AMOUNT_LIMBS].sum())
+
+
+def _aggregate_transfers_frame(transfers, sender_legs=None, receiver_legs=None):
+    """
+    Агрегаты по коду адреса (DataFrame с индексом address) для DataFrame трансферов из _transfers_frame.
+    sender_legs/receiver_legs — как в _transfer_legs.
+    """
+    legs = _transfer_legs(transfers, sender_legs, receiver_legs)
+
+    per_address = legs.groupby("address").agg(
+        tx_count=("timestamp", "size"),
+        incoming_tx_count=("incoming", "sum"),
+        outgoing_tx_count=("outgoing", "sum"),
+        first_ts=("timestamp", "min"),
+        last_ts=("timestamp", "max"),
+        active_days=("day", "nunique"),
+    )
+    counterparty_legs = legs[legs["address"] != legs["counterparty"]]
+    per_address["counterparties"] = counterparty_legs.groupby("address")["counterparty"].nunique()
+    per_address["counterparties"] = per_address["counterparties"].fillna(0).astype(np.int64)
+    # Точные целые объемы: суммы разрядов в целые Python
+    for column, limb_sums in zip(("volume_in", "volume_out"), _volume_limb_sums(legs, ["address"])):
+        limb_sums = limb_sums.reindex(per_address.index, fill_value=0)
+        per_address[column] = pd.Series(_limb_totals(limb_sums.to_numpy()), index=per_address.index, dtype=object)
+    return per_address
+
+
+def _per_address_metrics(per_address, code_to_address, divisor):
+    """Агрегаты _aggregate_transfers_frame -> {адрес: метрики} в схеме aggregate_period_metrics."""
+    metrics_by_address = {}
+    columns = ("tx_count", "incoming_tx_count", "outgoing_tx_count", "volume_in", "volume_out",
+               "counterparties", "first_ts", "last_ts", "active_days")
+    for code, tx_count, incoming_count, outgoing_count, volume_in, volume_out, counterparties, first_ts, last_ts, active_days in zip(
+        per_address.index.tolist(), *(per_address[column].tolist() for column in columns)
+    ):
+        volume_in = int(volume_in) / divisor
+        volume_out = int(volume_out) / divisor
+        metrics_by_address[code_to_address(int(code))] = {
+            "period_total_tx_count": int(tx_count),
+            "period_incoming_tx_count": int(incoming_count),
+            "period_outgoing_tx_count": int(outgoing_count),
+            "period_total_volume_in": volume_in,
+            "period_total_volume_out": volume_out,
+            "period_avg_volume_in": volume_in / incoming_count if incoming_count > 0 else 0.0,
+            "period_avg_volume_out": volume_out / outgoing_count if outgoing_count > 0 else 0.0,
+            "period_unique_counterparties": int(counterparties),
+            "period_first_tx_date": datetime.fromtimestamp(int(first_ts)),
+            "period_last_tx_date": datetime.fromtimestamp(int(last_ts)),
+            "period_active_days": int(active_days),
+        }
+    return metrics_by_address
+
+
+def _address_shards(address_codes, shards):
+    """Номер шарда для кодов адресов (перемешивающий хэш)."""
+    return ((address_codes.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(40)) % np.uint64(shards)
+
+
+def aggregate_shards(transfers_path, addresses_path, shards, worker_shards, divisor):
+    """{адрес: метрики} для адресов шардов worker_shards по файлам aggregate_period_metrics_sharded."""
+    transfers = pa.ipc.open_file(pa.memory_map(transfers_path)).read_all()
+    addresses = pa.ipc.open_file(pa.memory_map(addresses_path)).read_all().column("address")
+    sender_shards = _address_shards(transfers.column("sender").to_numpy(), shards)
+    receiver_shards = _address_shards(transfers.column("receiver").to_numpy(), shards)
+    metrics_by_address = {}
+    for shard in worker_shards:
+        sender_legs = sender_shards == shard
+        receiver_legs = receiver_shards == shard
+        rows = np.flatnonzero(sender_legs | receiver_legs)
+        per_address = _aggregate_transfers_frame(transfers.take(rows).to_pandas(), sender_legs[rows], receiver_legs[rows])
+        names = dict(zip(per_address.index.tolist(), addresses.take(per_address.index.to_numpy()).to_pylist()))
+        metrics_by_address.update(_per_address_metrics(per_address, names.__getitem__, divisor))
+    return metrics_by_address
+
+
+if __name__ == "__main__":
+    # python metrics_worker.py <трансферы> <адреса> <шардов> <шарды процесса> <делитель>
+    transfers_path, addresses_path, shards, worker_shards, divisor = sys.argv[1:]
+    result = aggregate_shards(transfers_path, addresses_path, int(shards),
+                              [int(shard) for shard in worker_shards.split(",")], int(divisor))
+    pickle.dump(result, sys.stdout.buffer, protocol=pickle.HIGHEST_PROTOCOL)
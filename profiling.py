@@ -0,0 +1,210 @@
+"""
+Встроенный режим профилирования (--profile) для скриптов загрузки и кластеризации.
+Сохраняет profile.pstats, hotspots.txt, profile.json и, с --profile-memory, memory.txt.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+PROFILE_DIR = "profiles"
+PROFILE_TOP = 30 # Сколько функций выводить в сводке
+HOT_PATH_DEPTH = 8 # Глубина пути вызова от горячей функции к точке входа
+MEMORY_FRAMES = 1 # Глубина стека tracemalloc: 1 — только строка аллокации
+MEMORY_SAMPLE_INTERVAL = 1.0 # Период опроса памяти, сек
+MEMORY_SNAPSHOT_GROWTH = 1.1 # Новый снимок, если память выросла на 10% относительно предыдущего
+
+
+def add_profile_arguments(parser, default_dir=PROFILE_DIR):
+    """Добавляет в argparse ключи --profile, --profile-dir, --profile-memory и --profile-top."""
+    group = parser.add_argument_group("профилирование")
+    group.add_argument("--profile", action="store_true", help="выполнить под cProfile и сохранить сводку горячих функций")
+    group.add_argument("--profile-dir", default=default_dir, help="каталог для результатов профилирования")
+    group.add_argument("--profile-memory", action="store_true",
+                       help="дополнительно отслеживать аллокации через tracemalloc (замедляет выполнение)")
+    group.add_argument("--profile-top", type=int, default=PROFILE_TOP, help="сколько функций выводить в сводке")
+    return parser
+
+
+def _function_label(func):
+    """(файл, строка, имя) из pstats -> короткая подпись 'файл:строка(имя)'."""
+    filename, line, name = func
+    if filename == "~":
+        return name # Встроенные функции: '<built-in method ...>'
+    return f"{os.path.basename(filename)}:{line}({name})"
+
+
+class ProfileSession:
+    """
+    Профилирование части скрипта между start() и stop() (или в блоке with).
+    При enabled=False ничего не делает, поэтому вызывающий код не ветвится по флагу --profile.
+    """
+
+    def __init__(self, name, enabled=True, profile_dir=PROFILE_DIR, trace_memory=False, top=PROFILE_TOP):
+        self.name = name
+        self.enabled = enabled
+        self.profile_dir = profile_dir
+        self.trace_memory = trace_memory
+        self.top = top
+        self.run_dir = None
+        self.profiler = None
+        self.thread_profilers = []
+        self.lock = threading.Lock()
+        self.started = None
+        self.memory_snapshot = None
+        self.memory_snapshot_at = None
+        self.memory_sampler = None
+        self.memory_stop = threading.Event()
+
+    @classmethod
+    def from_args(cls, name, args):
+        return cls(name, enabled=args.profile, profile_dir=args.profile_dir, trace_memory=args.profile_memory,
+                   top=args.profile_top)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def _profile_thread(self, frame, event, arg):
+        # Первое событие нового потока: включаем профилировщик потока
+        profiler = cProfile.Profile()
+        with self.lock:
+            self.thread_profilers.append(profiler)
+        profiler.enable()
+
+    def start(self):
+        if not self.enabled or self.profiler is not None:
+            return self
+        self.run_dir = os.path.join(self.profile_dir, f"{self.name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        os.makedirs(self.run_dir, exist_ok=True)
+        self.started = time.perf_counter()
+        if self.trace_memory:
+            tracemalloc.start(MEMORY_FRAMES)
+            self.memory_stop.clear()
+            self.memory_sampler = threading.Thread(target=self._sample_memory, daemon=True) # До setprofile: не профилируется
+            self.memory_sampler.start()
+        if sys.version_info < (3, 12):
+            threading.setprofile(self._profile_thread)
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+        return self
+
+    def stop(self):
+        """Останавливает профилирование и сохраняет результаты; повторный вызов ничего не делает."""
+        if self.profiler is None:
+            return None
+        self.profiler.disable()
+        wall_seconds = time.perf_counter() - self.started
+        if sys.version_info < (3, 12):
+            threading.setprofile(None)
+        memory = self._memory_report() if self.trace_memory else None
+
+        stats = pstats.Stats(self.profiler)
+        with self.lock:
+            for profiler in self.thread_profilers:
+                stats.add(profiler)
+        stats.dump_stats(os.path.join(self.run_dir, "profile.pstats"))
+        hotspots = self._hotspots(stats)
+        with open(os.path.join(self.run_dir, "hotspots.txt"), "w", encoding="utf-8") as f:
+            f.write(self._hotspots_text(stats, hotspots, wall_seconds))
+        with open(os.path.join(self.run_dir, "profile.json"), "w", encoding="utf-8") as f:
+            json.dump({"name": self.name, "argv": sys.argv, "python": sys.version.split()[0], "wall_seconds": wall_seconds,
+                       "threads_profiled": len(self.thread_profilers) + 1, "functions": hotspots, "memory": memory},
+                      f, ensure_ascii=False, indent=2)
+
+        print(f"\n--- Профиль {self.name}: {wall_seconds:.2f} сек, результаты в {self.run_dir} ---")
+        for index, hotspot in enumerate(hotspots[:10], 1):
+            print(f"{index:>3}. {hotspot['own_seconds']:>9.3f} сек собств. {hotspot['cumulative_seconds']:>9.3f} сек всего  "
+                  f"{hotspot['function']}")
+        if memory:
+            print(f"Пик памяти Python (tracemalloc): {memory['peak_mb']:.1f} МБ")
+        self.profiler = None
+        return self.run_dir
+
+    def _hot_path(self, stats, func):
+        """Путь от func к точке входа: на каждом шаге — вызывающая функция с наибольшим суммарным временем."""
+        path = []
+        seen = {func}
+        while len(path) < HOT_PATH_DEPTH:
+            callers = stats.stats[func][4]
+            candidates = [(values[3], caller) for caller, values in callers.items() if caller not in seen]
+            if not candidates:
+                break
+            func = max(candidates)[1]
+            seen.add(func)
+            path.append(_function_label(func))
+        return path
+
+    def _hotspots(self, stats):
+        """Функции по убыванию собственного времени с числом вызовов, суммарным временем и горячим путем."""
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:self.top]
+        return [{
+            "function": _function_label(func), "file": func[0], "line": func[1], "name": func[2],
+            "calls": calls, "primitive_calls": primitive_calls, "own_seconds": own, "cumulative_seconds": cumulative,
+            "own_per_call_us": own / calls * 1e6 if calls else 0.0, "hot_path": self._hot_path(stats, func),
+        } for func, (primitive_calls, calls, own, cumulative, _) in rows]
+
+    def _hotspots_text(self, stats, hotspots, wall_seconds):
+        lines = [f"Профиль {self.name}: {wall_seconds:.3f} сек, потоков: {len(self.thread_profilers) + 1}",
+                 f"Аргументы: {' '.join(sys.argv)}", "",
+                 f"Топ-{self.top} по собственному времени (путь: кто вызывает функцию чаще всего по времени)",
+                 "Время потоков суммируется: ожидание в recv_into, lock.acquire, queue.get — простой, а не работа CPU.",
+                 f"{'собств., с':>11} {'всего, с':>10} {'вызовов':>10} {'мкс/вызов':>10}  функция"]
+        for hotspot in hotspots:
+            lines.append(f"{hotspot['own_seconds']:>11.3f} {hotspot['cumulative_seconds']:>10.3f} {hotspot['calls']:>10} "
+                         f"{hotspot['own_per_call_us']:>10.2f}  {hotspot['function']}")
+            if hotspot["hot_path"]:
+                lines.append(f"{'':>46}<- " + " <- ".join(hotspot["hot_path"]))
+        buffer = io.StringIO()
+        stats.stream = buffer
+        stats.sort_stats("cumulative").print_stats(self.top)
+        lines += ["", f"Топ-{self.top} по суммарному времени (pstats)", buffer.getvalue()]
+        return "\n".join(lines)
+
+    def _take_snapshot(self):
+        """Снимок tracemalloc, если память выросла относительно предыдущего снимка (или снимка еще нет)."""
+        current = tracemalloc.get_traced_memory()[0]
+        if self.memory_snapshot is not None and current < self.memory_snapshot[1] * MEMORY_SNAPSHOT_GROWTH:
+            return
+        self.memory_snapshot = (tracemalloc.take_snapshot(), current)
+        self.memory_snapshot_at = time.perf_counter() - self.started
+
+    def _sample_memory(self):
+        while not self.memory_stop.wait(MEMORY_SAMPLE_INTERVAL):
+            self._take_snapshot()
+
+    def _memory_report(self):
+        """Места наибольших аллокаций по снимку вблизи пика, текущая и пиковая память Python."""
+        self.memory_stop.set()
+        self.memory_sampler.join()
+        self._take_snapshot()
+        snapshot, snapshot_bytes = self.memory_snapshot
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.memory_snapshot = None
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ])
+        top = snapshot.statistics("lineno")[:self.top]
+        lines = [f"Память Python (tracemalloc): при остановке {current / 2 ** 20:.1f} МБ, пик {peak / 2 ** 20:.1f} МБ", "",
+                 f"Топ-{self.top} мест аллокаций по снимку на {self.memory_snapshot_at:.1f} сек "
+                 f"({snapshot_bytes / 2 ** 20:.1f} МБ); память вне Python (Arrow, numpy) tracemalloc не видит",
+                 f"{'МБ':>9} {'блоков':>10}  место"]
+        allocations = []
+        for stat in top:
+            frame = stat.traceback[0]
+            allocations.append({"file": frame.filename, "line": frame.lineno, "mb": stat.size / 2 ** 20, "blocks": stat.count})
+            lines.append(f"{stat.size / 2 ** 20:>9.2f} {stat.count:>10}  {os.path.basename(frame.filename)}:{frame.lineno}")
+        with open(os.path.join(self.run_dir, "memory.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        return {"current_mb": current / 2 ** 20, "peak_mb": peak / 2 ** 20, "snapshot_seconds": self.memory_snapshot_at,
+                "snapshot_mb": snapshot_bytes / 2 ** 20, "allocations": allocations}